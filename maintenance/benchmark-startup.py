@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+Measure the startup time of grond subcommands.
+
+Each command is run several times in a fresh interpreter and the minimum and
+median wall clock times are reported. With --importtime, the modules which
+take longest to import are listed for each command.
+
+Example::
+
+    python maintenance/benchmark-startup.py \\
+        'version --short' 'events config/regional_cmt.gronf'
+'''
+
+from __future__ import print_function
+
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+
+def run(args):
+    t0 = time.time()
+    proc = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    _, stderr = proc.communicate()
+    return time.time() - t0, stderr.decode('utf-8', 'replace')
+
+
+def importtime_top(stderr, n):
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        try:
+            entries.append((int(fields[1]), fields[2].strip()))
+        except (IndexError, ValueError):
+            pass
+
+    entries.sort(reverse=True)
+    return entries[:n]
+
+
+def main():
+    parser = OptionParser(
+        usage='%prog [options] <command> ...',
+        description='Benchmark startup time of grond subcommands.')
+
+    parser.add_option(
+        '--repeat', dest='repeat', type=int, default=5,
+        help='number of runs per command (default: %default)')
+    parser.add_option(
+        '--importtime', dest='importtime', type=int, default=0, metavar='N',
+        help='list the N slowest imports of each command')
+
+    options, commands = parser.parse_args()
+    if not commands:
+        commands = ['version --short', '--help']
+
+    for command in commands:
+        args = [sys.executable, '-m', 'grond.apps.grond'] + command.split()
+        times = sorted(run(args)[0] for _ in range(options.repeat))
+        print('%-40s min %6.3f s  median %6.3f s' % (
+            command, times[0], times[len(times) // 2]))
+
+        if options.importtime:
+            _, stderr = run(args[:1] + ['-X', 'importtime'] + args[1:])
+            for cumulative_us, name in importtime_top(
+                    stderr, options.importtime):
+
+                print('    %8.3f s  %s' % (cumulative_us * 1e-6, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,90 @@
-from .core import *  # noqa
-from .config import *  # noqa
-from .dataset import *  # noqa
-from .problems import *  # noqa
-from .targets import *  # noqa
-from .meta import *  # noqa
-from .synthetic_tests import *  # noqa
-from .optimisers import *  # noqa
-from .clustering import *  # noqa
-from .environment import *  # noqa
+'''
+Grond's public API is available in the top-level namespace, e.g.
+``grond.read_config``.
+
+The submodules providing it are imported on first attribute access, so that
+``import grond`` and quick command line tools do not pay for importing all
+problem, target and optimiser modules and their Pyrocko dependencies.
+'''
+
+import sys
+import importlib
+
 from .version import __version__  # noqa
+
+# modules providing the top-level namespace, searched in this order
+_api_modules = [
+    'meta',
+    'config',
+    'dataset',
+    'problems',
+    'targets',
+    'optimisers',
+    'synthetic_tests',
+    'clustering',
+    'environment',
+    'core']
+
+
+def _public_names(module):
+    names = getattr(module, '__all__', None)
+    if names is None:
+        names = [name for name in vars(module) if not name.startswith('_')]
+
+    return names
+
+
+def _api_names():
+    '''
+    Public names of the top-level namespace, imports all API modules.
+    '''
+
+    names = []
+    seen = set()
+    for module_name in _api_modules:
+        module = importlib.import_module('.' + module_name, __name__)
+        for name in _public_names(module):
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+
+    return names
+
+
+if sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562), import everything
+    for _module_name in reversed(_api_modules):
+        _module = importlib.import_module('.' + _module_name, __name__)
+        for _name in _public_names(_module):
+            globals()[_name] = getattr(_module, _name)
+
+    __all__ = _api_names()
+
+else:
+    import importlib.util
+
+    def __getattr__(name):
+        if name == '__all__':
+            # for ``from grond import *``, the names are then resolved
+            # one by one through this function
+            names = globals()['__all__'] = _api_names()
+            return names
+
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        if importlib.util.find_spec(__name__ + '.' + name) is not None:
+            return importlib.import_module('.' + name, __name__)
+
+        for module_name in _api_modules:
+            module = importlib.import_module('.' + module_name, __name__)
+            if name in _public_names(module):
+                value = getattr(module, name)
+                globals()[name] = value
+                return value
+
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_api_names()))
@@ -1,12 +1,96 @@
-from pyrocko.guts import Object
+import os
+import copy
+import time
+import uuid
+import hashlib
+import logging
+import os.path as op
+
+import numpy as num
+
+from pyrocko import guts, util
+from pyrocko.guts import Object, String, Float, List
 
 from grond.meta import GrondError
 
 guts_prefix = 'grond'
+logger = logging.getLogger('grond.analysers.base')
+
+
+def fingerprint(*args):
+    '''
+    Digest of analyser inputs.
+
+    Guts objects are hashed through their YAML representation, arrays
+    through their data, everything else through its ``repr``.
+    '''
+
+    h = hashlib.sha1()
+    for arg in args:
+        if isinstance(arg, Object):
+            h.update(arg.dump().encode('utf-8'))
+        elif isinstance(arg, num.ndarray):
+            h.update(repr((arg.dtype.str, arg.shape)).encode('utf-8'))
+            h.update(num.ascontiguousarray(arg).tobytes())
+        elif isinstance(arg, (list, tuple)):
+            h.update(fingerprint(*arg).encode('ascii'))
+        else:
+            h.update(repr(arg).encode('utf-8'))
+
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+def target_fingerprint_args(engine, targets):
+    '''
+    Get the inputs defining a set of targets for :py:func:`fingerprint`.
+
+    Analyser results and manual weights of the targets are ignored, the
+    configurations of the GF stores used are included.
+    '''
+
+    args = []
+    store_ids = set()
+    for target in targets:
+        target = copy.copy(target)
+        target.analyser_results = {}
+        target.manual_weight = 1.0
+        args.append(target)
+        store_ids.add(target.store_id)
+
+    for store_id in sorted(store_ids):
+        args.append(engine.get_store_config(store_id))
+
+    return args
 
 
 class Analyser(object):
 
+    def __init__(self):
+        self.cache = None
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def get_cached_results(self, name, fingerprint, targets):
+        if self.cache is None:
+            return None
+
+        results = self.cache.get(name, fingerprint, targets)
+        if results is not None:
+            logger.info(
+                'Using cached results of analyser "%s" (%s).' % (
+                    name, fingerprint))
+
+        return results
+
+    def put_cached_results(self, name, fingerprint, targets, results):
+        if self.cache is None:
+            return
+
+        self.cache.put(name, fingerprint, targets, results)
+
     def analyse(self, problem, ds):
         pass
 
@@ -25,7 +109,73 @@ class AnalyserResult(Object):
     pass
 
 
+class AnalyserCacheEntry(Object):
+    analyser = String.T()
+    fingerprint = String.T()
+    time_created = Float.T()
+    target_ids = List.T(String.T())
+    results = List.T(AnalyserResult.T())
+
+
+class AnalyserCache(object):
+    '''
+    Persistent store of analyser results, keyed by a fingerprint of the
+    analyser inputs.
+
+    :param path: cache directory, entries are stored as
+        ``<path>/<analyser>/<fingerprint>.yaml``
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def entry_path(self, analyser, fingerprint):
+        return op.join(self.path, analyser, fingerprint + '.yaml')
+
+    def get(self, analyser, fingerprint, targets):
+        '''
+        Get cached results.
+
+        :returns: list of results, one for each target, or ``None`` if there
+            is no matching entry
+        '''
+
+        fn = self.entry_path(analyser, fingerprint)
+        if not op.exists(fn):
+            return None
+
+        try:
+            entry = guts.load(filename=fn)
+        except Exception as e:
+            logger.warning(
+                'Ignoring unreadable analyser cache entry "%s": %s' % (fn, e))
+            return None
+
+        if not isinstance(entry, AnalyserCacheEntry) \
+                or entry.target_ids != [t.string_id() for t in targets] \
+                or len(entry.results) != len(targets):
+            return None
+
+        return entry.results
+
+    def put(self, analyser, fingerprint, targets, results):
+        fn = self.entry_path(analyser, fingerprint)
+        util.ensuredirs(fn)
+        entry = AnalyserCacheEntry(
+            analyser=analyser,
+            fingerprint=fingerprint,
+            time_created=time.time(),
+            target_ids=[t.string_id() for t in targets],
+            results=list(results))
+
+        tmp_fn = fn + '.%s.tmp' % uuid.uuid4().hex
+        guts.dump(entry, filename=tmp_fn)
+        os.rename(tmp_fn, fn)
+
+
 __all__ = '''
     Analyser
     AnalyserConfig
+    AnalyserCache
+    AnalyserCacheEntry
 '''.split()
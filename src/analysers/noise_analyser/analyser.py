@@ -1,12 +1,14 @@
-
-from pyrocko.client import catalog
-
+import os
 import logging
+import warnings
 import numpy as num
+from pyrocko import model, orthodrome
 from pyrocko.guts import Int, Bool, Float, String, StringChoice
 from pyrocko.gf.meta import OutOfBounds
-from ..base import Analyser, AnalyserConfig, AnalyserResult
+from ..base import Analyser, AnalyserConfig, AnalyserResult, \
+    fingerprint, target_fingerprint_args
 from grond.dataset import NotFound
+from grond.meta import Path, HasPaths
 from grond import meta
 
 logger = logging.getLogger('grond.analysers.NoiseAnalyser')
@@ -41,9 +43,166 @@ def get_phase_arrival_time(engine, source, target, wavename):
     return store.t(wavename, (depth, dist)) + source.time
 
 
+class EventCatalogIndex(object):
+    '''
+    Earthquake catalogue, indexed by time.
+
+    Events in a time span are found by binary search over the sorted event
+    times. Optionally, they are prefiltered by their distance to a location.
+
+    :param events: list of :py:class:`pyrocko.model.Event` objects
+    '''
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda ev: ev.time)
+        self.times = num.array(
+            [ev.time for ev in self.events], dtype=num.float)
+
+        latlons = num.array(
+            [ev.effective_latlon for ev in self.events],
+            dtype=num.float).reshape((-1, 2))
+
+        self.lats = latlons[:, 0]
+        self.lons = latlons[:, 1]
+        self.magnitudes = num.array(
+            [ev.magnitude if ev.magnitude is not None else num.nan
+             for ev in self.events], dtype=num.float)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load catalogue from a file in Pyrocko's event format.
+        '''
+        return cls(model.load_events(filename))
+
+    @classmethod
+    def query_global_cmt(cls, time_range, magmin=None):
+        '''
+        Query the online GlobalCMT catalogue.
+        '''
+        from pyrocko.client import catalog
+
+        return cls(catalog.GlobalCMT().get_events(
+            time_range=time_range, magmin=magmin))
+
+    def __len__(self):
+        return len(self.events)
+
+    def get_indices(self, tmin, tmax, magmin=None):
+        i0 = num.searchsorted(self.times, tmin, side='left')
+        i1 = num.searchsorted(self.times, tmax, side='right')
+        indices = num.arange(i0, i1)
+        if magmin is not None:
+            indices = indices[self.magnitudes[indices] >= magmin]
+
+        return indices
+
+    def get_events(self, tmin, tmax, magmin=None, location=None,
+                   distance_max=None):
+        '''
+        Get events in a time span.
+
+        :param tmin: start of time span
+        :param tmax: end of time span
+        :param magmin: minimum magnitude, events without magnitude are
+            excluded if given
+        :param location: :py:class:`pyrocko.gf.Location`, reference for the
+            distance prefilter
+        :param distance_max: maximum epicentral distance to ``location`` [m]
+        '''
+
+        indices = self.get_indices(tmin, tmax, magmin)
+        if location is not None and distance_max is not None \
+                and indices.size != 0:
+
+            lat, lon = location.effective_latlon
+            dists = orthodrome.distance_accurate50m_numpy(
+                self.lats[indices], self.lons[indices], lat, lon)
+
+            indices = indices[dists <= distance_max]
+
+        return [self.events[i] for i in indices]
+
+
+def stack_traces(traces):
+    '''
+    Stack trace samples into a 2-D array, padded with NaN.
+
+    Rows of missing traces (``None``) are all NaN.
+    '''
+
+    nsamples = max(
+        [tr.ydata.size for tr in traces if tr is not None] or [0])
+
+    data = num.full((len(traces), nsamples), num.nan)
+    for i, tr in enumerate(traces):
+        if tr is not None:
+            data[i, :tr.ydata.size] = tr.ydata
+
+    return data
+
+
+def windowed_variance(data, nwindows=1, statistic='mean'):
+    '''
+    Variance of the rows of a 2-D array, optionally in sub-windows.
+
+    :param data: 2-D array, one row per trace, NaN samples are ignored
+    :param nwindows: number of equal-length sub-windows per row, trailing
+        samples not filling a window are dropped
+    :param statistic: ``'mean'`` or ``'median'``, how the variances of the
+        sub-windows are combined
+    :returns: 1-D array with one variance per row, NaN for rows without
+        samples
+    '''
+
+    ntraces, nsamples = data.shape
+    var = num.full(ntraces, num.nan)
+    ok = num.any(num.isfinite(data), axis=1)
+    if not num.any(ok):
+        return var
+
+    data = data[ok]
+    if nwindows <= 1:
+        var[ok] = num.nanvar(data, axis=1)
+        return var
+
+    nwin = nsamples // nwindows
+    windows = data[:, :nwin*nwindows].reshape((data.shape[0], nwindows, nwin))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        wvar = num.nanvar(windows, axis=2)
+        if statistic == 'mean':
+            var[ok] = num.nanmean(wvar, axis=1)
+        elif statistic == 'median':
+            var[ok] = num.nanmedian(wvar, axis=1)
+        else:
+            assert False, 'invalid statistic argument'
+
+    return var
+
+
+g_catalog_indices = {}
+
+
+def get_catalog_index(filename):
+    '''
+    Get indexed catalogue from file, cached per process.
+    '''
+
+    key = (filename, os.stat(filename).st_mtime)
+    if key not in g_catalog_indices:
+        g_catalog_indices[key] = EventCatalogIndex.load(filename)
+        logger.info(
+            'Loaded %i events from catalogue file "%s".' % (
+                len(g_catalog_indices[key]), filename))
+
+    return g_catalog_indices[key]
+
+
 def seismic_noise_variance(traces, engine, event, targets,
                            nwindows, pre_event_noise_duration,
-                           check_events, phase_def):
+                           check_events, phase_def, catalog_index=None,
+                           arrival_times=None, window_statistic='mean'):
     """
     Calculate variance of noise in a given time before P-Phase onset.
 
@@ -70,33 +229,57 @@ def seismic_noise_variance(traces, engine, event, targets,
     arrivals : list
         of :class'pyrocko.gf.Timing' arrivals of waveforms
         at station
+    catalog_index : :class:`EventCatalogIndex`
+        catalogue used to check for interfering events, if not given, the
+        GlobalCMT catalogue is queried online
+    arrival_times : list
+        of precomputed phase arrival times, one for each target, ``None``
+        for missing traces
+    window_statistic : string
+        how the variances of the sub-windows are combined, ``'mean'`` or
+        ``'median'``
 
     Returns
     -------
     :class:`numpy.ndarray`
     """
 
-    var_ds = []
-    global_cmt_catalog = catalog.GlobalCMT()
-    var_ds = []
+    if arrival_times is None:
+        arrival_times = []
+        for tr, target in zip(traces, targets):
+            if tr is None:
+                arrival_times.append(None)
+            else:
+                arrival_times.append(get_phase_arrival_time(
+                    engine=engine, source=event,
+                    target=target, wavename=phase_def))
+
+    tcheck = 50.*60.
+    if check_events and catalog_index is None:
+        tarrivals = [t for t in arrival_times if t is not None]
+        if tarrivals:
+            catalog_index = EventCatalogIndex.query_global_cmt(
+                time_range=(
+                    min(tarrivals) - pre_event_noise_duration - tcheck,
+                    max(tarrivals)),
+                magmin=5.)
+
     ev_ws = []
-    for tr, target in zip(traces, targets):
+    for tr, target, arrival_time in zip(traces, targets, arrival_times):
         stat_w = 1.
 
         if tr is None:
-            var_ds.append(num.nan)
             ev_ws.append(num.nan)
         else:
-
-            arrival_time = get_phase_arrival_time(
-                engine=engine, source=event,
-                target=target, wavename=phase_def)
             if check_events:
-                events = global_cmt_catalog.get_events(
-                    time_range=(
-                        arrival_time-pre_event_noise_duration-50.*60.,
-                        arrival_time),
-                    magmin=5.,)
+                store = engine.get_store(target.store_id)
+                events = catalog_index.get_events(
+                    tmin=arrival_time-pre_event_noise_duration-tcheck,
+                    tmax=arrival_time,
+                    magmin=5.,
+                    location=target,
+                    distance_max=store.config.distance_max)
+
                 for ev in events:
                     try:
                         arrival_time_pre = get_phase_arrival_time(
@@ -128,23 +311,9 @@ def seismic_noise_variance(traces, engine, event, targets,
                         pass
             ev_ws.append(stat_w)
 
-            if nwindows == 1:
-                vtrace_var = num.nanvar(tr.ydata)
-                var_ds.append(vtrace_var)
-            else:
-                win = arrival_time - (arrival_time -
-                                      pre_event_noise_duration)
-                win_len = win/nwindows
-                v_traces_w = []
-                for i in range(0, nwindows):
-                    vtrace_w = tr.chop(
-                        tmin=win+win_len*i,
-                        tmax=arrival_time+win_len*i+1,
-                        inplace=False)
-                    v_traces_w.append(vtrace_w.ydata)
-                v_traces_w = num.nanmean(v_traces_w)
-                var_ds.append(v_traces_w)
-    var_ds = num.array(var_ds, dtype=num.float)
+    var_ds = windowed_variance(
+        stack_traces(traces), nwindows, window_statistic)
+
     ev_ws = num.array(ev_ws, dtype=num.float)
     return var_ds, ev_ws
 
@@ -169,16 +338,122 @@ class NoiseAnalyser(Analyser):
     '''
 
     def __init__(self, nwindows, pre_event_noise_duration,
-                 check_events, phase_def, statistic, mode, cutoff):
+                 check_events, phase_def, statistic, mode, cutoff,
+                 catalog_path=None, window_statistic='mean'):
         Analyser.__init__(self)
         self.nwindows = nwindows
         self.pre_event_noise_duration = pre_event_noise_duration
         self.check_events = check_events
+        self.catalog_path = catalog_path
+        self.window_statistic = window_statistic
         self.phase_def = phase_def
         self.statistic = statistic
         self.mode = mode
         self.cutoff = cutoff
 
+    def get_fingerprint(self, problem, ds):
+        '''
+        Digest of the inputs the noise weights depend on.
+
+        These are the event, the targets, the GF stores, the settings of the
+        analyser and the waveform files of the dataset with their
+        modification times.
+        '''
+
+        event = ds.get_event()
+        files = sorted(
+            (f.abspath, f.mtime) for f in ds.pile.iter_files())
+
+        return fingerprint(
+            'noise',
+            (event.time, event.lat, event.lon, event.north_shift,
+             event.east_shift, event.depth),
+            target_fingerprint_args(
+                problem.get_engine(), problem.waveform_targets),
+            self.nwindows, self.pre_event_noise_duration, self.check_events,
+            self.phase_def, self.statistic, self.mode, self.cutoff,
+            self.window_statistic, self.get_catalog_fingerprint(), files)
+
+    def get_catalog_fingerprint(self):
+        if not self.check_events:
+            return None
+
+        if self.catalog_path is None:
+            return 'GlobalCMT'
+
+        return (self.catalog_path, os.stat(self.catalog_path).st_mtime)
+
+    def get_catalog_index(self):
+        if not self.check_events or self.catalog_path is None:
+            return None
+
+        return get_catalog_index(self.catalog_path)
+
+    def get_pre_event_traces(self, engine, event, ds, targets):
+        '''
+        Get the pre-event noise traces of all targets.
+
+        Requests are set up for all targets first and are then fetched from
+        the dataset one after the other, as the dataset's waveform access
+        and caches are not thread-safe.
+
+        :returns: list of traces and list of phase arrival times, ``None``
+            for targets without data
+        '''
+
+        tdur = self.pre_event_noise_duration
+
+        deltat = None
+        for target in targets:  # deltat diff check?
+            store = engine.get_store(target.store_id)
+            deltat = store.config.deltat
+
+        requests = []
+        arrival_times = []
+        for target in targets:
+            try:
+                freqlimits = tuple(target.get_freqlimits())
+                tfade = 1./freqlimits[0]
+                arrival_time = get_phase_arrival_time(
+                    engine=engine, source=event,
+                    target=target, wavename=self.phase_def)
+
+                requests.append(dict(
+                    obj=target.codes,
+                    tmin=arrival_time-tdur-tfade,
+                    tmax=arrival_time-tfade,
+                    tfade=tfade,
+                    freqlimits=freqlimits,
+                    deltat=deltat,
+                    backazimuth=target.get_backazimuth_for_waveform(),
+                    tinc_cache=1./freqlimits[0],
+                    debug=False))
+
+                arrival_times.append(arrival_time)
+
+            except OutOfBounds as e:
+                logger.debug(str(e))
+                requests.append(None)
+                arrival_times.append(None)
+
+        def get_waveform(request):
+            if request is None:
+                return None
+
+            try:
+                return ds.get_waveform(**request)
+            except (NotFound, OutOfBounds) as e:
+                logger.debug(str(e))
+                return None
+
+        traces = [get_waveform(request) for request in requests]
+
+        arrival_times = [
+            t if tr is not None else None
+            for (t, tr) in zip(arrival_times, traces)]
+
+        return traces, arrival_times
+
     def analyse(self, problem, ds):
 
         tdur = self.pre_event_noise_duration
@@ -189,41 +464,30 @@ class NoiseAnalyser(Analyser):
         if not problem.has_waveforms:
             return
 
-        traces = []
+        fp = None
+        if self.cache is not None:
+            fp = self.get_fingerprint(problem, ds)
+            results = self.get_cached_results(
+                'noise', fp, problem.waveform_targets)
+
+            if results is not None:
+                for result, target in zip(results, problem.waveform_targets):
+                    target.analyser_results['noise'] = result
+
+                return
+
         engine = problem.get_engine()
         event = ds.get_event()
-        for target in problem.waveform_targets:  # deltat diff check?
-                store = engine.get_store(target.store_id)
-                deltat = store.config.deltat
-        for target in problem.waveform_targets:
-                try:
-                    freqlimits = list(target.get_freqlimits())
-                    freqlimits = tuple(freqlimits)
-                    tfade = 1./freqlimits[0]
-                    arrival_time = get_phase_arrival_time(
-                        engine=engine, source=event,
-                        target=target, wavename=self.phase_def)
-                    traces.append(
-                        ds.get_waveform(
-                            target.codes,
-                            tmin=arrival_time-tdur-tfade,
-                            tmax=arrival_time-tfade,
-                            tfade=tfade,
-                            freqlimits=freqlimits,
-                            deltat=deltat,
-                            backazimuth=target.
-                            get_backazimuth_for_waveform(),
-                            tinc_cache=1./freqlimits[0],
-                            debug=False))
-
-                except (NotFound, OutOfBounds) as e:
-                    logger.debug(str(e))
-                    traces.append(None)
+        traces, arrival_times = self.get_pre_event_traces(
+            engine, event, ds, problem.waveform_targets)
 
         var_ds, ev_ws = seismic_noise_variance(
             traces, engine, event, problem.waveform_targets,
             self.nwindows, tdur,
-            self.check_events, self.phase_def)
+            self.check_events, self.phase_def,
+            catalog_index=self.get_catalog_index(),
+            arrival_times=arrival_times,
+            window_statistic=self.window_statistic)
 
         if self.statistic == 'var':
             noise = var_ds
@@ -267,9 +531,15 @@ class NoiseAnalyser(Analyser):
                     num.sqrt(var_ds[itarget]), ev_ws[itarget],
                     weights[itarget]))
 
-        for weight, target in zip(weights, problem.waveform_targets):
-            target.analyser_results['noise'] = \
-                NoiseAnalyserResult(weight=float(weight))
+        results = [
+            NoiseAnalyserResult(weight=float(weight)) for weight in weights]
+
+        for result, target in zip(results, problem.waveform_targets):
+            target.analyser_results['noise'] = result
+
+        if fp is not None:
+            self.put_cached_results(
+                'noise', fp, problem.waveform_targets, results)
 
 
 class NoiseAnalyserResult(AnalyserResult):
@@ -279,7 +549,7 @@ class NoiseAnalyserResult(AnalyserResult):
              'arrivals, the weight can be zero for contaminated traces.')
 
 
-class NoiseAnalyserConfig(AnalyserConfig):
+class NoiseAnalyserConfig(AnalyserConfig, HasPaths):
     """Configuration parameters for the pre-event noise analysis."""
 
     nwindows = Int.T(
@@ -300,6 +570,18 @@ class NoiseAnalyserConfig(AnalyserConfig):
              ' that produce phase arrivals'
              ' contaminating and affecting the noise analysis')
 
+    catalog_path = Path.T(
+        optional=True,
+        help='Local earthquake catalogue file in Pyrocko\'s event format to '
+             'use for check_events instead of querying the GlobalCMT '
+             'online')
+
+    window_statistic = StringChoice.T(
+        choices=('mean', 'median'),
+        default='mean',
+        help='How the noise variances of the windows are combined, if '
+             'nwindows is larger than 1.')
+
     statistic = StringChoice.T(
         choices=('var', 'std'),
         default='var',
@@ -323,10 +605,14 @@ class NoiseAnalyserConfig(AnalyserConfig):
             nwindows=self.nwindows,
             pre_event_noise_duration=self.pre_event_noise_duration,
             check_events=self.check_events, phase_def=self.phase_def,
-            statistic=self.statistic, mode=self.mode, cutoff=self.cutoff)
+            statistic=self.statistic, mode=self.mode, cutoff=self.cutoff,
+            catalog_path=self.expand_path(self.catalog_path)
+            if self.catalog_path is not None else None,
+            window_statistic=self.window_statistic)
 
 
 __all__ = '''
+    EventCatalogIndex
     NoiseAnalyser
     NoiseAnalyserConfig
 '''.split()
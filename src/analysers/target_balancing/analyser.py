@@ -1,12 +1,14 @@
 import copy
 import time
 import logging
+import multiprocessing
 import numpy as num
 from pyrocko.guts import Int, Float
+from pyrocko.gf.meta import OutOfBounds
 
-from grond.meta import Forbidden
-
-from ..base import Analyser, AnalyserConfig, AnalyserResult
+from ..base import Analyser, AnalyserConfig, AnalyserResult, \
+    fingerprint, target_fingerprint_args
+from grond.dataset import NotFound
 
 logger = logging.getLogger('grond.analysers.target_balancer')
 
@@ -29,9 +31,13 @@ class TargetBalancingAnalyser(Analyser):
      described as adaptive station weighting in Heimann (2011).
      """
 
-    def __init__(self, niter):
+    def __init__(self, niter, nworkers=1, nbatch=50,
+                 convergence_tolerance=None):
         Analyser.__init__(self)
         self.niter = niter
+        self.nworkers = nworkers
+        self.nbatch = nbatch
+        self.convergence_tolerance = convergence_tolerance
 
     def log_progress(self, problem, iiter, niter):
         t = time.time()
@@ -46,14 +52,8 @@ class TargetBalancingAnalyser(Analyser):
 
             self._tlog_last = t
 
-    def analyse(self, problem, ds):
-        if self.niter == 0:
-            return
-
+    def get_wproblem(self, problem):
         wtargets = []
-        if not problem.has_waveforms:
-            return
-
         for target in problem.waveform_targets:
             wtarget = copy.copy(target)
             wtarget.flip_norm = True
@@ -62,52 +62,244 @@ class TargetBalancingAnalyser(Analyser):
 
         wproblem = problem.copy()
         wproblem.targets = wtargets
+        return wproblem
+
+    def random_models(self, wproblem, rstate, n):
+        '''
+        Draw ``n`` random models within the parameter bounds.
+
+        Candidates are drawn in batches, models rejected by the problem's
+        preconstraints are replaced by the following candidates.
+        '''
 
         xbounds = wproblem.get_parameter_bounds()
         npar = xbounds.shape[0]
 
+        xs = []
+        while len(xs) < n:
+            candidates = rstate.uniform(
+                xbounds[:, 0], xbounds[:, 1], size=(n - len(xs), npar))
+
+            candidates, ok = wproblem.preconstrain_many(candidates)
+            xs.extend(candidates[ok])
+
+        return num.array(xs, dtype=float)
+
+    def get_pool(self, wproblem):
+        if self.nworkers <= 1:
+            return None
+
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            ctx = multiprocessing.get_context()
+
+        return ctx.Pool(
+            self.nworkers,
+            initializer=_init_worker,
+            initargs=(wproblem,))
+
+    def evaluate_batch(self, pool, wproblem, xs, isbad_mask):
+        if pool is None:
+            return _misfits_chunk(wproblem, xs, isbad_mask)
+
+        chunks = num.array_split(xs, min(self.nworkers, xs.shape[0]))
+        return num.vstack(pool.map(
+            _misfits_chunk_worker,
+            [(chunk, isbad_mask) for chunk in chunks]))
+
+    def converged(self, mean_ms, mean_ms_last):
+        if self.convergence_tolerance is None or mean_ms_last is None:
+            return False
+
+        mask = num.logical_and(
+            num.isfinite(mean_ms), num.isfinite(mean_ms_last))
+
+        if not num.any(mask):
+            return False
+
+        change = num.abs(mean_ms[mask] - mean_ms_last[mask]) \
+            / num.abs(mean_ms[mask])
+
+        return num.max(change) < self.convergence_tolerance
+
+    def get_mean_amplitudes(self, problem):
+        '''
+        Get mean synthetic amplitudes of the waveform targets.
+
+        Random models are evaluated in batches of ``nbatch``, distributed
+        over ``nworkers`` processes. If a convergence tolerance is set, the
+        estimation stops early, when the relative change of all mean
+        amplitudes between two batches is below it.
+        '''
+
+        wproblem = self.get_wproblem(problem)
+
         mss = num.zeros((self.niter, wproblem.ntargets))
         rstate = num.random.RandomState(123)
+        isbad_mask = num.zeros(wproblem.ntargets, dtype=bool)
 
-        isbad_mask = None
-
+        pool = self.get_pool(wproblem)
         self._tlog_last = 0
-        for iiter in range(self.niter):
-            self.log_progress(problem, iiter, self.niter)
-            while True:
-                x = []
-                for ipar in range(npar):
-                    v = rstate.uniform(xbounds[ipar, 0], xbounds[ipar, 1])
-                    x.append(v)
-
-                try:
-                    x = wproblem.preconstrain(x)
+        iiter = 0
+        mean_ms_last = None
+        try:
+            while iiter < self.niter:
+                self.log_progress(problem, iiter, self.niter)
+                nbatch = min(max(1, self.nbatch), self.niter - iiter)
+                xs = self.random_models(wproblem, rstate, nbatch)
+                ms = self.evaluate_batch(pool, wproblem, xs, isbad_mask)
+                mss[iiter:iiter+nbatch, :] = ms
+                iiter += nbatch
+
+                isbad_mask |= num.any(num.isnan(ms), axis=0)
+
+                mean_ms = num.mean(mss[:iiter], axis=0)
+                if iiter < self.niter \
+                        and self.converged(mean_ms, mean_ms_last):
+
+                    logger.info(
+                        'Target balancing for "%s" converged after %i '
+                        'iterations.' % (problem.name, iiter))
                     break
 
-                except Forbidden:
-                    pass
+                mean_ms_last = mean_ms
 
-            if isbad_mask is not None and num.any(isbad_mask):
-                isok_mask = num.logical_not(isbad_mask)
-            else:
-                isok_mask = None
-            ms = wproblem.misfits(x, mask=isok_mask)[:, 1]
-            mss[iiter, :] = ms
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-            isbad_mask = num.isnan(ms)
+        return num.mean(mss[:iiter], axis=0), wproblem.get_family_mask()
 
-        mean_ms = num.mean(mss, axis=0)
+    def get_data_availability(self, problem):
+        '''
+        Check which waveform targets have observed data.
+
+        Targets without data get no balancing weight. Data is requested for
+        the fit windows of the problem's base source.
+
+        :returns: list of booleans, one for each waveform target
+        '''
+
+        engine = problem.get_engine()
+        source = problem.base_source
+        available = []
+        for target in problem.waveform_targets:
+            config = target.misfit_config
+            try:
+                tmin_fit, tmax_fit, tfade, _ = target.get_taper_params(
+                    engine, source)
+
+                target.get_dataset().get_waveform(
+                    target.codes,
+                    tinc_cache=1.0/(config.fmin or 0.1*config.fmax),
+                    tmin=tmin_fit-tfade,
+                    tmax=tmax_fit+tfade,
+                    tfade=tfade,
+                    freqlimits=target.get_freqlimits(),
+                    deltat=engine.get_store_config(target.store_id).deltat,
+                    cache=True,
+                    backazimuth=target.get_backazimuth_for_waveform())
+
+                available.append(True)
+
+            except (NotFound, OutOfBounds):
+                available.append(False)
+
+        return available
+
+    def get_fingerprint(self, problem):
+        '''
+        Digest of the inputs the balancing weights depend on.
+
+        These are the targets, the availability of their data, the GF
+        stores, the parameter ranges and the settings of the analyser. Event
+        name and origin time are ignored.
+        '''
+
+        fproblem = problem.copy()
+        fproblem.name = ''
+        fproblem.targets = []
+        fproblem.nthreads = 1
+        fproblem.base_source = problem.base_source.clone(time=0.)
+        if hasattr(fproblem.base_source, 'name'):
+            fproblem.base_source.name = ''
+
+        return fingerprint(
+            'target_balancing',
+            fproblem,
+            target_fingerprint_args(
+                problem.get_engine(), problem.waveform_targets),
+            self.get_data_availability(problem),
+            self.niter, self.nbatch, self.convergence_tolerance)
+
+    def analyse(self, problem, ds):
+        if self.niter == 0:
+            return
+
+        if not problem.has_waveforms:
+            return
+
+        targets = problem.waveform_targets
+        fp = None
+        if self.cache is not None:
+            fp = self.get_fingerprint(problem)
+            results = self.get_cached_results(
+                'target_balancing', fp, targets)
+
+            if results is not None:
+                for result, target in zip(results, targets):
+                    target.analyser_results['target_balancing'] = result
+
+                return
+
+        mean_ms, (families, nfamilies) = self.get_mean_amplitudes(problem)
         weights = 1. / mean_ms
-        families, nfamilies = wproblem.get_family_mask()
 
         for ifamily in range(nfamilies):
             weights[families == ifamily] /= (
                 num.nansum(weights[families == ifamily]) /
                 num.nansum(num.isfinite(weights[families == ifamily])))
 
-        for weight, target in zip(weights, problem.waveform_targets):
-            target.analyser_results['target_balancing'] = \
-                TargetBalancingAnalyserResult(weight=float(weight))
+        results = [
+            TargetBalancingAnalyserResult(weight=float(weight))
+            for weight in weights]
+
+        for result, target in zip(results, targets):
+            target.analyser_results['target_balancing'] = result
+
+        if fp is not None:
+            self.put_cached_results('target_balancing', fp, targets, results)
+
+
+g_wproblem = None
+
+
+def _init_worker(wproblem):
+    global g_wproblem
+    g_wproblem = wproblem
+
+
+def _misfits_chunk(wproblem, xs, isbad_mask):
+    mss = num.zeros((xs.shape[0], wproblem.ntargets))
+    isbad_mask = isbad_mask.copy()
+    for i, x in enumerate(xs):
+        if num.any(isbad_mask):
+            isok_mask = num.logical_not(isbad_mask)
+        else:
+            isok_mask = None
+
+        ms = wproblem.misfits(x, mask=isok_mask)[:, 1]
+        mss[i, :] = ms
+        isbad_mask = num.isnan(ms)
+
+    return mss
+
+
+def _misfits_chunk_worker(args):
+    xs, isbad_mask = args
+    return _misfits_chunk(g_wproblem, xs, isbad_mask)
 
 
 class TargetBalancingAnalyserResult(AnalyserResult):
@@ -119,9 +311,25 @@ class TargetBalancingAnalyserConfig(AnalyserConfig):
     niterations = Int.T(default=1000,
                         help='Number of random forward models for mean \
                              phase amplitude estimation')
+    nworkers = Int.T(
+        default=1,
+        help='Number of worker processes evaluating the random forward '
+             'models.')
+    nbatch = Int.T(
+        default=50,
+        help='Number of random forward models drawn and evaluated per batch.')
+    convergence_tolerance = Float.T(
+        optional=True,
+        help='If set, stop before reaching niterations, when the relative '
+             'change of all mean phase amplitudes between two batches is '
+             'below this value.')
 
     def get_analyser(self):
-        return TargetBalancingAnalyser(niter=self.niterations)
+        return TargetBalancingAnalyser(
+            niter=self.niterations,
+            nworkers=self.nworkers,
+            nbatch=self.nbatch,
+            convergence_tolerance=self.convergence_tolerance)
 
 
 __all__ = '''
@@ -9,7 +9,7 @@ from optparse import OptionParser, OptionValueError
 import grond
 
 try:
-    from pyrocko import util, marker
+    from pyrocko import util
 except ImportError:
     print('Pyrocko is required for Grond!'
           'Go to https://pyrocko.org/ for installation instructions.')
@@ -45,6 +45,7 @@ subcommand_descriptions = {
     'events': 'print available event names for given configuration',
     'check': 'check data and configuration',
     'go': 'run Grond optimisation',
+    'worker': 'process events from a job queue',
     'forward': 'run forward modelling',
     'harvest': 'manually run harvesting',
     'cluster': 'run cluster analysis on result ensemble',
@@ -68,6 +69,7 @@ subcommand_usages = {
     'events': 'events <configfile>',
     'check': 'check <configfile> <eventnames> ... [options]',
     'go': 'go <configfile> <eventnames> ... [options]',
+    'worker': 'worker <queuedir> [options]',
     'forward': (
         'forward <rundir> [options]',
         'forward <configfile> <eventnames> ... [options]'),
@@ -119,6 +121,7 @@ Subcommands:
     events          %(events)s
     check           %(check)s
     go              %(go)s
+    worker          %(worker)s
     forward         %(forward)s
     harvest         %(harvest)s
     cluster         %(cluster)s
@@ -639,7 +642,7 @@ def command_events(args):
     try:
         config = grond.read_config(config_path)
 
-        for event_name in grond.get_event_names(config):
+        for event_name in config.get_event_names():
             print(event_name)
 
     except grond.GrondError as e:
@@ -668,6 +671,12 @@ def command_check(args):
                  '10). If set to zero, create synthetics for the reference '
                  'solution.')
 
+        parser.add_option(
+            '--modelling-processes', dest='nprocs_modelling', type=int,
+            default=1, metavar='N',
+            help='number of processes for forward modelling of synthetics '
+                 '(default: %default)')
+
     parser, options, args = cl_parse('check', args, setup)
     if len(args) < 1:
         help_and_die(parser, 'missing arguments')
@@ -685,7 +694,8 @@ def command_check(args):
             event_names=env.get_selected_event_names(),
             target_string_ids=target_string_ids,
             show_waveforms=options.show_waveforms,
-            n_random_synthetics=options.n_random_synthetics)
+            n_random_synthetics=options.n_random_synthetics,
+            nprocs=options.nprocs_modelling)
         logger.info(CLIHints('check', config=env.get_config_path()))
 
     except grond.GrondError as e:
@@ -712,14 +722,36 @@ def command_go(args):
             '--parallel', dest='nparallel', type=int, default=1,
             help='set number of events to process in parallel, '
                  'If set to more than one, --status=quiet is implied.')
+        parser.add_option(
+            '--cores', dest='ncores', type=int, default=None,
+            help='total number of cores to use. Events are scheduled on this '
+                 'budget and the threads of the GF engine are assigned to '
+                 'the running events according to their estimated cost. '
+                 'Implies --status=quiet.')
+        parser.add_option(
+            '--queue', dest='queue_path', metavar='DIR',
+            help='do not process the events but add them to the job queue '
+                 'in directory DIR, to be processed by any number of '
+                 '"grond worker DIR" processes.')
 
     parser, options, args = cl_parse('go', args, setup)
 
     try:
         env = Environment(args)
 
+        if options.queue_path:
+            from grond import jobqueue
+            jobqueue.submit(
+                options.queue_path,
+                args[0],
+                env.get_selected_event_names(),
+                force=options.force,
+                preserve=options.preserve)
+
+            return
+
         status = options.status
-        if options.nparallel != 1:
+        if options.nparallel != 1 or options.ncores is not None:
             status = 'quiet'
 
         grond.go(
@@ -727,7 +759,8 @@ def command_go(args):
             force=options.force,
             preserve=options.preserve,
             status=status,
-            nparallel=options.nparallel)
+            nparallel=options.nparallel,
+            ncores=options.ncores)
         if len(env.get_selected_event_names()) == 1:
             logger.info(CLIHints(
                 'go', rundir=env.get_rundir_path()))
@@ -736,6 +769,41 @@ def command_go(args):
         die(str(e))
 
 
+def command_worker(args):
+
+    from grond import jobqueue
+
+    def setup(parser):
+        parser.add_option(
+            '--no-wait', dest='wait', action='store_false', default=True,
+            help='exit when no more events can be claimed, instead of '
+                 'waiting for events claimed by other workers to finish or '
+                 'become stale')
+        parser.add_option(
+            '--heartbeat-interval', dest='heartbeat_interval', type=float,
+            default=30., metavar='SECONDS',
+            help='interval of heartbeat updates (default: %default)')
+        parser.add_option(
+            '--stale-timeout', dest='stale_timeout', type=float,
+            default=300., metavar='SECONDS',
+            help='reclaim events whose worker did not send a heartbeat for '
+                 'this time (default: %default)')
+
+    parser, options, args = cl_parse('worker', args, setup)
+    if len(args) != 1:
+        help_and_die(parser, 'no queue directory given')
+
+    try:
+        jobqueue.work(
+            args[0],
+            wait=options.wait,
+            heartbeat_interval=options.heartbeat_interval,
+            stale_timeout=options.stale_timeout)
+
+    except grond.GrondError as e:
+        die(str(e))
+
+
 def command_forward(args):
     def setup(parser):
         pass
@@ -807,6 +875,14 @@ def command_cluster(args):
             metavar='FILE',
             help='write configuration (or default configuration) to FILE')
 
+        parser.add_option(
+            '--threads',
+            dest='nthreads',
+            type=int,
+            default=1,
+            help='number of threads computing the model distances '
+                 '(default: %default)')
+
     method = args[0] if args else ''
     try:
         parser, options, args = cl_parse(
@@ -833,7 +909,9 @@ def command_cluster(args):
                 help_and_die(parser, 'no rundir')
             run_path, = args
 
-            grond.cluster(run_path, clustering, metric=options.metric)
+            grond.cluster(
+                run_path, clustering, metric=options.metric,
+                nthreads=options.nthreads)
 
     except grond.GrondError as e:
         die(str(e))
@@ -845,6 +923,16 @@ def command_plot(args):
         parser.add_option(
             '--show', dest='show', action='store_true',
             help='show plot for interactive inspection')
+        parser.add_option(
+            '--modelling-processes', dest='nprocs_modelling', type=int,
+            default=1, metavar='N',
+            help='number of processes for forward modelling of plots '
+                 '(default: %default)')
+        parser.add_option(
+            '--plot-processes', dest='nprocs_plots', type=int,
+            default=1, metavar='N',
+            help='number of processes making plots in parallel '
+                 '(default: %default)')
 
     details = ''
 
@@ -861,6 +949,7 @@ def command_plot(args):
 
     if len(args) > 1:
         env = Environment(args[1:])
+        env.set_nprocs_modelling(options.nprocs_modelling)
     else:
         env = None
 
@@ -898,19 +987,24 @@ def command_plot(args):
         if env is None:
             help_and_die(parser, 'two or three arguments required')
         plot_names = plot.get_plot_names(env)
-        plot.make_plots(env, plot_names=plot_names, show=options.show)
+        plot.make_plots(
+            env, plot_names=plot_names, show=options.show,
+            nprocs=options.nprocs_plots)
 
     elif op.exists(args[0]):
         if env is None:
             help_and_die(parser, 'two or three arguments required')
         plots = plot.PlotConfigCollection.load(args[0])
-        plot.make_plots(env, plots, show=options.show)
+        plot.make_plots(
+            env, plots, show=options.show, nprocs=options.nprocs_plots)
 
     else:
         if env is None:
             help_and_die(parser, 'two or three arguments required')
         plot_names = [name.strip() for name in args[0].split(',')]
-        plot.make_plots(env, plot_names=plot_names, show=options.show)
+        plot.make_plots(
+            env, plot_names=plot_names, show=options.show,
+            nprocs=options.nprocs_plots)
 
 
 def command_movie(args):
@@ -919,7 +1013,16 @@ def command_movie(args):
     matplotlib.use('Agg')
 
     def setup(parser):
-        pass
+        parser.add_option(
+            '--frame-stride', dest='frame_stride', type=int,
+            default=1, metavar='N',
+            help='render a frame for every N-th iteration only '
+                 '(default: %default)')
+        parser.add_option(
+            '--plot-processes', dest='nprocs_plots', type=int,
+            default=1, metavar='N',
+            help='number of processes rendering frames in parallel '
+                 '(default: %default)')
 
     parser, options, args = cl_parse('movie', args, setup)
 
@@ -935,7 +1038,10 @@ def command_movie(args):
         'ypar': ypar_name}
 
     try:
-        plot.make_movie(run_path, xpar_name, ypar_name, movie_filename)
+        plot.make_movie(
+            run_path, xpar_name, ypar_name, movie_filename,
+            frame_stride=options.frame_stride,
+            nprocs=options.nprocs_plots)
 
     except grond.GrondError as e:
         die(str(e))
@@ -1055,17 +1161,21 @@ def command_tag(args):
         die('Errors occurred, see log messages above.')
 
 
-def make_report(env_args, event_name, conf, update_without_plotting):
+def make_report(env_args, event_name, conf, update_without_plotting,
+                nprocs_modelling=1, nprocs_plots=1, force=False):
     from grond.environment import Environment
     from grond.report import report
     try:
         env = Environment(env_args)
+        env.set_nprocs_modelling(nprocs_modelling)
         if event_name:
             env.set_current_event_name(event_name)
 
         report(
             env, conf,
             update_without_plotting=update_without_plotting,
+            nprocs_plots=nprocs_plots,
+            force=force,
             make_index=False,
             make_archive=False)
 
@@ -1143,10 +1253,26 @@ def command_report(args):
             dest='update_without_plotting',
             action='store_true',
             help='quick-and-dirty update parameter files without plotting')
+        parser.add_option(
+            '--force',
+            dest='force',
+            action='store_true',
+            help='regenerate report entries completely, even if the rundir '
+                 'and plot configuration did not change')
         parser.add_option(
             '--parallel', dest='nparallel', type=int, default=1,
             help='set number of runs to process in parallel, '
                  'If set to more than one, --status=quiet is implied.')
+        parser.add_option(
+            '--modelling-processes', dest='nprocs_modelling', type=int,
+            default=1, metavar='N',
+            help='number of processes for forward modelling of plots '
+                 '(default: %default)')
+        parser.add_option(
+            '--plot-processes', dest='nprocs_plots', type=int,
+            default=1, metavar='N',
+            help='number of processes making plots in parallel '
+                 '(default: %default)')
 
     parser, options, args = cl_parse('report', args, setup)
 
@@ -1192,14 +1318,18 @@ def command_report(args):
         all_failed = True
         for rundir in rundirs:
             payload.append(([rundir], None,
-                           conf, options.update_without_plotting))
+                           conf, options.update_without_plotting,
+                           options.nprocs_modelling, options.nprocs_plots,
+                           options.force))
 
     elif args:
         try:
             env = Environment(args)
             for event_name in env.get_selected_event_names():
                 payload.append((args, event_name,
-                                conf, options.update_without_plotting))
+                                conf, options.update_without_plotting,
+                                options.nprocs_modelling,
+                                options.nprocs_plots, options.force))
 
         except grond.GrondError as e:
             die(str(e))
@@ -1316,6 +1446,8 @@ def command_qc_polarization(args):
 
     nsl_to_time = None
     if options.picks_filename:
+        from pyrocko import marker
+
         markers = marker.load_markers(options.picks_filename)
         marker.associate_phases_to_events(markers)
 
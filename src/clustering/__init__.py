@@ -15,6 +15,16 @@ class Clustering(Object):
     def perform(self):
         raise NotImplementedError('should be implemented in subclass')
 
+    def perform_events(self, events, metric, nthreads=1):
+        '''
+        Cluster events, using the full similarity matrix.
+
+        Subclasses may override this to avoid computing the full matrix.
+        '''
+        from .metrics import compute_similarity_matrix
+        return self.perform(
+            compute_similarity_matrix(events, metric, nthreads=nthreads))
+
     @classmethod
     def _cli_setup(cls, parser):
 
@@ -96,6 +106,23 @@ class DBScan(Clustering):
             eps=self.eps,
             ncluster_limit=self.ncluster_limit)
 
+    def perform_events(self, events, metric, nthreads=1):
+        '''
+        Cluster events on their eps-neighbour graph.
+
+        The similarity matrix is never stored, memory grows with the number
+        of neighbour pairs.
+        '''
+        from .metrics import compute_neighbour_graph
+        from .dbscan import dbscan_graph
+        indptr, indices = compute_neighbour_graph(
+            events, metric, self.eps, nthreads=nthreads)
+
+        return dbscan_graph(
+            indptr, indices,
+            nmin=self.nmin,
+            ncluster_limit=self.ncluster_limit)
+
 
 def read_config(path):
     try:
@@ -8,126 +8,126 @@ epsilon = 1e-6
 km = 1000.
 
 
-class DBEvent:
-    '''
-    Event condition with respect to the DBSCAN clustering.
-
-    :param event_id: event index (sequential number)
-    :param event_type: type of the event according to clustering
-    :param directly_reachable: list of ids of events directly reachable
-    '''
-
-    def __init__(self, event_id, event_type, directly_reachables):
-        self.event_id = event_id
-        self.event_type = event_type
-        self.directly_reachables = directly_reachables
-
-
 class ClusterError(Exception):
     pass
 
 
-def dbscan(simmat, nmin, eps, ncluster_limit):
+def neighbour_graph(simmat, eps, nblock=1000):
     '''
-    Apply DBSCAN algorithm, reading a similarity matrix and returning a list of
-    events clusters
+    Get the eps-neighbourhoods of all events as a sparse graph.
+
+    Event ``j`` is a neighbour of event ``i`` if ``simmat[i, j] <= eps`` and
+    ``i != j``.
 
     :param simmat: similarity matrix (numpy matrix)
-    :param nmin: minimum number of neighbours to define a cluster
     :param eps: maximum distance to search for neighbours
+    :param nblock: number of rows processed at once
+    :returns: adjacency in compressed sparse row format, tuple ``(indptr,
+        indices)``, neighbours of event ``i`` are
+        ``indices[indptr[i]:indptr[i+1]]``, in increasing order
     '''
-    CORE = 1
-    NOT_CORE = 2
-    EDGE = 3
-    ISLE = 4
-    REACHED = 5
 
     nev = len(simmat)
-    clusterevents = []
-    for i in range(nev):
-        event_id = i
-        directly_reachables = []
-        for j in range(nev):
-            if simmat[i, j] <= eps:
-                if (i != j):
-                    directly_reachables.append(j)
-
-        if len(directly_reachables) >= nmin:
-            event_type = CORE
-        else:
-            event_type = NOT_CORE
+    counts = num.zeros(nev, dtype=int)
+    indices = []
+    for i0 in range(0, nev, nblock):
+        i1 = min(i0 + nblock, nev)
+        mask = num.asarray(simmat[i0:i1]) <= eps
+        mask[num.arange(i1 - i0), num.arange(i0, i1)] = False
+        counts[i0:i1] = num.sum(mask, axis=1)
+        indices.append(num.nonzero(mask)[1])
+
+    return graph_from_counts(counts, indices)
+
+
+def graph_from_counts(counts, indices):
+    indptr = num.zeros(counts.size + 1, dtype=int)
+    num.cumsum(counts, out=indptr[1:])
+    if indices:
+        indices = num.concatenate(indices).astype(int)
+    else:
+        indices = num.zeros(0, dtype=int)
+
+    return indptr, indices
 
-        clusterevents.append(
-            DBEvent(event_id, event_type, directly_reachables))
 
-    for i in range(nev):
-        for j in range(nev):
-            if (i in clusterevents[j].directly_reachables) \
-                    and (clusterevents[j].event_type == CORE):
+def gather_neighbours(indptr, indices, ievents):
+    '''
+    Concatenated neighbour lists of the given events.
+    '''
+
+    starts = indptr[ievents]
+    lengths = indptr[ievents + 1] - starts
+    ntotal = num.sum(lengths)
+    if ntotal == 0:
+        return num.zeros(0, dtype=int)
 
-                if clusterevents[i].event_type == NOT_CORE:
-                    clusterevents[i].event_type = EDGE
+    offsets = num.repeat(starts - num.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + num.arange(ntotal)]
 
-        if clusterevents[i].event_type == NOT_CORE:
-            clusterevents[i].event_type = ISLE
 
-    eventsclusters = num.zeros((nev), dtype=int)
+def dbscan_graph(indptr, indices, nmin, ncluster_limit):
+    '''
+    Apply DBSCAN algorithm on an eps-neighbour graph.
+
+    :param indptr, indices: neighbour graph, see :py:func:`neighbour_graph`
+    :param nmin: minimum number of neighbours to define a cluster
+    :returns: cluster labels, clusters are numbered by decreasing size,
+        noise is labelled ``-1``
+    '''
+
+    nev = indptr.size - 1
+    counts = num.diff(indptr)
+
+    # core events have at least nmin neighbours, edge events are neighbours
+    # of core events, all other events are isles (noise)
+    is_core = counts >= nmin
+
+    eventsclusters = num.full(nev, -1, dtype=int)
+    reached = num.zeros(nev, dtype=bool)
     actualcluster = -1
-    for i in range(nev):
-        if clusterevents[i].event_type == ISLE:
-            eventsclusters[i] = -1
-        else:
-            if clusterevents[i].event_type == CORE:
-                actualcluster = actualcluster + 1
-                reachedevents = []
-                pointingevents = []
-
-                eventsclusters[i] = actualcluster
-                reachedevents.append(i)
-                pointingevents.append(i)
-
-                while len(pointingevents) > 0:
-                    newpointingevents = []
-                    for j in pointingevents:
-                        for k in clusterevents[j].directly_reachables:
-                            if clusterevents[k].event_type == CORE:
-                                reachedevents.append(k)
-                                newpointingevents.append(k)
-                                eventsclusters[k] = actualcluster
-                                clusterevents[k].event_type = REACHED
-                            elif clusterevents[k].event_type == EDGE:
-                                reachedevents.append(k)
-                                eventsclusters[k] = actualcluster
-                                clusterevents[k].event_type = REACHED
-
-                    pointingevents = []
-                    for newpointingevent in newpointingevents:
-                        pointingevents.append(newpointingevent)
+    for i in num.flatnonzero(is_core):
+        if reached[i]:
+            continue
 
-    n_clusters = actualcluster + 1
-#   resorting data clusters (noise remains as -1)
+        actualcluster += 1
+        eventsclusters[i] = actualcluster
 
-    clustersizes = []
-    for icl in range(n_clusters):
-        lencl = len([ev for ev in eventsclusters if ev == icl])
-        clustersizes.append([icl, lencl])
+        pointingevents = num.array([i])
+        while pointingevents.size > 0:
+            neighbours = gather_neighbours(indptr, indices, pointingevents)
+            neighbours = num.unique(neighbours[~reached[neighbours]])
+            eventsclusters[neighbours] = actualcluster
+            reached[neighbours] = True
+            pointingevents = neighbours[is_core[neighbours]]
 
-    resorted_clustersizes = sorted(
-        clustersizes, key=lambda tup: tup[1], reverse=True)
+    n_clusters = actualcluster + 1
 
-    resorting_dict = {}
-    resorting_dict[-1] = -1
+    # resorting data clusters by size (noise remains as -1)
+    clustersizes = num.bincount(
+        eventsclusters[eventsclusters >= 0], minlength=n_clusters)
 
-    for icl in range(n_clusters):
+    resorted = num.argsort(-clustersizes, kind='stable')
+    resorting = num.full(n_clusters + 1, -1, dtype=int)
+    for icl, iclold in enumerate(resorted):
         if ncluster_limit is None or icl < ncluster_limit:
-            resorting_dict[resorted_clustersizes[icl][0]] = icl
-        else:
-            resorting_dict[resorted_clustersizes[icl][0]] = -1
+            resorting[iclold] = icl
+
+    return resorting[eventsclusters]
 
-    for ievcl, evcl in enumerate(eventsclusters):
-        eventsclusters[ievcl] = resorting_dict[evcl]
 
-    return eventsclusters
+def dbscan(simmat, nmin, eps, ncluster_limit):
+    '''
+    Apply DBSCAN algorithm, reading a similarity matrix and returning a list of
+    events clusters
+
+    :param simmat: similarity matrix (numpy matrix)
+    :param nmin: minimum number of neighbours to define a cluster
+    :param eps: maximum distance to search for neighbours
+    '''
+
+    indptr, indices = neighbour_graph(simmat, eps)
+    return dbscan_graph(indptr, indices, nmin, ncluster_limit)
 
 
 def get_clusters(events, eventsclusters):
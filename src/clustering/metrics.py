@@ -1,55 +1,282 @@
 import math
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as num
 from pyrocko import moment_tensor, orthodrome
 from grond.meta import GrondError
 
+r2d = 180. / math.pi
+d2r = 1.0 / r2d
 
-def get_distance_mt_l2(eventi, eventj):
+# weights of the 6 independent moment tensor entries, in the order of
+# MomentTensor.m6(), for the inner product in R^9
+m6_r9_weights = num.array([1., 1., 1., 2., 2., 2.])
+
+# order of the entries of MomentTensor.m6() in the weights of
+# get_distance_mt_weighted_cos, which are given in the order
+# xx, xy, yy, xz, yz, zz
+m6_iweights = [0, 2, 5, 1, 3, 4]
+
+
+class EventArrays(object):
     '''
-    L2 norm among two moment tensors, with 6 independet entries
+    Moment tensors and hypocentres of a set of events as arrays.
+
+    :param m6s: moment tensors, shape ``(n, 6)``, in the order of
+        :py:meth:`pyrocko.moment_tensor.MomentTensor.m6`, or ``None``
+    :param lats: latitudes [deg]
+    :param lons: longitudes [deg]
+    :param depths: depths [m]
     '''
 
-    # ni = (eventi.mxx)**2 + (eventi.myy)**2 + (eventi.mzz)**2 + \
-    #      (eventi.mxy)**2 + (eventi.mxz)**2 + (eventi.myz)**2
-    # nj = (eventj.mxx)**2 + (eventj.myy)**2 + (eventj.mzz)**2 + \
-    #      (eventj.mxy)**2 + (eventj.mxz)**2 + (eventj.myz)**2
+    def __init__(self, m6s, lats, lons, depths):
+        self.m6s = m6s
+        self.lats = lats
+        self.lons = lons
+        self.depths = depths
+        self._axes_angles = None
+        self._tpb_rotations = None
 
-    # mixx, miyy, mizz = eventi.mxx / ni, eventi.myy / ni, eventi.mzz / ni
-    # mixy, mixz, miyz = eventi.mxy / ni, eventi.mxz / ni, eventi.myz / ni
-    # mjxx, mjyy, mjzz = eventj.mxx / nj, eventj.myy / nj, eventj.mzz / nj
-    # mjxy, mjxz, mjyz = eventj.mxy / nj, eventj.mxz / nj, eventj.myz / nj
+    @classmethod
+    def from_events(cls, events):
+        if events and all(ev.moment_tensor is not None for ev in events):
+            m6s = num.array(
+                [ev.moment_tensor.m6() for ev in events], dtype=float)
+        else:
+            m6s = None
 
-    d = (eventi.mxx - eventj.mxx)**2 + (eventi.myy - eventj.myy)**2 + \
-        (eventi.mzz - eventj.mzz)**2 + (eventi.mxy - eventj.mxy)**2 + \
-        (eventi.mxz - eventj.mxz)**2 + (eventi.myz - eventj.myz)**2
+        latlons = num.array(
+            [ev.effective_latlon for ev in events], dtype=float)
 
-    d = 0.5 * math.sqrt(d)
+        return cls(
+            m6s=m6s,
+            lats=latlons[:, 0],
+            lons=latlons[:, 1],
+            depths=num.array([ev.depth for ev in events], dtype=float))
 
-    return d
+    def __len__(self):
+        return self.lats.size
 
+    def __getitem__(self, sl):
+        sub = EventArrays(
+            self.m6s[sl] if self.m6s is not None else None,
+            self.lats[sl], self.lons[sl], self.depths[sl])
 
-def get_distance_mt_l1(eventi, eventj):
+        if self._axes_angles is not None:
+            sub._axes_angles = self._axes_angles[sl]
+
+        if self._tpb_rotations is not None:
+            sub._tpb_rotations = self._tpb_rotations[sl]
+
+        return sub
+
+    def get_m6s(self):
+        if self.m6s is None:
+            raise GrondError('metric needs moment tensors of all events')
+
+        return self.m6s
+
+    def _eigh(self):
+        return num.linalg.eigh(moment_tensor.symmat6(
+            *self.get_m6s().T).transpose((2, 0, 1)))
+
+    def get_axes_angles(self):
+        '''
+        Angles of the B, T and P axes to the vertical, shape ``(n, 3)``.
+        '''
+
+        if self._axes_angles is None:
+            _, evecs = self._eigh()
+            self._axes_angles = num.arccos(num.abs(
+                evecs[:, 2, [1, 2, 0]]))
+
+        return self._axes_angles
+
+    def get_tpb_rotations(self):
+        '''
+        Eigenvector bases in T, P, B order, as used for the Kagan angle.
+        '''
+
+        if self._tpb_rotations is None:
+            _, evecs = self._eigh()
+            evecs[num.linalg.det(evecs) < 0.] *= -1.
+            self._tpb_rotations = num.einsum(
+                'kl,iml->ikm', moment_tensor._pbt2tpb, evecs)
+
+        return self._tpb_rotations
+
+
+def mt_l2_matrix(a, b):
     '''
-    L1 norm among two moment tensors, with 6 independet entries
+    L2 norm among moment tensors, with 6 independent entries.
+    '''
+
+    diff = a.get_m6s()[:, num.newaxis, :] - b.get_m6s()[num.newaxis, :, :]
+    return 0.5 * num.sqrt(num.sum(diff**2, axis=2))
+
+
+def mt_l2_pairs(a, b):
+    '''
+    L2 norm among moment tensors, for pairs of events ``(a[i], b[i])``.
     '''
 
-    # ni = abs(eventi.mxx) + abs(eventi.myy) + abs(eventi.mzz) + \
-    #      abs(eventi.mxy) + abs(eventi.mxz) + abs(eventi.myz)
-    # nj = abs(eventj.mxx) + abs(eventj.myy) + abs(eventj.mzz) + \
-    #      abs(eventj.mxy) + abs(eventj.mxz) + abs(eventj.myz)
-    #
-    # mixx, miyy, mizz = eventi.mxx / ni, eventi.myy / ni, eventi.mzz / ni
-    # mixy, mixz, miyz = eventi.mxy / ni, eventi.mxz / ni, eventi.myz / ni
-    # mjxx, mjyy, mjzz = eventj.mxx / nj, eventj.myy / nj, eventj.mzz / nj
-    # mjxy, mjxz, mjyz = eventj.mxy / nj, eventj.mxz / nj, eventj.myz / nj
+    return 0.5 * num.sqrt(num.sum((a.get_m6s() - b.get_m6s())**2, axis=1))
 
-    d = abs(eventi.mxx - eventj.mxx) + abs(eventi.myy - eventj.myy) + \
-        abs(eventi.mzz - eventj.mzz) + abs(eventi.mxy - eventj.mxy) + \
-        abs(eventi.mxz - eventj.mxz) + abs(eventi.myz - eventj.myz)
 
-    d = 0.5 * math.sqrt(d)
+def mt_l1_matrix(a, b):
+    '''
+    L1 norm among moment tensors, with 6 independent entries.
+    '''
 
-    return d
+    diff = a.get_m6s()[:, num.newaxis, :] - b.get_m6s()[num.newaxis, :, :]
+    return 0.5 * num.sqrt(num.sum(num.abs(diff), axis=2))
+
+
+def _cos_distance_matrix(m6s_a, m6s_b, weights):
+    na = num.sqrt(num.sum(weights * m6s_a**2, axis=1))
+    nb = num.sqrt(num.sum(weights * m6s_b**2, axis=1))
+    innerproduct = num.dot(m6s_a * weights, m6s_b.T) \
+        / (na[:, num.newaxis] * nb[num.newaxis, :])
+
+    return 0.5 * (1.0 - num.clip(innerproduct, -1.0, 1.0))
+
+
+def mt_cos_matrix(a, b):
+    '''
+    Inner product among moment tensors, normalized in R^9.
+    '''
+
+    return _cos_distance_matrix(a.get_m6s(), b.get_m6s(), m6_r9_weights)
+
+
+def mt_weighted_cos_matrix(a, b, ws=None):
+    '''
+    Weighted moment tensor distance, see
+    :py:func:`get_distance_mt_weighted_cos`.
+    '''
+
+    if ws is None:
+        ws = num.ones(6)
+
+    weights = num.asarray(ws, dtype=float)[m6_iweights]**2
+    return _cos_distance_matrix(a.get_m6s(), b.get_m6s(), weights)
+
+
+def _tpb2q_many(t, p, b):
+    eps = 0.001
+    tqs = num.array([
+        1. + t[..., 0] + p[..., 1] + b[..., 2],
+        1. + t[..., 0] - p[..., 1] - b[..., 2],
+        1. - t[..., 0] + p[..., 1] - b[..., 2],
+        1. - t[..., 0] - p[..., 1] + b[..., 2]])
+
+    vecs = num.array([
+        [p[..., 2] - b[..., 1], b[..., 0] - t[..., 2], t[..., 1] - p[..., 0]],
+        [p[..., 2] - b[..., 1], p[..., 0] + t[..., 1], b[..., 0] + t[..., 2]],
+        [b[..., 0] - t[..., 2], p[..., 0] + t[..., 1], b[..., 1] + p[..., 2]],
+        [t[..., 1] - p[..., 0], b[..., 0] + t[..., 2], b[..., 1] + p[..., 2]]])
+
+    # first case exceeding eps, as in moment_tensor._tpb2q
+    icase = num.argmax(tqs > eps, axis=0)
+    tq = num.choose(icase, tqs)
+    vec = num.choose(icase[num.newaxis, ...], vecs)
+
+    q0 = 0.5 * num.sqrt(tq)
+    q = num.concatenate(
+        [q0[num.newaxis], vec / (4.0 * q0[num.newaxis])], axis=0)
+
+    return q / num.sqrt(num.sum(q**2, axis=0))
+
+
+def kagan_angle_matrix(a, b):
+    '''
+    Normalized Kagan angle distance among DC components of moment tensors.
+    '''
+
+    u = num.einsum(
+        'ikl,jml->ijkm', a.get_tpb_rotations(), b.get_tpb_rotations())
+
+    q = _tpb2q_many(u[..., 0, :], u[..., 1, :], u[..., 2, :])
+    angle = 2. * r2d * num.arccos(
+        num.minimum(num.max(num.abs(q), axis=0), 1.0))
+
+    return num.minimum(angle / 120., 1.)
+
+
+def _hypo_distance_pairs(a, b, with_depth):
+    maxdist_km = 1000.
+
+    same = num.logical_and(a.lats == b.lats, a.lons == b.lons)
+    distance_km = num.zeros(len(a))
+    distance_km[~same] = orthodrome.distance_accurate50m_numpy(
+        a.lats[~same], a.lons[~same], b.lats[~same], b.lons[~same]) / 1000.
+
+    if with_depth:
+        ddepth_km = num.abs(a.depths - b.depths) / 1000.
+        distance_km = num.sqrt(distance_km**2 + ddepth_km**2)
+
+    return num.minimum(distance_km / maxdist_km, 1.)
+
+
+def _hypo_distance_matrix(a, b, with_depth):
+    ia = num.repeat(num.arange(len(a)), len(b))
+    ib = num.tile(num.arange(len(b)), len(a))
+    return _hypo_distance_pairs(a[ia], b[ib], with_depth).reshape(
+        (len(a), len(b)))
+
+
+def hypo_distance_matrix(a, b):
+    '''
+    Normalized Euclidean hypocentral distance.
+    '''
+
+    return _hypo_distance_matrix(a, b, with_depth=True)
+
+
+def epi_distance_matrix(a, b):
+    '''
+    Normalized Euclidean epicentral distance.
+    '''
+
+    return _hypo_distance_matrix(a, b, with_depth=False)
+
+
+def hypo_distance_pairs(a, b):
+    return _hypo_distance_pairs(a, b, with_depth=True)
+
+
+def epi_distance_pairs(a, b):
+    return _hypo_distance_pairs(a, b, with_depth=False)
+
+
+def mt_triangle_diagram_matrix(a, b):
+    '''
+    Scalar product among principal axes angles.
+    '''
+
+    return 1. - num.dot(a.get_axes_angles(), b.get_axes_angles().T)
+
+
+def _distance_from_matrix(func, eventi, eventj, **kwargs):
+    return float(func(
+        EventArrays.from_events([eventi]),
+        EventArrays.from_events([eventj]), **kwargs)[0, 0])
+
+
+def get_distance_mt_l2(eventi, eventj):
+    '''
+    L2 norm among two moment tensors, with 6 independet entries
+    '''
+
+    return _distance_from_matrix(mt_l2_matrix, eventi, eventj)
+
+
+def get_distance_mt_l1(eventi, eventj):
+    '''
+    L1 norm among two moment tensors, with 6 independet entries
+    '''
+
+    return _distance_from_matrix(mt_l1_matrix, eventi, eventj)
 
 
 def get_distance_mt_cos(eventi, eventj):
@@ -60,81 +287,19 @@ def get_distance_mt_cos(eventi, eventj):
     R^9 to ensure innerproduct between -1 and +1.
     '''
 
-    ni = math.sqrt(
-        eventi.mxx * eventi.mxx +
-        eventi.myy * eventi.myy +
-        eventi.mzz * eventi.mzz +
-        2. * eventi.mxy * eventi.mxy +
-        2. * eventi.mxz * eventi.mxz +
-        2. * eventi.myz * eventi.myz)
-
-    nj = math.sqrt(
-        eventj.mxx * eventj.mxx +
-        eventj.myy * eventj.myy +
-        eventj.mzz * eventj.mzz +
-        2. * eventj.mxy * eventj.mxy +
-        2. * eventj.mxz * eventj.mxz +
-        2. * eventj.myz * eventj.myz)
-
-    nc = ni * nj
-    innerproduct = (
-        eventi.mxx * eventj.mxx +
-        eventi.myy * eventj.myy +
-        eventi.mzz * eventj.mzz +
-        2. * eventi.mxy * eventj.mxy +
-        2. * eventi.mxz * eventj.mxz +
-        2. * eventi.myz * eventj.myz) / nc
-
-    if innerproduct >= 1.0:
-        innerproduct = 1.0
-    elif innerproduct <= -1.0:
-        innerproduct = -1.0
-
-    d = 0.5 * (1 - innerproduct)
-
-    return d
+    return _distance_from_matrix(mt_cos_matrix, eventi, eventj)
 
 
-def get_distance_mt_weighted_cos(eventi, eventj, ws):
+def get_distance_mt_weighted_cos(eventi, eventj, ws=None):
     '''
     Weighted moment tensor distance.
 
-    According to Cesca et al. 2014 GJI
-    '''
-    ni = math.sqrt(
-        (ws[0] * eventi.mxx)**2 +
-        (ws[1] * eventi.mxy)**2 +
-        (ws[2] * eventi.myy)**2 +
-        (ws[3] * eventi.mxz)**2 +
-        (ws[4] * eventi.myz)**2 +
-        (ws[5] * eventi.mzz)**2)
-
-    nj = math.sqrt(
-        (ws[0] * eventj.mxx)**2 +
-        (ws[1] * eventj.mxy)**2 +
-        (ws[2] * eventj.myy)**2 +
-        (ws[3] * eventj.mxz)**2 +
-        (ws[4] * eventj.myz)**2 +
-        (ws[5] * eventj.mzz)**2)
-
-    nc = ni * nj
-    innerproduct = (
-        ws[0] * ws[0] * eventi.mxx * eventj.mxx +
-        ws[1] * ws[1] * eventi.mxy * eventj.mxy +
-        ws[2] * ws[2] * eventi.myy * eventj.myy +
-        ws[3] * ws[3] * eventi.mxz * eventj.mxz +
-        ws[4] * ws[4] * eventi.myz * eventj.myz +
-        ws[5] * ws[5] * eventi.mzz * eventj.mzz) / nc
-
-    if innerproduct >= 1.0:
-        innerproduct = 1.0
-
-    elif innerproduct <= -1.0:
-        innerproduct = -1.0
-
-    d = 0.5 * (1.0 - innerproduct)
+    According to Cesca et al. 2014 GJI. The weights ``ws`` are given in the
+    order xx, xy, yy, xz, yz, zz.
+    '''
 
-    return d
+    return _distance_from_matrix(
+        mt_weighted_cos_matrix, eventi, eventj, ws=ws)
 
 
 def get_distance_dc(eventi, eventj):
@@ -159,56 +324,16 @@ def get_distance_hypo(eventi, eventj):
 
     The normalization assumes largest considered distance is 1000 km.
     '''
-    maxdist_km = 1000.
-    a_lats, a_lons, b_lats, b_lons = \
-        eventi.north, eventi.east, eventj.north, eventj.east
 
-    a_dep, b_dep = eventi.down, eventj.down
-
-    if (a_lats == b_lats) and (a_lons == b_lons) and (a_dep == b_dep):
-        d = 0.
-    else:
-        distance_m = orthodrome.distance_accurate50m_numpy(
-            a_lats, a_lons, b_lats, b_lons)
-
-        distance_km = distance_m / 1000.
-        ddepth = abs(eventi.down - eventj.down)
-        hypo_distance_km = math.sqrt(
-            distance_km * distance_km + ddepth * ddepth)
-
-        # maxdist = float(inv_param['EUCLIDEAN_MAX'])
-
-        d = hypo_distance_km / maxdist_km
-        if d >= 1.:
-            d = 1.
-
-    return d
+    return _distance_from_matrix(hypo_distance_matrix, eventi, eventj)
 
 
 def get_distance_epi(eventi, eventj):
     '''Normalized Euclidean epicentral distance.
        The normalization assumes largest considered distance is 1000 km.
     '''
-    maxdist_km = 1000.
-
-    a_lats, a_lons, b_lats, b_lons = \
-        eventi.north, eventi.east, eventj.north, eventj.east
-
-    a_dep, b_dep = eventi.down, eventj.down
-
-    if (a_lats == b_lats) and (a_lons == b_lons) and (a_dep == b_dep):
-        d = 0.
-    else:
-        distance_m = orthodrome.distance_accurate50m_numpy(
-            a_lats, a_lons, b_lats, b_lons)
 
-        distance_km = distance_m / 1000.
-
-        d = distance_km / maxdist_km
-        if d >= 1.:
-            d = 1.
-
-    return d
+    return _distance_from_matrix(epi_distance_matrix, eventi, eventj)
 
 
 def get_distance_mt_triangle_diagram(eventi, eventj):
@@ -216,24 +341,7 @@ def get_distance_mt_triangle_diagram(eventi, eventj):
     Scalar product among principal axes (?).
     '''
 
-    mti = eventi.moment_tensor
-    mtj = eventj.moment_tensor
-
-    ti, pi, bi = mti.t_axis(), mti.p_axis(), mti.b_axis()
-    deltabi = math.acos(abs(bi[2]))
-    deltati = math.acos(abs(ti[2]))
-    deltapi = math.acos(abs(pi[2]))
-    tj, pj, bj = mtj.t_axis(), mtj.p_axis(), mtj.b_axis()
-    deltabj = math.acos(abs(bj[2]))
-    deltatj = math.acos(abs(tj[2]))
-    deltapj = math.acos(abs(pj[2]))
-    dotprod = deltabi * deltabj + deltati * deltatj + deltapi * deltapj
-
-    if dotprod >= 1.:
-        dotprod == 1.
-
-    d = 1. - dotprod
-    return d
+    return _distance_from_matrix(mt_triangle_diagram_matrix, eventi, eventj)
 
 
 metric_funcs = {
@@ -248,9 +356,47 @@ metric_funcs = {
 }
 
 
+metric_matrix_funcs = {
+    'mt_l2norm': mt_l2_matrix,
+    'mt_l1norm': mt_l1_matrix,
+    'mt_cos': mt_cos_matrix,
+    'mt_weighted_cos': mt_weighted_cos_matrix,
+    'mt_principal_axis': mt_triangle_diagram_matrix,
+    'kagan_angle': kagan_angle_matrix,
+    'hypocentral': hypo_distance_matrix,
+    'epicentral': epi_distance_matrix,
+}
+
+
+# metrics with a Euclidean embedding, used to find neighbours with a KD-tree,
+# see get_embedding
+metric_pair_funcs = {
+    'mt_l2norm': mt_l2_pairs,
+    'hypocentral': hypo_distance_pairs,
+    'epicentral': epi_distance_pairs,
+}
+
+
 metrics = sorted(metric_funcs.keys())
 
 
+# approximate peak memory of the temporary arrays of the matrix functions per
+# event pair [bytes], used to size the blocks
+metric_pair_nbytes = {
+    'mt_l2norm': 110,
+    'mt_l1norm': 110,
+    'mt_cos': 25,
+    'mt_weighted_cos': 25,
+    'mt_principal_axis': 20,
+    'kagan_angle': 330,
+    'hypocentral': 410,
+    'epicentral': 410,
+}
+
+# memory budget of all blocks computed in parallel [bytes]
+block_memory_max = 256 * 1024**2
+
+
 def get_distance(eventi, eventj, metric, **kwargs):
     '''
     Compute the normalized distance among two earthquakes, calling the function
@@ -262,31 +408,231 @@ def get_distance(eventi, eventj, metric, **kwargs):
     except KeyError:
         raise GrondError('unknown metric: %s' % metric)
 
-    return func(eventi, eventj)
+    return func(eventi, eventj, **kwargs)
+
+
+def get_matrix_func(metric):
+    try:
+        return metric_matrix_funcs[metric]
+    except KeyError:
+        raise GrondError('unknown metric: %s' % metric)
+
+
+def get_block_size(metric, nblock=1000, nthreads=1, memory_max=None):
+    '''
+    Get the block size for the matrix function of a metric.
+
+    The block size ``nblock`` is reduced where necessary, so that the
+    temporary arrays of ``nthreads`` blocks computed in parallel fit into
+    ``memory_max`` bytes, default :py:data:`block_memory_max`.
+    '''
+
+    if memory_max is None:
+        memory_max = block_memory_max
+
+    nbytes = metric_pair_nbytes.get(metric, 410) * max(1, nthreads)
+    return max(1, min(nblock, int(math.sqrt(memory_max / nbytes))))
 
 
-def compute_similarity_matrix(events, metric):
+def iter_blocks(nev, nblock, lower=True):
+    '''
+    Iterate over index ranges of matrix blocks.
+
+    :param lower: only yield blocks on and below the diagonal
+    :returns: iterator over tuples ``(i0, i1, j0, j1)``
+    '''
+
+    for i0 in range(0, nev, nblock):
+        for j0 in range(0, (i0 + 1) if lower else nev, nblock):
+            yield i0, min(i0 + nblock, nev), j0, min(j0 + nblock, nev)
+
+
+def compute_similarity_matrix(events, metric, nthreads=1, nblock=1000,
+                              memory_max=None, **kwargs):
     '''
     Compute and return a similarity matrix for all event pairs, according to
     the desired metric
 
-    :param events: list of pyrocko events
+    The matrix is computed in blocks of up to ``nblock`` x ``nblock`` event
+    pairs with the array implementations of the metrics, optionally by
+    ``nthreads`` threads in parallel. Blocks are made smaller if their
+    temporary arrays would exceed ``memory_max`` bytes in total, see
+    :py:func:`get_block_size`.
+
+    :param events: list of pyrocko events or :py:class:`EventArrays`
     :param metric: metric type (string)
 
     :returns: similarity matrix as NumPy array
     '''
 
+    func = get_matrix_func(metric)
+    if not isinstance(events, EventArrays):
+        events = EventArrays.from_events(events)
+
+    # cached per event, before the blocks are computed
+    if metric == 'kagan_angle':
+        events.get_tpb_rotations()
+    elif metric == 'mt_principal_axis':
+        events.get_axes_angles()
+
     nev = len(events)
     simmat = num.zeros((nev, nev), dtype=float)
-    for i in range(len(events)):
-        for j in range(i):
-            d = get_distance(events[i], events[j], metric)
-            simmat[i, j] = d
-            simmat[j, i] = d
+    nblock = get_block_size(metric, nblock, nthreads, memory_max)
+
+    def fill(block):
+        i0, i1, j0, j1 = block
+        simmat[i0:i1, j0:j1] = func(events[i0:i1], events[j0:j1], **kwargs)
+
+    blocks = list(iter_blocks(nev, nblock))
+    if nthreads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(fill, blocks))
+    else:
+        for block in blocks:
+            fill(block)
+
+    iupper = num.triu_indices(nev)
+    simmat[iupper] = simmat.T[iupper]
+    simmat[num.diag_indices(nev)] = 0.0
 
     return simmat
 
 
+def get_embedding(events, metric, eps):
+    '''
+    Get points in a Euclidean space in which neighbours can be searched.
+
+    For moment tensors, the L2 norm is the Euclidean distance of the 6
+    independent entries, halved. Hypocentres are placed on a sphere, the
+    chord is shorter than the great circle distance. The returned radius
+    includes a margin for the ellipticity of the Earth, candidates must be
+    checked with the exact metric.
+
+    :returns: tuple ``(points, radius)`` or ``None`` if the metric has no
+        embedding or if all events are neighbours due to the clipping of
+        the metric at 1.
+    '''
+
+    if metric == 'mt_l2norm':
+        return events.get_m6s(), 2.0 * eps * (1.0 + 1e-6)
+
+    elif metric in ('hypocentral', 'epicentral'):
+        if eps >= 1.0:
+            return None
+
+        # normalised to the maximum distance of 1000 km
+        r = orthodrome.earthradius / 1000e3
+        lats = events.lats * d2r
+        lons = events.lons * d2r
+        columns = [
+            r * num.cos(lats) * num.cos(lons),
+            r * num.cos(lats) * num.sin(lons),
+            r * num.sin(lats)]
+
+        if metric == 'hypocentral':
+            columns.append(events.depths / 1000e3)
+
+        return num.array(columns).T, eps * 1.02
+
+    else:
+        return None
+
+
+def _threshold_pairs(func, events, ia, ib, eps, **kwargs):
+    ds = func(events[ia], events[ib], **kwargs)
+    mask = ds <= eps
+    return ia[mask], ib[mask]
+
+
+def _candidate_pairs_kdtree(events, metric, eps, npairs):
+    from scipy.spatial import cKDTree
+
+    points, radius = get_embedding(events, metric, eps)
+    pairs = cKDTree(points).query_pairs(radius, output_type='ndarray')
+
+    # same orientation as in the lower triangle of the similarity matrix
+    ia = num.maximum(pairs[:, 0], pairs[:, 1])
+    ib = num.minimum(pairs[:, 0], pairs[:, 1])
+
+    func = metric_pair_funcs[metric]
+    for i0 in range(0, ia.size, npairs):
+        i1 = i0 + npairs
+        yield _threshold_pairs(func, events, ia[i0:i1], ib[i0:i1], eps)
+
+
+def compute_neighbour_graph(events, metric, eps, nthreads=1, nblock=1000,
+                            memory_max=None, **kwargs):
+    '''
+    Find the eps-neighbours of all events without the full similarity matrix.
+
+    For metrics with a Euclidean embedding (``mt_l2norm``, ``hypocentral``,
+    ``epicentral``), candidates are found with a KD-tree and checked with the
+    exact metric. Other metrics are computed in blocks of up to ``nblock`` x
+    ``nblock`` event pairs, optionally by ``nthreads`` threads in parallel,
+    and only the neighbours are kept. Block sizes are limited by
+    ``memory_max``, as in :py:func:`compute_similarity_matrix`. The
+    neighbours are the same as those from
+    :py:func:`compute_similarity_matrix`.
+
+    :param events: list of pyrocko events or :py:class:`EventArrays`
+    :param metric: metric type (string)
+    :param eps: maximum distance of neighbours
+    :returns: neighbour graph ``(indptr, indices)``, see
+        :py:func:`grond.clustering.dbscan.neighbour_graph`
+    '''
+
+    from .dbscan import graph_from_counts
+
+    func = get_matrix_func(metric)
+    if not isinstance(events, EventArrays):
+        events = EventArrays.from_events(events)
+
+    nev = len(events)
+
+    if metric in metric_pair_funcs and not kwargs \
+            and get_embedding(events, metric, eps) is not None:
+
+        nblock = get_block_size(metric, nblock, 1, memory_max)
+        pairs = list(_candidate_pairs_kdtree(
+            events, metric, eps, nblock**2))
+
+    else:
+        if metric == 'kagan_angle':
+            events.get_tpb_rotations()
+        elif metric == 'mt_principal_axis':
+            events.get_axes_angles()
+
+        def neighbours(block):
+            i0, i1, j0, j1 = block
+            ds = func(events[i0:i1], events[j0:j1], **kwargs)
+            ia, ib = num.nonzero(ds <= eps)
+            ia += i0
+            ib += j0
+            lower = ia > ib
+            return ia[lower], ib[lower]
+
+        nblock = get_block_size(metric, nblock, nthreads, memory_max)
+        blocks = iter_blocks(nev, nblock)
+        if nthreads > 1:
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                pairs = list(executor.map(neighbours, blocks))
+        else:
+            pairs = [neighbours(block) for block in blocks]
+
+    if pairs:
+        ia = num.concatenate([p[0] for p in pairs])
+        ib = num.concatenate([p[1] for p in pairs])
+    else:
+        ia = ib = num.zeros(0, dtype=int)
+
+    rows = num.concatenate((ia, ib))
+    cols = num.concatenate((ib, ia))
+    order = num.lexsort((cols, rows))
+
+    return graph_from_counts(
+        num.bincount(rows, minlength=nev), [cols[order]])
+
+
 def load_similarity_matrix(fname):
     '''
     Load a binary similarity matrix from file
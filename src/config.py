@@ -1,10 +1,12 @@
 import os.path as op
+import logging
+
 from pyrocko import guts, gf
 from pyrocko.guts import Bool, List
 
 from .meta import Path, HasPaths, GrondError
 from .dataset import DatasetConfig
-from .analysers.base import AnalyserConfig
+from .analysers.base import AnalyserConfig, AnalyserCache
 from .analysers.target_balancing import TargetBalancingAnalyserConfig
 from .problems.base import ProblemConfig
 from .optimisers.base import OptimiserConfig
@@ -12,6 +14,7 @@ from .targets.base import TargetGroup
 from .version import __version__
 
 guts_prefix = 'grond'
+logger = logging.getLogger('grond.config')
 
 
 def color_diff(diff):
@@ -44,6 +47,12 @@ class EngineConfig(HasPaths):
     gf_store_dirs = List.T(
         Path.T(),
         help='List of Green\'s function stores')
+    shared_stores = Bool.T(
+        default=False,
+        help='Share opened GF stores between the parallel worker processes '
+             'of grond go --cores. The stores are memory-mapped and their '
+             'travel time tables loaded once in the parent process, forked '
+             'workers inherit them instead of loading their own copies.')
 
     def __init__(self, *args, **kwargs):
         HasPaths.__init__(self, *args, **kwargs)
@@ -59,6 +68,28 @@ class EngineConfig(HasPaths):
 
         return self._engine
 
+    def preload_stores(self, store_ids):
+        '''
+        Open GF stores and load their travel time tables.
+
+        Called in the parent process before forking the workers when
+        ``shared_stores`` is enabled. The forked workers inherit this
+        configuration with its engine, so that the index and data mappings
+        and the phase tables are shared with them.
+        '''
+
+        engine = self.get_engine()
+        for store_id in store_ids:
+            try:
+                store = engine.get_store(store_id)
+                store.open()
+                for pdef in store.config.tabulated_phases:
+                    store.get_stored_phase(pdef.id)
+
+            except gf.StoreError as e:
+                logger.warning(
+                    'Could not preload GF store "%s": %s' % (store_id, e))
+
 
 class Config(HasPaths):
     rundir_template = Path.T(
@@ -75,6 +106,11 @@ class Config(HasPaths):
         AnalyserConfig.T(),
         default=[TargetBalancingAnalyserConfig.D()],
         help='List of problem analysers')
+    analyser_cache_dir = Path.T(
+        optional=True,
+        help='Directory to store analyser results in. Results are reused '
+             'for runs with identical analyser inputs, e.g. when re-running '
+             'an event after changing only the optimiser settings.')
     optimiser_config = OptimiserConfig.T(
         help='The optimisers configuration')
     engine_config = EngineConfig.T(
@@ -116,6 +152,17 @@ class Config(HasPaths):
 
         return targets
 
+    def get_analyser_cache(self):
+        if self.analyser_cache_dir is None:
+            return None
+
+        return AnalyserCache(self.expand_path(self.analyser_cache_dir))
+
+    def get_store_ids(self):
+        return sorted(set(
+            target_group.store_id for target_group in self.target_groups
+            if target_group.store_id is not None))
+
     def setup_modelling_environment(self, problem):
         problem.set_engine(self.engine_config.get_engine())
         ds = self.get_dataset(problem.base_source.name)
@@ -7,12 +7,13 @@ import copy
 import shutil
 import glob
 import os.path as op
+import multiprocessing
 from collections import defaultdict
 import numpy as num
 
 from pyrocko.guts import Object, String, Float, List
 from pyrocko import gf, trace, guts, util, weeding
-from pyrocko import parimap, model, marker as pmarker
+from pyrocko import parimap, model
 
 from .dataset import NotFound
 from .problems.base import Problem, load_problem_info_and_data, \
@@ -25,6 +26,7 @@ from .config import read_config
 from . import stats
 from .environment import Environment
 from .monitor import GrondMonitor
+from .forward_cache import ForwardCache, evaluate_models
 
 logger = logging.getLogger('grond.core')
 guts_prefix = 'grond'
@@ -81,6 +83,7 @@ def sarr(a):
 
 
 def forward(rundir_or_config_path, event_names):
+    from pyrocko import marker as pmarker
 
     if not event_names:
         return
@@ -102,7 +105,11 @@ def forward(rundir_or_config_path, event_names):
         for target in problem.targets:
             target.set_dataset(ds)
 
-        payload = [(problem, xbest)]
+        cache = ForwardCache(
+            op.join(rundir, 'forward_cache'), problem,
+            extra=(config.dataset_config,))
+
+        payload = [(problem, xbest, cache)]
 
     else:
         config = read_config(rundir_or_config_path)
@@ -114,13 +121,13 @@ def forward(rundir_or_config_path, event_names):
             problem = config.get_problem(event)
             xref = problem.preconstrain(
                 problem.pack(problem.base_source))
-            payload.append((problem, xref))
+            payload.append((problem, xref, None))
 
     all_trs = []
     events = []
-    for (problem, x) in payload:
+    for (problem, x, cache) in payload:
         ds.empty_cache()
-        results = problem.evaluate(x)
+        results, = evaluate_models(problem, [x], cache=cache)
 
         event = problem.get_source(x).pyrocko_event()
         events.append(event)
@@ -201,22 +208,21 @@ def harvest(rundir, problem=None, nbest=10, force=False, weed=0):
     logger.info('Done harvesting problem "%s".' % problem.name)
 
 
-def cluster(rundir, clustering, metric):
+def cluster(rundir, clustering, metric, nthreads=1):
     env = Environment([rundir])
     history = env.get_history(subset='harvest')
     problem = history.problem
     models = history.models
 
-    events = [problem.get_source(model).pyrocko_event() for model in models]
+    events = [
+        source.pyrocko_event() for source in problem.get_sources(models)]
 
     from grond.clustering import metrics
 
     if metric not in metrics.metrics:
         raise GrondError('Unknown metric: %s' % metric)
 
-    mat = metrics.compute_similarity_matrix(events, metric)
-
-    clusters = clustering.perform(mat)
+    clusters = clustering.perform_events(events, metric, nthreads=nthreads)
 
     labels = num.sort(num.unique(clusters))
     bins = num.concatenate((labels, [labels[-1]+1]))
@@ -247,7 +253,10 @@ def check(
         event_names=None,
         target_string_ids=None,
         show_waveforms=False,
-        n_random_synthetics=10):
+        n_random_synthetics=10,
+        nprocs=1):
+
+    from pyrocko import marker as pmarker
 
     fns = defaultdict(list)
     markers = []
@@ -273,20 +282,16 @@ def check(
 
             check_problem(problem)
 
-            results_list = []
-            sources = []
             if n_random_synthetics == 0:
-                x = problem.get_reference_model()
-                sources.append(problem.base_source)
-                results = problem.evaluate(x)
-                results_list.append(results)
+                xs = [problem.get_reference_model()]
+                sources = [problem.base_source]
 
             else:
-                for i in range(n_random_synthetics):
-                    x = problem.get_random_model()
-                    sources.append(problem.get_source(x))
-                    results = problem.evaluate(x)
-                    results_list.append(results)
+                xs = [problem.get_random_model()
+                      for i in range(n_random_synthetics)]
+                sources = [problem.get_source(x) for x in xs]
+
+            results_list = evaluate_models(problem, xs, nprocs=nprocs)
 
             if show_waveforms:
                 engine = config.engine_config.get_engine()
@@ -424,25 +429,80 @@ def check(
 g_state = {}
 
 
+def setup_shared_stores(config):
+    engine_config = config.engine_config
+    if not engine_config.shared_stores:
+        return
+
+    try:
+        multiprocessing.get_context('fork')
+    except ValueError:
+        logger.warning(
+            'Shared GF stores need the "fork" start method for worker '
+            'processes, stores are opened by each worker.')
+        return
+
+    store_ids = config.get_store_ids()
+    logger.info('Preloading shared GF stores: %s' % ', '.join(store_ids))
+    engine_config.preload_stores(store_ids)
+
+
 def go(environment,
        force=False, preserve=False,
-       nparallel=1, status='state'):
+       nparallel=1, status='state', ncores=None):
+    '''
+    Process the selected events.
+
+    :returns: names of the events whose processing failed
+    '''
 
     g_data = (environment, force, preserve,
               status, nparallel)
     g_state[id(g_data)] = g_data
 
     nevents = environment.nevents_selected
-    for x in parimap.parimap(
+
+    if ncores is not None:
+        from .scheduler import EventScheduler
+
+        config = environment.get_config()
+        setup_shared_stores(config)
+
+        # costs are estimated by the workers, once the targets are set up
+        scheduler = EventScheduler(
+            ncores, environment.get_selected_event_names(),
+            nparallel=nparallel if nparallel != 1 else None)
+
+        scheduler.run(process_event, (id(g_data),))
+        return []
+
+    if nparallel != 1 \
+            and environment.get_config().engine_config.shared_stores:
+
+        logger.warning(
+            'Shared GF stores are only used when events are scheduled with '
+            '--cores, stores are opened by each worker.')
+
+    event_names = environment.get_selected_event_names()
+    failed = []
+    for ievent, ok in enumerate(parimap.parimap(
             process_event,
             range(environment.nevents_selected),
             [id(g_data)] * nevents,
-            nprocs=nparallel):
+            nprocs=nparallel)):
+
+        if ok is False:
+            failed.append(event_names[ievent])
 
-        pass
+    return failed
 
 
-def process_event(ievent, g_data_id):
+def process_event(ievent, g_data_id, thread_budget=None):
+    '''
+    Set up and optimise the problem of an event.
+
+    :returns: ``False`` if the optimisation failed, ``True`` otherwise
+    '''
 
     environment, force, preserve, status, nparallel = \
         g_state[g_data_id]
@@ -455,6 +515,11 @@ def process_event(ievent, g_data_id):
     ds = config.get_dataset(event_name)
     event = ds.get_event()
     problem = config.get_problem(event)
+    if thread_budget is not None:
+        from .scheduler import estimate_problem_cost
+        thread_budget.set_cost(estimate_problem_cost(
+            problem, config.engine_config.get_engine()))
+        thread_budget.attach(problem)
 
     synt = ds.synthetic_test
     if synt:
@@ -476,7 +541,7 @@ def process_event(ievent, g_data_id):
         else:
             logger.warn('Skipping problem "%s": rundir already exists: %s' %
                         (problem.name, rundir))
-            return
+            return True
 
     util.ensuredir(rundir)
 
@@ -487,8 +552,10 @@ def process_event(ievent, g_data_id):
 
     logger.info('Analysing problem "%s".' % problem.name)
 
+    analyser_cache = config.get_analyser_cache()
     for analyser_conf in config.analyser_configs:
         analyser = analyser_conf.get_analyser()
+        analyser.set_cache(analyser_cache)
         analyser.analyse(problem, ds)
 
     basepath = config.get_basepath()
@@ -509,6 +576,7 @@ def process_event(ievent, g_data_id):
     if synt and synt.inject_solution:
         xs_inject = synt.get_x()[num.newaxis, :]
 
+    ok = True
     try:
         if xs_inject is not None:
             from .optimisers import highscore
@@ -527,9 +595,11 @@ def process_event(ievent, g_data_id):
 
     except BadProblem as e:
         logger.error(str(e))
+        ok = False
 
     except GrondError as e:
         logger.error(str(e))
+        ok = False
 
     finally:
         if monitor:
@@ -542,6 +612,8 @@ def process_event(ievent, g_data_id):
     logger.info(
         'Done with problem "%s", rundir is "%s".' % (problem.name, rundir))
 
+    return ok
+
 
 class ParameterStats(Object):
     name = String.T()
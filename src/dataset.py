@@ -6,8 +6,7 @@ import math
 import numpy as num
 
 from collections import defaultdict
-from pyrocko import util, pile, model, config, trace, \
-    marker as pmarker
+from pyrocko import util, pile, model, config, trace
 from pyrocko.io.io_common import FileLoadError
 from pyrocko.fdsn import enhanced_sacpz, station as fs
 from pyrocko.guts import (Object, Tuple, String, Float, List, Bool, dump_all,
@@ -95,6 +94,7 @@ class Dataset(object):
         self.synthetic_test = None
         self._picks = None
         self._cache = {}
+        self._station_coordinates = None
         self._event_name = event_name
 
     def empty_cache(self):
@@ -109,6 +109,8 @@ class Dataset(object):
             pyrocko_stations_filename=None,
             stationxml_filenames=None):
 
+        self._station_coordinates = None
+
         if stations is not None:
             for station in stations:
                 self.stations[station.nsl()] = station
@@ -179,6 +181,8 @@ class Dataset(object):
                     fs.load_xml(filename=stationxml_filename))
 
     def add_clippings(self, markers_filename):
+        from pyrocko import marker as pmarker
+
         markers = pmarker.load_markers(markers_filename)
         clippings = {}
         for marker in markers:
@@ -202,6 +206,7 @@ class Dataset(object):
 
     def add_blacklist(self, blacklist=[], filenames=None):
         logger.debug('Loading blacklisted stations...')
+        self._station_coordinates = None
         if filenames:
             blacklist = list(blacklist)
             for filename in filenames:
@@ -219,6 +224,7 @@ class Dataset(object):
 
     def add_whitelist(self, whitelist=[], filenames=None):
         logger.debug('Loading whitelisted stations...')
+        self._station_coordinates = None
         if filenames:
             whitelist = list(whitelist)
             for filename in filenames:
@@ -244,6 +250,8 @@ class Dataset(object):
             (sc.codes, sc) for sc in load_station_corrections(filename))
 
     def add_picks(self, filename):
+        from pyrocko import marker as pmarker
+
         self.pick_markers.extend(
             pmarker.load_markers(filename))
 
@@ -401,6 +409,24 @@ class Dataset(object):
                 if not self.is_blacklisted(self.stations[k])
                 and self.is_whitelisted(self.stations[k])]
 
+    def get_station_coordinates(self):
+        '''
+        Get stations and their coordinates as arrays.
+
+        :returns: tuple ``(stations, lats, lons, depths)``, with the stations
+            as returned by :py:meth:`get_stations`
+        '''
+
+        if self._station_coordinates is None:
+            stations = self.get_stations()
+            self._station_coordinates = (
+                stations,
+                num.array([st.lat for st in stations], dtype=float),
+                num.array([st.lon for st in stations], dtype=float),
+                num.array([st.depth for st in stations], dtype=float))
+
+        return self._station_coordinates
+
     def get_kite_scenes(self):
         return self.kite_scenes
 
@@ -863,6 +889,8 @@ class Dataset(object):
         raise NotFound('No such event: %s' % self._event_name)
 
     def get_picks(self):
+        from pyrocko import marker as pmarker
+
         if self._picks is None:
             hash_to_name = {}
             names = set()
@@ -4,6 +4,7 @@ import os.path as op
 
 from grond.config import read_config
 from grond import meta, run_info
+from grond.forward_cache import ForwardCache, evaluate_models
 from grond.problems.base import load_optimiser_info, load_problem_info, \
     ModelHistory
 
@@ -46,6 +47,7 @@ class Environment(object):
         self._selected_event_names = None
         self._config = None
         self._plot_collection_manager = None
+        self._nprocs_modelling = 1
         if isinstance(args, str):
             args = [args]
 
@@ -90,6 +92,7 @@ class Environment(object):
         self._dataset = None
         self._optimiser = None
         self._problem = None
+        self._forward_cache = None
 
     def get_config(self):
         if self._config is None:
@@ -241,6 +244,41 @@ class Environment(object):
         for target in self.get_problem().targets:
             target.set_dataset(ds)
 
+    def set_nprocs_modelling(self, nprocs):
+        self._nprocs_modelling = max(1, nprocs)
+
+    def get_nprocs_modelling(self):
+        return self._nprocs_modelling
+
+    def get_forward_cache(self):
+        '''
+        Get cache of forward modelling results, ``None`` without rundir.
+
+        :py:meth:`setup_modelling` must be called before.
+        '''
+        if self._forward_cache is None:
+            try:
+                path = op.join(self.get_rundir_path(), 'forward_cache')
+            except NoRundirAvailable:
+                return None
+
+            self._forward_cache = ForwardCache(
+                path, self.get_problem(),
+                extra=(self.get_config().dataset_config,))
+
+        return self._forward_cache
+
+    def evaluate_models(self, xs):
+        '''
+        Evaluate models through the forward cache of the run.
+
+        See :py:func:`grond.forward_cache.evaluate_models`.
+        '''
+        return evaluate_models(
+            self.get_problem(), xs,
+            cache=self.get_forward_cache(),
+            nprocs=self.get_nprocs_modelling())
+
     def get_plot_classes(self):
         '''Discover all plot classes relevant for the setup.'''
 
@@ -0,0 +1,310 @@
+'''
+Cache of forward modelling results.
+
+Plots and checks evaluate the same models again and again, e.g. the best
+model of a run is modelled by several waveform plots and again on every
+report update. Results of :py:meth:`grond.Problem.evaluate` (processed
+traces, spectra and misfits) are stored under the rundir::
+
+    <rundir>/forward_cache/<fingerprint>/<model>.pickle
+
+The fingerprint covers the problem setup, the dataset configuration, the
+sizes and modification times of the dataset files and the configurations of
+the GF stores used, so that a changed setup or changed data never picks up
+stale results. Entries of other fingerprints are removed and the number of
+entries is limited, dropping the least recently used ones. Models which are
+not in the cache are evaluated in parallel in a pool of worker processes.
+'''
+
+import os
+import uuid
+import shutil
+import pickle
+import hashlib
+import logging
+import os.path as op
+import multiprocessing
+
+import numpy as num
+
+from pyrocko import util
+from pyrocko.guts import List
+
+from grond.meta import GrondError, Path, expand_template
+from grond.dataset import DatasetConfig
+from grond.analysers.base import fingerprint
+
+logger = logging.getLogger('grond.forward_cache')
+
+nentries_max_default = 1000
+
+
+def dataset_file_states(dataset_config, event_name):
+    '''
+    Get paths, sizes and modification times of the files of a dataset.
+
+    Directories, e.g. those of ``waveform_paths``, are scanned recursively.
+
+    :param dataset_config: :py:class:`grond.DatasetConfig` object
+    :param event_name: name of the event, to expand path templates
+    :returns: sorted list of ``(path, size, mtime)`` tuples, ``size`` and
+        ``mtime`` are ``None`` for missing files
+    '''
+
+    def extra(path):
+        return expand_template(path, dict(event_name=event_name))
+
+    paths = []
+    for prop in dataset_config.T.properties:
+        value = getattr(dataset_config, prop.name)
+        if value is None or prop.name == 'path_prefix':
+            continue
+
+        if isinstance(prop, Path.T):
+            paths.append(value)
+        elif isinstance(prop, List.T) and isinstance(prop.content_t, Path.T):
+            paths.extend(value)
+
+    filenames = set()
+    for path in dataset_config.expand_path(paths, extra=extra):
+        if op.isdir(path):
+            for dirpath, _, fns in os.walk(path):
+                filenames.update(op.join(dirpath, fn) for fn in fns)
+        else:
+            filenames.add(path)
+
+    states = []
+    for fn in sorted(filenames):
+        try:
+            st = os.stat(fn)
+            states.append((fn, st.st_size, st.st_mtime))
+        except OSError:
+            states.append((fn, None, None))
+
+    return states
+
+
+def problem_fingerprint(problem, *extra):
+    '''
+    Digest of the inputs defining the forward modelling of a problem.
+
+    For a :py:class:`grond.DatasetConfig` in ``extra``, the state of the
+    dataset files is included, see :py:func:`dataset_file_states`.
+
+    :param problem: :py:class:`grond.Problem` object, set up for modelling
+    :param extra: further inputs, e.g. the dataset configuration
+    '''
+
+    engine = problem.get_engine()
+    if engine is None:
+        raise GrondError(
+            'Cannot fingerprint problem, modelling is not set up!')
+
+    args = [problem]
+    store_ids = sorted(set(
+        target.store_id for target in problem.targets
+        if getattr(target, 'store_id', None) is not None))
+
+    for store_id in store_ids:
+        args.append(engine.get_store_config(store_id))
+
+    for arg in extra:
+        args.append(arg)
+        if isinstance(arg, DatasetConfig):
+            args.append(dataset_file_states(arg, problem.base_source.name))
+
+    return fingerprint(*args)
+
+
+def model_key(x):
+    x = num.ascontiguousarray(x, dtype=num.float64)
+    return hashlib.sha1(x.tobytes()).hexdigest()
+
+
+class ForwardCache(object):
+    '''
+    Directory-based store of forward modelling results of a problem.
+
+    :param path: cache directory, usually ``<rundir>/forward_cache``
+    :param problem: :py:class:`grond.Problem` object
+    :param extra: further inputs for :py:func:`problem_fingerprint`
+    :param nentries_max: maximum number of entries kept in the cache
+
+    Entries of other fingerprints are removed when the cache is opened.
+    '''
+
+    def __init__(
+            self, path, problem, extra=(),
+            nentries_max=nentries_max_default):
+
+        self.path = path
+        self.fingerprint = problem_fingerprint(problem, *extra)
+        self.nentries_max = nentries_max
+        self.remove_stale()
+
+    def entries_path(self):
+        return op.join(self.path, self.fingerprint)
+
+    def entry_path(self, x):
+        return op.join(self.entries_path(), model_key(x) + '.pickle')
+
+    def remove_stale(self):
+        '''
+        Remove the entries of other fingerprints.
+        '''
+        if not op.isdir(self.path):
+            return
+
+        for entry in os.listdir(self.path):
+            if entry != self.fingerprint:
+                logger.debug(
+                    'Removing stale forward cache "%s".' % entry)
+
+                shutil.rmtree(op.join(self.path, entry), ignore_errors=True)
+
+    def prune(self):
+        '''
+        Remove the least recently used entries exceeding ``nentries_max``.
+        '''
+        dirpath = self.entries_path()
+        entries = []
+        for fn in os.listdir(dirpath):
+            if fn.endswith('.pickle'):
+                fn = op.join(dirpath, fn)
+                try:
+                    entries.append((os.stat(fn).st_mtime, fn))
+                except OSError:
+                    pass
+
+        if len(entries) <= self.nentries_max:
+            return
+
+        entries.sort()
+        for _, fn in entries[:len(entries) - self.nentries_max]:
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+
+    def get(self, x):
+        fn = self.entry_path(x)
+        if not op.exists(fn):
+            return None
+
+        try:
+            with open(fn, 'rb') as f:
+                results = pickle.load(f)
+
+            os.utime(fn, None)
+            return results
+
+        except Exception as e:
+            logger.warning(
+                'Ignoring unreadable forward cache entry "%s": %s' % (fn, e))
+
+            return None
+
+    def put(self, x, results):
+        fn = self.entry_path(x)
+        util.ensuredirs(fn)
+        tmp_path = fn + '.%s.tmp' % uuid.uuid4().hex
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.rename(tmp_path, fn)
+            self.prune()
+
+        except Exception as e:
+            logger.warning(
+                'Could not write forward cache entry "%s": %s' % (fn, e))
+
+            if op.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+g_problem = None
+
+
+def _init_worker(problem):
+    global g_problem
+    g_problem = problem
+
+
+def _evaluate_worker(x):
+    return g_problem.evaluate(x)
+
+
+def _get_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return multiprocessing.get_context()
+
+
+def evaluate_models(problem, xs, cache=None, nprocs=1):
+    '''
+    Evaluate several models, using cached results where available.
+
+    Models missing in the cache are evaluated with ``result_mode='full'``,
+    in a pool of ``nprocs`` worker processes if ``nprocs > 1``, and added to
+    the cache.
+
+    :param problem: :py:class:`grond.Problem` object, set up for modelling
+    :param xs: sequence of model vectors
+    :param cache: :py:class:`ForwardCache` object or ``None``
+    :param nprocs: number of worker processes
+    :returns: list with the results of :py:meth:`grond.Problem.evaluate` for
+        each model
+    '''
+
+    xs = [num.asarray(x, dtype=float) for x in xs]
+    results_list = [None] * len(xs)
+    imisses = []
+    for i, x in enumerate(xs):
+        if cache is not None:
+            results_list[i] = cache.get(x)
+
+        if results_list[i] is None:
+            imisses.append(i)
+
+    if cache is not None:
+        logger.debug(
+            'Forward cache: %i hits, %i misses.' % (
+                len(xs) - len(imisses), len(imisses)))
+
+    if not imisses:
+        return results_list
+
+    xs_miss = [xs[i] for i in imisses]
+    nprocs = min(nprocs, len(imisses))
+    if nprocs > 1 and multiprocessing.current_process().daemon:
+        logger.debug(
+            'Cannot evaluate models in parallel from within a worker '
+            'process.')
+        nprocs = 1
+
+    if nprocs > 1:
+        with _get_context().Pool(
+                nprocs, initializer=_init_worker,
+                initargs=(problem,)) as pool:
+
+            results_miss = pool.map(_evaluate_worker, xs_miss, chunksize=1)
+
+    else:
+        results_miss = [problem.evaluate(x) for x in xs_miss]
+
+    for i, results in zip(imisses, results_miss):
+        results_list[i] = results
+        if cache is not None:
+            cache.put(xs[i], results)
+
+    return results_list
+
+
+__all__ = '''
+    ForwardCache
+    dataset_file_states
+    evaluate_models
+    problem_fingerprint
+'''.split()
@@ -0,0 +1,481 @@
+'''
+Filesystem-backed job queue for processing many events on many hosts.
+
+The queue is a directory on a shared filesystem, no server is involved::
+
+    <queue>/queue.yaml           -- QueueInfo: config and go options
+    <queue>/locks/<event>/       -- claimed events (mkdir is atomic)
+    <queue>/locks/<event>/owner  -- JobOwner: host and pid of the worker
+    <queue>/locks/<event>/heartbeat -- touched regularly by the worker
+    <queue>/done/<event>         -- JobResult, written when finished
+
+Workers claim events by creating their lock directory. Events whose
+heartbeat is older than the stale timeout are reclaimed: the lock directory
+is renamed away, which only one of the competing workers can do, and the
+event is claimed anew and processed from scratch, replacing the rundir left
+behind by the dead worker. Another worker may have reclaimed the event and
+created a fresh lock between the staleness check and the rename. To catch
+this, the renamed lock is compared with the one observed as stale. If it
+differs, it is put back and the reclaim is abandoned. Each claim writes a
+unique token to the owner file. A worker only removes a lock carrying its
+own token, so a slow worker does not remove the lock of the worker which
+reclaimed its event.
+'''
+
+import os
+import os.path as op
+import time
+import uuid
+import shutil
+import socket
+import logging
+import threading
+
+from pyrocko import guts, util
+from pyrocko.guts import Object, String, Bool, List, Float, Int
+
+from .meta import GrondError
+
+guts_prefix = 'grond'
+logger = logging.getLogger('grond.jobqueue')
+
+
+class QueueInfo(Object):
+    config_path = String.T(
+        help='Absolute path to the Grond configuration file.')
+    event_names = List.T(
+        String.T(),
+        help='Names of the events to process.')
+    force = Bool.T(default=False)
+    preserve = Bool.T(default=False)
+
+
+class JobOwner(Object):
+    host = String.T()
+    pid = Int.T()
+    time_claimed = Float.T()
+    token = String.T(
+        optional=True,
+        help='Unique identifier of the claim.')
+
+
+class JobResult(Object):
+    event_name = String.T()
+    host = String.T()
+    pid = Int.T()
+    time_start = Float.T()
+    time_stop = Float.T()
+    ok = Bool.T()
+    message = String.T(optional=True)
+
+
+class JobQueue(object):
+    '''
+    Directory-based queue of events.
+
+    :param path: queue directory
+    :param heartbeat_interval: interval at which workers touch the heartbeat
+        file of their current event [s]
+    :param stale_timeout: age of the heartbeat after which an event is
+        considered abandoned and is reclaimed [s]
+    '''
+
+    def __init__(self, path, heartbeat_interval=30., stale_timeout=300.):
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_timeout = stale_timeout
+        self._info = None
+        self._tokens = {}
+        self._reclaimed = set()
+
+    def info_path(self):
+        return op.join(self.path, 'queue.yaml')
+
+    def lock_path(self, event_name):
+        return op.join(self.path, 'locks', event_name)
+
+    def done_path(self, event_name):
+        return op.join(self.path, 'done', event_name)
+
+    @classmethod
+    def create(cls, path, config_path, event_names, force=False,
+               preserve=False, **kwargs):
+        '''
+        Set up queue directory, adding events to an existing queue.
+
+        With ``force``, the given events are processed again, even if they
+        have been finished before.
+        '''
+
+        queue = cls(path, **kwargs)
+        util.ensuredir(op.join(path, 'locks'))
+        util.ensuredir(op.join(path, 'done'))
+
+        config_path = op.abspath(config_path)
+        if op.exists(queue.info_path()):
+            info = queue.get_info()
+            if info.config_path != config_path:
+                raise GrondError(
+                    'Queue "%s" belongs to another configuration: %s' % (
+                        path, info.config_path))
+
+            info.event_names.extend(
+                name for name in event_names if name not in info.event_names)
+            info.force = force
+            info.preserve = preserve
+
+        else:
+            info = QueueInfo(
+                config_path=config_path,
+                event_names=list(event_names),
+                force=force,
+                preserve=preserve)
+
+        if force:
+            for event_name in event_names:
+                try:
+                    os.unlink(queue.done_path(event_name))
+                except OSError:
+                    pass
+
+        tmp_path = queue.info_path() + '.%s.tmp' % uuid.uuid4().hex
+        guts.dump(info, filename=tmp_path)
+        os.rename(tmp_path, queue.info_path())
+        queue._info = info
+        return queue
+
+    def get_info(self):
+        if self._info is None:
+            if not op.exists(self.info_path()):
+                raise GrondError('No job queue found at "%s".' % self.path)
+
+            self._info = guts.load(filename=self.info_path())
+
+        return self._info
+
+    def reload(self):
+        self._info = None
+
+    def fs_time(self):
+        '''
+        Current time of the shared filesystem.
+
+        Heartbeats are compared against this time, not against the local
+        clock, so clock differences between hosts do not matter.
+        '''
+
+        fn = op.join(self.path, 'locks', '.clock-%s-%i' % (
+            socket.gethostname(), os.getpid()))
+
+        with open(fn, 'a'):
+            os.utime(fn, None)
+
+        t = os.stat(fn).st_mtime
+        os.unlink(fn)
+        return t
+
+    def is_done(self, event_name):
+        return op.exists(self.done_path(event_name))
+
+    def get_status(self):
+        '''
+        Get the names of pending, running and finished events.
+        '''
+
+        pending, running, done = [], [], []
+        for event_name in self.get_info().event_names:
+            if self.is_done(event_name):
+                done.append(event_name)
+            elif op.exists(self.lock_path(event_name)):
+                running.append(event_name)
+            else:
+                pending.append(event_name)
+
+        return pending, running, done
+
+    def claim(self, event_name):
+        '''
+        Try to claim an event.
+
+        :returns: ``True`` if the event has been claimed by this process
+        '''
+
+        if self.is_done(event_name):
+            return False
+
+        lock_path = self.lock_path(event_name)
+        try:
+            os.mkdir(lock_path)
+        except OSError:
+            if not self.reclaim_if_stale(event_name):
+                return False
+
+            try:
+                os.mkdir(lock_path)
+            except OSError:
+                return False
+
+            self._reclaimed.add(event_name)
+
+        if self.is_done(event_name):
+            shutil.rmtree(lock_path, ignore_errors=True)
+            self._reclaimed.discard(event_name)
+            return False
+
+        token = uuid.uuid4().hex
+        guts.dump(
+            JobOwner(
+                host=socket.gethostname(),
+                pid=os.getpid(),
+                time_claimed=time.time(),
+                token=token),
+            filename=op.join(lock_path, 'owner'))
+
+        self._tokens[event_name] = token
+        self.touch(event_name)
+        return True
+
+    def was_reclaimed(self, event_name):
+        '''
+        Check if the claim of an event took it over from a dead worker.
+
+        The dead worker may have left a partial rundir behind.
+        '''
+
+        return event_name in self._reclaimed
+
+    def touch(self, event_name):
+        fn = op.join(self.lock_path(event_name), 'heartbeat')
+        with open(fn, 'a'):
+            os.utime(fn, None)
+
+    def get_owner_token(self, lock_path):
+        try:
+            return guts.load(filename=op.join(lock_path, 'owner')).token
+        except Exception:
+            return None
+
+    def get_lock_state(self, lock_path):
+        '''
+        Get identity and last heartbeat of a lock directory.
+
+        :returns: tuple ``(inode, token, tmod)`` with the inode of the
+            directory, the token of its owner and the modification time of
+            its heartbeat, or ``None`` if there is no lock
+        '''
+
+        try:
+            inode = os.stat(lock_path).st_ino
+        except OSError:
+            return None
+
+        token = self.get_owner_token(lock_path)
+        for fn in ('heartbeat', 'owner', ''):
+            try:
+                tmod = os.stat(op.join(lock_path, fn)).st_mtime
+                return inode, token, tmod
+            except OSError:
+                pass
+
+        return None
+
+    def heartbeat_age(self, event_name):
+        state = self.get_lock_state(self.lock_path(event_name))
+        if state is None:
+            return None
+
+        return self.fs_time() - state[2]
+
+    def reclaim_if_stale(self, event_name):
+        '''
+        Remove the lock of an event if its worker stopped sending heartbeats.
+
+        :returns: ``True`` if the lock has been removed by this process
+        '''
+
+        lock_path = self.lock_path(event_name)
+        state = self.get_lock_state(lock_path)
+        if state is None:
+            return False
+
+        age = self.fs_time() - state[2]
+        if age < self.stale_timeout:
+            return False
+
+        stale_path = lock_path + '.stale-%s' % uuid.uuid4().hex
+        try:
+            os.rename(lock_path, stale_path)
+        except OSError:
+            return False
+
+        if self.get_lock_state(stale_path) != state:
+            # lock has been renewed or reclaimed since it was checked
+            self._restore_lock(stale_path, lock_path)
+            return False
+
+        logger.warning(
+            'Reclaiming event "%s", no heartbeat for %.0f s.' % (
+                event_name, age))
+
+        shutil.rmtree(stale_path, ignore_errors=True)
+        return True
+
+    def _restore_lock(self, moved_path, lock_path):
+        try:
+            os.rename(moved_path, lock_path)
+        except OSError as e:
+            logger.warning(
+                'Could not restore lock "%s": %s' % (lock_path, e))
+
+    def release(self, event_name, result):
+        '''
+        Store the result of an event and remove its lock.
+
+        The lock is only removed if it is still owned by this queue object.
+        If the event has been reclaimed by another worker in the meantime,
+        that worker's lock is left in place.
+        '''
+
+        tmp_path = self.done_path(event_name) + '.%s.tmp' % uuid.uuid4().hex
+        guts.dump(result, filename=tmp_path)
+        os.rename(tmp_path, self.done_path(event_name))
+
+        self._reclaimed.discard(event_name)
+        token = self._tokens.pop(event_name, None)
+        lock_path = self.lock_path(event_name)
+        release_path = lock_path + '.release-%s' % uuid.uuid4().hex
+        try:
+            os.rename(lock_path, release_path)
+        except OSError:
+            return
+
+        if token is None or self.get_owner_token(release_path) != token:
+            self._restore_lock(release_path, lock_path)
+            logger.warning(
+                'Event "%s" has been reclaimed by another worker, leaving '
+                'its lock in place.' % event_name)
+
+            return
+
+        shutil.rmtree(release_path, ignore_errors=True)
+
+
+class Heartbeat(object):
+    def __init__(self, queue, event_name):
+        self._queue = queue
+        self._event_name = event_name
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self._queue.heartbeat_interval):
+            try:
+                self._queue.touch(self._event_name)
+            except OSError as e:
+                logger.warning('Heartbeat failed: %s' % e)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def submit(queue_path, config_path, event_names, force=False,
+           preserve=False):
+    '''
+    Add events to a job queue, creating the queue if needed.
+    '''
+
+    queue = JobQueue.create(
+        queue_path, config_path, event_names, force=force, preserve=preserve)
+
+    pending, running, done = queue.get_status()
+    logger.info(
+        'Job queue "%s": %i pending, %i running, %i done.' % (
+            queue_path, len(pending), len(running), len(done)))
+
+    return queue
+
+
+def work(queue_path, wait=True, poll_interval=10., **kwargs):
+    '''
+    Process events from a job queue until all are done.
+
+    :param wait: if ``True``, keep polling while events claimed by other
+        workers are unfinished, so that events of dead workers are reclaimed
+    :returns: number of events processed by this worker
+    '''
+
+    from .environment import Environment
+    from .core import go
+
+    queue = JobQueue(queue_path, **kwargs)
+
+    nprocessed = 0
+    while True:
+        queue.reload()
+        info = queue.get_info()
+        claimed = None
+        for event_name in info.event_names:
+            if queue.claim(event_name):
+                claimed = event_name
+                break
+
+        if claimed is None:
+            pending, running, _ = queue.get_status()
+            if not wait or not (pending or running):
+                break
+
+            time.sleep(poll_interval)
+            continue
+
+        # the partial rundir of a dead worker must not be taken for a
+        # finished run
+        force = info.force or queue.was_reclaimed(claimed)
+
+        logger.info('Worker claimed event "%s".' % claimed)
+        tstart = time.time()
+        ok, message = True, None
+        with Heartbeat(queue, claimed):
+            try:
+                env = Environment([info.config_path, claimed])
+                failed = go(env, force=force, preserve=info.preserve,
+                            status='quiet')
+
+                if failed:
+                    ok, message = False, 'Optimisation failed.'
+                    logger.error(
+                        'Processing event "%s" failed.' % claimed)
+
+            except Exception as e:
+                ok, message = False, str(e)
+                logger.error(
+                    'Processing event "%s" failed: %s' % (claimed, e))
+
+        queue.release(claimed, JobResult(
+            event_name=claimed,
+            host=socket.gethostname(),
+            pid=os.getpid(),
+            time_start=tstart,
+            time_stop=time.time(),
+            ok=ok,
+            message=message))
+
+        nprocessed += 1
+
+    logger.info('Worker done, processed %i events.' % nprocessed)
+    return nprocessed
+
+
+__all__ = '''
+    QueueInfo
+    JobOwner
+    JobResult
+    JobQueue
+    submit
+    work
+'''.split()
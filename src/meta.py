@@ -253,10 +253,18 @@ class HasPaths(Object):
     def set_basepath(self, basepath, parent_path_prefix=None):
         self._basepath = basepath
         self._parent_path_prefix = parent_path_prefix
-        for (prop, val) in self.T.ipropvals(self):
+        for val in self._iter_has_paths_children():
+            val.set_basepath(
+                basepath, self.path_prefix or self._parent_path_prefix)
+
+    def _iter_has_paths_children(self):
+        for val in self.T.ivals(self):
             if isinstance(val, HasPaths):
-                val.set_basepath(
-                    basepath, self.path_prefix or self._parent_path_prefix)
+                yield val
+            elif isinstance(val, list):
+                for v in val:
+                    if isinstance(v, HasPaths):
+                        yield v
 
     def get_basepath(self):
         assert self._basepath is not None
@@ -271,10 +279,9 @@ class HasPaths(Object):
             self.path_prefix = op.normpath(xjoin(xrelpath(
                 self._basepath, new_basepath), self.path_prefix))
 
-        for val in self.T.ivals(self):
-            if isinstance(val, HasPaths):
-                val.change_basepath(
-                    new_basepath, self.path_prefix or self._parent_path_prefix)
+        for val in self._iter_has_paths_children():
+            val.change_basepath(
+                new_basepath, self.path_prefix or self._parent_path_prefix)
 
         self._basepath = new_basepath
 
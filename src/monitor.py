@@ -9,6 +9,7 @@ from datetime import timedelta
 
 from pyrocko import util, guts
 from grond.environment import Environment
+from grond.timing import load_rundir_timings, timings_filename
 
 
 logger = logging.getLogger('grond.monit')
@@ -83,6 +84,8 @@ class GrondMonitor(threading.Thread):
         self._iiter = 0
         self._iter_buffer = RingBuffer(20)
         self._tm = None
+        self._timings = None
+        self._timings_mtime = None
 
     def run(self):
         logger.info('Waiting to follow environment %s...' % self.rundir)
@@ -142,6 +145,22 @@ class GrondMonitor(threading.Thread):
         return timedelta(seconds=round((self.niter - self.iiter)
                          / self.iter_per_second))
 
+    def get_timings_summary(self):
+        fn = op.join(self.rundir, timings_filename)
+        try:
+            mtime = op.getmtime(fn)
+        except OSError:
+            return None
+
+        if mtime != self._timings_mtime:
+            self._timings = load_rundir_timings(self.rundir)
+            self._timings_mtime = mtime
+
+        if self._timings is None:
+            return None
+
+        return self._timings.summary()
+
     def extend(self, *args):
         ''' Connected and called through the self.history.add_listener '''
         self.iiter = self.history.nmodels
@@ -161,6 +180,9 @@ class GrondMonitor(threading.Thread):
               .format(s=self, p=problem))
         lnadd('Iteration: {s.iiter} / {s.niter}'
               .format(s=self))
+        timings_summary = self.get_timings_summary()
+        if timings_summary is not None:
+            lnadd(timings_summary)
         if optimiser_status.extra_header is not None:
             lnadd(optimiser_status.extra_header)
 
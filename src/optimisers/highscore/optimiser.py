@@ -10,7 +10,9 @@ from collections import OrderedDict
 from pyrocko.guts import StringChoice, Int, Float, Object, List
 from pyrocko.guts_array import Array
 
-from grond.meta import GrondError, Forbidden, has_get_plot_classes
+from grond.meta import GrondError, has_get_plot_classes
+from grond.timing import timed, TimingRecorder, set_recorder, \
+    timings_filename
 from grond.problems.base import ModelHistory
 from grond.optimisers.base import Optimiser, OptimiserConfig, BadProblem, \
     OptimiserStatus
@@ -110,6 +112,8 @@ class SamplerPhase(Object):
         optional=True,
         help='Random state seed.')
 
+    nbatch_max = 64
+
     def __init__(self, *args, **kwargs):
         Object.__init__(self, *args, **kwargs)
         self._rstate = None
@@ -124,17 +128,41 @@ class SamplerPhase(Object):
         raise NotImplementedError
 
     def get_sample(self, problem, iiter, chains):
+        '''
+        Draw a candidate sample which passes the problem's preconstraints.
+
+        Candidates are preconstrained in batches with
+        :py:meth:`~grond.Problem.preconstrain_many`. The first batch holds
+        a single candidate, so that the random sequence is unchanged while
+        candidates are accepted. After each rejected batch, the batch size
+        is doubled up to ``nbatch_max``.
+        '''
+
         assert 0 <= iiter < self.niterations
 
         ntries_preconstrain = 0
-        for ntries_preconstrain in range(self.ntries_preconstrain_limit):
-            try:
-                sample = self.get_raw_sample(problem, iiter, chains)
-                sample.preconstrain(problem)
+        nbatch = 1
+        while ntries_preconstrain < self.ntries_preconstrain_limit:
+            nbatch = min(
+                nbatch, self.ntries_preconstrain_limit - ntries_preconstrain)
+
+            with timed('sample'):
+                samples = [
+                    self.get_raw_sample(problem, iiter, chains)
+                    for _ in range(nbatch)]
+
+            with timed('preconstrain'):
+                xs, ok = problem.preconstrain_many(
+                    num.array([sample.model for sample in samples]))
+
+            iok = num.flatnonzero(ok)
+            if iok.size:
+                sample = samples[iok[0]]
+                sample.model = xs[iok[0], :]
                 return sample
 
-            except Forbidden:
-                pass
+            ntries_preconstrain += nbatch
+            nbatch = min(nbatch * 2, self.nbatch_max)
 
         raise GrondError(
             'could not find any suitable candidate sample within %i tries' % (
@@ -365,10 +393,10 @@ class Chains(object):
             chains_m = self.chains_m
             chains_i = self.chains_i
 
-            for ichain in range(nbootstrap):
-                isort = num.argsort(chains_m[ichain, :self.nlinks])
-                chains_m[ichain, :self.nlinks] = chains_m[ichain, isort]
-                chains_i[ichain, :self.nlinks] = chains_i[ichain, isort]
+            isort = num.argsort(chains_m[:, :self.nlinks], axis=1)
+            ichains = num.arange(nbootstrap)[:, num.newaxis]
+            chains_m[:, :self.nlinks] = chains_m[ichains, isort]
+            chains_i[:, :self.nlinks] = chains_i[ichains, isort]
 
             if self.nlinks == self.nlinks_cap:
                 accept = (chains_i[:, self.nlinks_cap-1] != nread) \
@@ -595,54 +623,72 @@ class HighScoreOptimiser(Optimiser):
         niter = self.niterations
         isbad_mask = None
         self._tlog_last = 0
-        for iiter in range(niter):
-            iphase, phase, iiter_phase = self.get_sampler_phase(iiter)
-            self.log_progress(problem, iiter, niter, phase, iiter_phase)
 
-            sample = phase.get_sample(problem, iiter_phase, chains)
-            sample.iphase = iphase
+        recorder = TimingRecorder(
+            path=op.join(rundir, timings_filename)
+            if rundir is not None else None)
 
-            if isbad_mask is not None and num.any(isbad_mask):
-                isok_mask = num.logical_not(isbad_mask)
-            else:
-                isok_mask = None
+        recorder_old = set_recorder(recorder)
+        try:
+            for iiter in range(niter):
+                recorder.start_iteration()
+                iphase, phase, iiter_phase = self.get_sampler_phase(iiter)
+                self.log_progress(problem, iiter, niter, phase, iiter_phase)
+
+                sample = phase.get_sample(problem, iiter_phase, chains)
+                sample.iphase = iphase
+
+                if isbad_mask is not None and num.any(isbad_mask):
+                    isok_mask = num.logical_not(isbad_mask)
+                else:
+                    isok_mask = None
+
+                misfits = problem.misfits(sample.model, mask=isok_mask)
+
+                with timed('combine_misfits'):
+                    bootstrap_misfits = problem.combine_misfits(
+                        misfits,
+                        extra_weights=self.get_bootstrap_weights(problem),
+                        extra_residuals=self.get_bootstrap_residuals(
+                            problem))
 
-            misfits = problem.misfits(sample.model, mask=isok_mask)
+                isbad_mask_new = num.isnan(misfits[:, 0])
+                if isbad_mask is not None and num.any(
+                        isbad_mask != isbad_mask_new):
 
-            bootstrap_misfits = problem.combine_misfits(
-                misfits,
-                extra_weights=self.get_bootstrap_weights(problem),
-                extra_residuals=self.get_bootstrap_residuals(problem))
+                    errmess = [
+                        'problem %s: inconsistency in data availability'
+                        ' at iteration %i' %
+                        (problem.name, iiter)]
 
-            isbad_mask_new = num.isnan(misfits[:, 0])
-            if isbad_mask is not None and num.any(
-                    isbad_mask != isbad_mask_new):
+                    for target, isbad_new, isbad in zip(
+                            problem.targets, isbad_mask_new, isbad_mask):
 
-                errmess = [
-                    'problem %s: inconsistency in data availability'
-                    ' at iteration %i' %
-                    (problem.name, iiter)]
+                        if isbad_new != isbad:
+                            errmess.append('  %s, %s -> %s' % (
+                                target.string_id(), isbad, isbad_new))
 
-                for target, isbad_new, isbad in zip(
-                        problem.targets, isbad_mask_new, isbad_mask):
+                    raise BadProblem('\n'.join(errmess))
 
-                    if isbad_new != isbad:
-                        errmess.append('  %s, %s -> %s' % (
-                            target.string_id(), isbad, isbad_new))
+                isbad_mask = isbad_mask_new
 
-                raise BadProblem('\n'.join(errmess))
+                if num.all(isbad_mask):
+                    raise BadProblem(
+                        'Problem %s: all target misfit values are NaN.'
+                        % problem.name)
 
-            isbad_mask = isbad_mask_new
+                with timed('history'):
+                    history.append(
+                        sample.model, misfits,
+                        bootstrap_misfits,
+                        sample.pack_context())
 
-            if num.all(isbad_mask):
-                raise BadProblem(
-                    'Problem %s: all target misfit values are NaN.'
-                    % problem.name)
+                recorder.end_iteration()
 
-            history.append(
-                sample.model, misfits,
-                bootstrap_misfits,
-                sample.pack_context())
+        finally:
+            set_recorder(recorder_old)
+            if rundir is not None:
+                recorder.write()
 
     @property
     def niterations(self):
@@ -719,11 +765,13 @@ class HighScoreOptimiser(Optimiser):
                     ))
 
     def get_movie_maker(
-            self, problem, history, xpar_name, ypar_name, movie_filename):
+            self, problem, history, xpar_name, ypar_name, movie_filename,
+            frame_stride=1, nprocs=1):
 
         from . import plot
         return plot.HighScoreOptimiserPlot(
-            self, problem, history, xpar_name, ypar_name, movie_filename)
+            self, problem, history, xpar_name, ypar_name, movie_filename,
+            frame_stride=frame_stride, nprocs=nprocs)
 
     @classmethod
     def get_plot_classes(cls):
@@ -1,5 +1,10 @@
 from __future__ import print_function
+import shutil
 import logging
+import tempfile
+import subprocess
+import os.path as op
+import multiprocessing
 import numpy as num
 
 from matplotlib import pyplot as plt
@@ -9,6 +14,7 @@ from pyrocko.plot import mpl_init, mpl_margins, mpl_color
 from pyrocko.guts import Tuple, Float
 from pyrocko import trace
 
+from grond.meta import GrondError
 from grond.plot.config import PlotConfig
 from grond.plot.collection import PlotItem
 
@@ -18,10 +24,19 @@ guts_prefix = 'grond'
 
 
 class HighScoreOptimiserPlot(object):
+    '''
+    Movie of the evolution of the models and chains of an optimisation.
+
+    Every ``frame_stride``-th iteration gives one frame. With ``nprocs > 1``,
+    the frames are rendered in a pool of worker processes into numbered
+    image files, which are encoded with ffmpeg afterwards. Each worker
+    renders runs of consecutive frames and replays the chains of the history
+    up to the first frame of a run.
+    '''
 
     def __init__(
             self, optimiser, problem, history, xpar_name, ypar_name,
-            movie_filename):
+            movie_filename, frame_stride=1, nprocs=1):
 
         self.optimiser = optimiser
         self.problem = problem
@@ -31,13 +46,45 @@ class HighScoreOptimiserPlot(object):
         self.ypar_name = ypar_name
         self.fontsize = 10.
         self.movie_filename = movie_filename
+        self.frame_stride = frame_stride
+        self.nprocs = nprocs
         self.show = False
         self.iiter = 0
         self.iiter_last_draw = 0
         self._volatile = []
         self._blocks_complete = set()
 
+        from matplotlib import colors
+        n = self.optimiser.nbootstrap + 1
+        hsv = num.vstack((
+            num.random.uniform(0., 1., n),
+            num.random.uniform(0.5, 0.9, n),
+            num.repeat(0.7, n))).T
+
+        self.bcolors = colors.hsv_to_rgb(hsv[num.newaxis, :, :])[0, :, :]
+        self.bcolors[0, :] = [0., 0., 0.]
+
     def start(self):
+        self.setup_figure()
+
+        self.writer = None
+        if self.movie_filename:
+            from matplotlib.animation import FFMpegWriter
+
+            self.writer = FFMpegWriter(
+                fps=movie_fps,
+                metadata=self.get_metadata(),
+                codec='libx264',
+                bitrate=movie_bitrate,
+                extra_args=movie_extra_args)
+
+            self.writer.setup(self.fig, self.movie_filename, dpi=movie_dpi)
+
+        if self.show:
+            plt.ion()
+            plt.show()
+
+    def setup_figure(self):
         nfx = 1
         nfy = 1
 
@@ -78,21 +125,12 @@ class HighScoreOptimiserPlot(object):
         self.axes = axes
         self.ixpar = ixpar
         self.iypar = iypar
-        from matplotlib import colors
-        n = self.optimiser.nbootstrap + 1
-        hsv = num.vstack((
-            num.random.uniform(0., 1., n),
-            num.random.uniform(0.5, 0.9, n),
-            num.repeat(0.7, n))).T
-
-        self.bcolors = colors.hsv_to_rgb(hsv[num.newaxis, :, :])[0, :, :]
-        self.bcolors[0, :] = [0., 0., 0.]
 
         bounds = self.problem.get_combined_bounds()
 
-        from grond import plot
-        self.xlim = plot.fixlim(*xpar.scaled(bounds[ixpar]))
-        self.ylim = plot.fixlim(*ypar.scaled(bounds[iypar]))
+        from grond.optimisers.plot import fixlim
+        self.xlim = fixlim(*xpar.scaled(bounds[ixpar]))
+        self.ylim = fixlim(*ypar.scaled(bounds[iypar]))
 
         self.set_limits()
 
@@ -102,28 +140,16 @@ class HighScoreOptimiserPlot(object):
             (1.0, 1.0, 1.0),
             (0.5, 0.9, 0.6)])
 
-        self.writer = None
-        if self.movie_filename:
-            from matplotlib.animation import FFMpegWriter
-
-            metadata = dict(title=problem.name, artist='Grond')
+    def get_metadata(self):
+        return dict(title=self.problem.name, artist='Grond')
 
-            self.writer = FFMpegWriter(
-                fps=30,
-                metadata=metadata,
-                codec='libx264',
-                bitrate=200000,
-                extra_args=[
-                    '-pix_fmt', 'yuv420p',
-                    '-profile:v', 'baseline',
-                    '-level', '3',
-                    '-an'])
+    def get_frame_iterations(self):
+        nmodels = self.history.nmodels
+        iiters = list(range(0, nmodels, max(1, self.frame_stride)))
+        if iiters and iiters[-1] != nmodels - 1:
+            iiters.append(nmodels - 1)
 
-            self.writer.setup(self.fig, self.movie_filename, dpi=200)
-
-        if self.show:
-            plt.ion()
-            plt.show()
+        return iiters
 
     def set_limits(self):
         self.axes.autoscale(False)
@@ -190,7 +216,7 @@ class HighScoreOptimiserPlot(object):
         models_prob = num.zeros((np, self.problem.nparameters))
         for ip in range(np):
             models_prob[ip, :] = phase.get_sample(
-                self.problem, iiter_phase, self.chains)
+                self.problem, iiter_phase, self.chains).model
 
         fx = self.problem.extract(models_prob, self.ixpar)
         fy = self.problem.extract(models_prob, self.iypar)
@@ -225,9 +251,6 @@ class HighScoreOptimiserPlot(object):
 
             self._volatile.append(collection)
 
-        if self.writer:
-            self.writer.grab_frame()
-
         artist = self.axes.annotate(
             '%i (%s)' % (self.iiter+1, phase.__class__.__name__),
             xy=(0., 1.),
@@ -255,16 +278,141 @@ class HighScoreOptimiserPlot(object):
             plt.ioff()
 
     def render(self):
+        iiters = self.get_frame_iterations()
+        if self.nprocs > 1 and self.movie_filename and not self.show:
+            self.render_parallel(iiters)
+            return
+
         self.start()
 
-        while self.iiter < self.history.nmodels:
-            logger.info('Rendering frame %i/%i.'
-                        % (self.iiter+1, self.history.nmodels))
+        for iframe, iiter in enumerate(iiters):
+            logger.info('Rendering frame %i/%i (iteration %i/%i).'
+                        % (iframe+1, len(iiters), iiter+1,
+                           self.history.nmodels))
+
+            self.iiter = iiter
             self.draw_frame()
-            self.iiter += 1
+            if self.writer:
+                self.writer.grab_frame()
 
         self.finish()
 
+    def render_parallel(self, iiters):
+        nframes = len(iiters)
+        nprocs = min(self.nprocs, nframes)
+
+        # several runs per process, to balance the load
+        jobs = []
+        for iframes in num.array_split(
+                num.arange(nframes), min(nframes, nprocs * 4)):
+
+            iframe = int(iframes[0])
+            jobs.append((iframe, iiters[iframe:iframe+iframes.size]))
+
+        frames_path = tempfile.mkdtemp(prefix='grond-movie-')
+        try:
+            with _get_context().Pool(
+                    nprocs, initializer=_init_frame_worker,
+                    initargs=(self, frames_path)) as pool:
+
+                nframes_done = 0
+                for n in pool.imap_unordered(_render_frames_worker, jobs):
+                    nframes_done += n
+                    logger.info(
+                        'Rendered %i/%i frames.' % (nframes_done, nframes))
+
+            logger.info('Encoding movie "%s".' % self.movie_filename)
+            encode_movie(
+                op.join(frames_path, frame_filename_template),
+                self.movie_filename,
+                metadata=self.get_metadata())
+
+        finally:
+            shutil.rmtree(frames_path)
+
+
+movie_fps = 30
+movie_dpi = 200
+movie_bitrate = 200000
+movie_extra_args = [
+    '-pix_fmt', 'yuv420p',
+    '-profile:v', 'baseline',
+    '-level', '3',
+    '-an']
+
+frame_filename_template = 'frame-%08d.png'
+
+
+def encode_movie(frame_path_template, movie_filename, metadata={}):
+    '''
+    Encode numbered frame images into a movie with ffmpeg.
+
+    The encoder settings are the same as used when piping frames directly
+    from a figure.
+    '''
+
+    from matplotlib import rcParams
+
+    args = [
+        rcParams['animation.ffmpeg_path'],
+        '-y',
+        '-loglevel', 'error',
+        '-framerate', str(movie_fps),
+        '-i', frame_path_template,
+        '-vcodec', 'libx264',
+        '-b', '%ik' % movie_bitrate]
+
+    for k, v in metadata.items():
+        args.extend(['-metadata', '%s=%s' % (k, v)])
+
+    args.extend(movie_extra_args)
+    args.append(movie_filename)
+
+    try:
+        subprocess.check_call(args)
+
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GrondError('Encoding movie failed: %s' % e)
+
+
+g_movie_maker = None
+g_frames_path = None
+
+
+def _get_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return multiprocessing.get_context()
+
+
+def _init_frame_worker(movie_maker, frames_path):
+    global g_movie_maker, g_frames_path
+    g_movie_maker = movie_maker
+    g_frames_path = frames_path
+
+
+def _render_frames_worker(job):
+    iframe_start, iiters = job
+
+    mm = g_movie_maker
+    movie_maker = HighScoreOptimiserPlot(
+        mm.optimiser, mm.problem, mm.history, mm.xpar_name, mm.ypar_name,
+        movie_filename=None)
+
+    movie_maker.bcolors = mm.bcolors
+    movie_maker.setup_figure()
+
+    for iframe, iiter in enumerate(iiters, iframe_start):
+        movie_maker.iiter = iiter
+        movie_maker.draw_frame()
+        movie_maker.fig.savefig(
+            op.join(g_frames_path, frame_filename_template % iframe),
+            dpi=movie_dpi)
+
+    plt.close(movie_maker.fig)
+    return len(iiters)
+
 
 def rolling_window(a, window):
     shape = a.shape[:-1] + (a.shape[-1] - window + 1, window)
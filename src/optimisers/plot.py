@@ -8,7 +8,10 @@ from pyrocko.guts import Tuple, Float, Int, StringChoice, Bool
 from pyrocko.plot import mpl_margins, mpl_graph_color, mpl_init
 
 from grond.plot.config import PlotConfig
+from grond.plot.density import DensityPlotConfig, density_weightings, \
+    get_model_weights, histogram2d, draw_density
 from grond.plot.collection import PlotItem
+from grond.timing import load_rundir_timings, format_duration
 
 logger = logging.getLogger('grond.problem.plot')
 
@@ -22,7 +25,7 @@ def fixlim(lo, hi):
         return lo, hi
 
 
-class SequencePlot(PlotConfig):
+class SequencePlot(DensityPlotConfig):
     '''
     Draws all parameter values evaluated during the optimisation
 
@@ -44,6 +47,10 @@ class SequencePlot(PlotConfig):
     subplot_layout = Tuple.T(2, Int.T(), default=(1, 1))
     marker_size = Float.T(default=1.5)
     show_reference = Bool.T(default=True)
+    density_weighting = StringChoice.T(
+        choices=density_weightings,
+        default='misfit_rank',
+        help='Weight of the models in the density grids.')
 
     def make(self, environ):
         cm = environ.get_plot_collection_manager()
@@ -109,6 +116,33 @@ corresponding misfit values.
         else:
             ibest = gms < misfit_cutoff
 
+        use_density = self.use_density(num.sum(ibest))
+        if use_density:
+            bootstrap_misfits = history.bootstrap_misfits
+            weights = get_model_weights(
+                self.density_weighting,
+                gms[ibest],
+                bootstrap_misfits[isort][ibest]
+                if bootstrap_misfits is not None else None)
+
+            xedges = num.linspace(
+                0, history.nmodels, self.density_nbins + 1)
+
+        def draw(axes, ys, ymin, ymax):
+            if use_density:
+                yedges = num.linspace(ymin, ymax, self.density_nbins + 1)
+                draw_density(
+                    axes,
+                    histogram2d(
+                        imodels[ibest], ys, xedges, yedges, weights),
+                    xedges, yedges, cmap=cmap, rasterized=True)
+
+            else:
+                axes.scatter(
+                    imodels[ibest], ys, s=msize, c=iorder[ibest],
+                    edgecolors='none', cmap=cmap, alpha=alpha,
+                    rasterized=True)
+
         def config_axes(axes, nfx, nfy, impl, iplot, nplots):
             if (impl - 1) % nfx != nfx - 1:
                 axes.get_yaxis().tick_left()
@@ -160,13 +194,11 @@ corresponding misfit values.
 
             config_axes(axes, nfx, nfy, impl, ipar, npar + ndep + 1)
 
-            axes.set_ylim(*fixlim(*par.scaled(bounds[ipar])))
+            ymin, ymax = fixlim(*par.scaled(bounds[ipar]))
+            axes.set_ylim(ymin, ymax)
             axes.set_xlim(0, history.nmodels)
 
-            axes.scatter(
-                imodels[ibest], par.scaled(models[ibest, ipar]), s=msize,
-                c=iorder[ibest], edgecolors='none', cmap=cmap, alpha=alpha,
-                rasterized=True)
+            draw(axes, par.scaled(models[ibest, ipar]), ymin, ymax)
 
             if self.show_reference:
                 axes.axhline(par.scaled(xref[ipar]), color='black', alpha=0.3)
@@ -201,13 +233,12 @@ corresponding misfit values.
 
             config_axes(axes, nfx, nfy, impl, npar + idep, npar + ndep + 1)
 
-            axes.set_ylim(*fixlim(*par.scaled(bounds[npar + idep])))
+            ymin, ymax = fixlim(*par.scaled(bounds[npar + idep]))
+            axes.set_ylim(ymin, ymax)
             axes.set_xlim(0, history.nmodels)
 
             ys = problem.make_dependant(models[ibest, :], par.name)
-            axes.scatter(
-                imodels[ibest], par.scaled(ys), s=msize, c=iorder[ibest],
-                edgecolors='none', cmap=cmap, alpha=alpha, rasterized=True)
+            draw(axes, par.scaled(ys), ymin, ymax)
 
             if self.show_reference:
                 y = problem.make_dependant(xref, par.name)
@@ -239,9 +270,12 @@ corresponding misfit values.
         axes.set_yticklabels(
             ['0.0', '0.2', '0.4', '0.6', '0.8', '1', '10', '100'])
 
-        axes.scatter(
-            imodels[ibest], gms_softclip[ibest], c=iorder[ibest],
-            s=msize, edgecolors='none', cmap=cmap, alpha=alpha)
+        if use_density:
+            draw(axes, gms_softclip[ibest], 0., 1.5)
+        else:
+            axes.scatter(
+                imodels[ibest], gms_softclip[ibest], c=iorder[ibest],
+                s=msize, edgecolors='none', cmap=cmap, alpha=alpha)
 
         axes.axhspan(1.0, 1.5, color=(0.8, 0.8, 0.8), alpha=0.2)
         axes.axhline(1.0, color=(0.5, 0.5, 0.5), zorder=2)
@@ -544,5 +578,104 @@ functions of the bootstrap start to disagree.
         return [(PlotItem(name='main'), fig)]
 
 
+class TimingsPlot(PlotConfig):
+    '''
+    Time spent in the phases of the optimisation iterations
+    '''
+
+    name = 'timings'
+    size_cm = Tuple.T(2, Float.T(), default=(21., 10.))
+
+    def make(self, environ):
+        cm = environ.get_plot_collection_manager()
+        timings = load_rundir_timings(environ.get_rundir_path())
+        mpl_init(fontsize=self.font_size)
+        cm.create_group_mpl(
+            self,
+            self.draw_figures(timings),
+            title=u'Timings',
+            section='optimiser',
+            feather_icon='clock',
+            description=u'''
+Time spent in the phases of the optimisation iterations.
+
+Left: mean time per iteration spent in each phase and its share of the total
+iteration time. Phases are the generation (``sample``) and preconstraining
+(``preconstrain``) of the candidate models, the modelling setup (``plan``),
+the forward modelling by the GF engine (``engine``), the post-processing of
+the synthetics per target type (``processing.*``), the misfit combination
+(``combine_misfits``) and writing the model history (``history``). Right:
+histograms of the time spent in each phase per iteration.
+
+A run dominated by ``engine`` is limited by the Green's function stores,
+``processing.*`` points to the data processing of the targets and the
+remaining phases to the Python code of the sampler.
+''')
+
+    def draw_figures(self, timings):
+        if timings is None or timings.get_iteration_phase() is None:
+            logger.warn('No timings available.')
+            return []
+
+        iteration = timings.get_iteration_phase()
+        phases = timings.get_breakdown_phases()
+        niterations = float(max(1, iteration.count))
+
+        fontsize = self.font_size
+        fig = plt.figure(figsize=self.size_inch)
+        labelpos = mpl_margins(fig, nw=2, nh=1, left=10., right=1.,
+                               top=2., bottom=3.5, wspace=7.,
+                               units=fontsize)
+
+        axes1 = fig.add_subplot(1, 2, 1)
+        labelpos(axes1, 2., 1.5)
+
+        names = [phase.name for phase in phases]
+        tmeans = num.array([phase.total for phase in phases]) / niterations
+        ys = num.arange(len(phases))[::-1]
+        axes1.barh(
+            ys, tmeans,
+            color=[mpl_graph_color(i) for i in range(len(phases))])
+
+        for y, phase, tmean in zip(ys, phases, tmeans):
+            axes1.text(
+                tmean, y, u' %.0f%%' % (100. * phase.total / iteration.total),
+                va='center', fontsize=fontsize * 0.8)
+
+        axes1.set_yticks(ys)
+        axes1.set_yticklabels(names)
+        axes1.set_xlabel('Mean time per iteration [s]')
+        axes1.set_title(
+            u'%i iterations, %s per iteration' % (
+                iteration.count, format_duration(iteration.mean)),
+            fontsize=fontsize)
+
+        axes2 = fig.add_subplot(1, 2, 2)
+        labelpos(axes2, 6.5, 1.5)
+
+        edges = timings.get_bin_edges()
+        for i, phase in enumerate([iteration] + phases):
+            counts = num.array(phase.histogram, dtype=float)
+            if counts.size != edges.size - 1 or not num.any(counts):
+                continue
+
+            inonzero = num.nonzero(counts)[0]
+            ia, ib = inonzero[0], inonzero[-1] + 1
+            axes2.step(
+                edges[ia:ib+1],
+                num.concatenate((counts[ia:ib], counts[ib-1:ib])),
+                where='post',
+                color='black' if i == 0 else mpl_graph_color(i-1),
+                lw=2. if i == 0 else 1.,
+                label=phase.name)
+
+        axes2.set_xscale('log')
+        axes2.set_xlabel('Time per iteration [s]')
+        axes2.set_ylabel('Number of iterations')
+        axes2.legend(loc='best', fontsize=fontsize * 0.7)
+
+        return [(PlotItem(name='main'), fig)]
+
+
 def get_plot_classes():
-    return [SequencePlot, ContributionsPlot, BootstrapPlot]
+    return [SequencePlot, ContributionsPlot, BootstrapPlot, TimingsPlot]
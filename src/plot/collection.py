@@ -49,6 +49,9 @@ class PlotGroup(Object):
     size_cm = Tuple.T(2, Float.T())
     items = List.T(PlotItem.T())
     attributes = Dict.T(StringID.T(), List.T(String.T()))
+    input_fingerprint = String.T(
+        optional=True,
+        help='digest of the inputs the group has been made from')
 
     def filename_image(self, item, format):
         return '%s.%s.%s.%s' % (
@@ -64,10 +67,93 @@ class PlotCollection(Object):
 
 class PlotCollectionManager(object):
 
-    def __init__(self, path, show=False):
+    def __init__(self, path, show=False, write_collection=True):
         self._path = path
         self.load_collection()
         self._show = show
+        self._write_collection = write_collection
+        self._group_refs_created = []
+        self._group_refs_removed = []
+        self._input_fingerprint = None
+
+    def set_input_fingerprint(self, input_fingerprint):
+        '''Set fingerprint to be recorded in the groups created next.'''
+        self._input_fingerprint = input_fingerprint
+
+    def is_group_current(self, group_ref, input_fingerprint):
+        '''
+        Check if a group exists, is complete and has been made from the
+        inputs given by ``input_fingerprint``.
+        '''
+
+        group_ref = tuple(group_ref)
+        if group_ref not in self._collection.group_refs:
+            return False
+
+        path_group = self.path_group(group_ref=group_ref)
+        if not op.exists(path_group):
+            return False
+
+        try:
+            group = guts.load(filename=path_group)
+        except Exception:
+            return False
+
+        if group.input_fingerprint != input_fingerprint:
+            return False
+
+        return all(
+            op.exists(self.path_image(group, item, format))
+            for item in group.items
+            for format in group.formats)
+
+    def get_group_refs(self):
+        return list(self._collection.group_refs)
+
+    def remove_group(self, group_ref):
+        group_ref = tuple(group_ref)
+        path_group = self.path_group(group_ref=group_ref)
+        if op.exists(path_group):
+            self.remove_group_files(path_group)
+
+        self._unlist_group(group_ref)
+        self.dump_collection()
+
+    def _unlist_group(self, group_ref):
+        if group_ref in self._collection.group_refs:
+            self._collection.group_refs.remove(group_ref)
+
+        self._group_refs_removed.append(group_ref)
+
+    def get_group_refs_created(self):
+        return list(self._group_refs_created)
+
+    def get_group_refs_removed(self):
+        return list(self._group_refs_removed)
+
+    def merge_group_refs(self, group_refs, group_refs_removed=()):
+        '''
+        Add groups created and drop groups removed by another manager on the
+        same path.
+
+        Used to combine the collection index after plots have been made in
+        worker processes, which do not write the index themselves. Groups
+        removed and created again are kept.
+        '''
+
+        for group_ref in group_refs_removed:
+            group_ref = tuple(group_ref)
+            if group_ref in self._collection.group_refs:
+                self._collection.group_refs.remove(group_ref)
+
+        for group_ref in group_refs:
+            group_ref = tuple(group_ref)
+            if group_ref in self._collection.group_refs:
+                self._collection.group_refs.remove(group_ref)
+
+            self._collection.group_refs.append(group_ref)
+
+        self.dump_collection()
 
     def load_collection(self):
         path = self.path_collection()
@@ -77,6 +163,9 @@ class PlotCollectionManager(object):
             self._collection = PlotCollection()
 
     def dump_collection(self):
+        if not self._write_collection:
+            return
+
         path = self.path_collection()
         util.ensuredirs(path)
         guts.dump(self._collection, filename=path)
@@ -118,6 +207,7 @@ class PlotCollectionManager(object):
             size_cm=config.size_cm,
             name=config.name,
             variant=config.variant,
+            input_fingerprint=self._input_fingerprint,
             **kwargs)
 
         path_group = self.path_group(group=group)
@@ -125,9 +215,7 @@ class PlotCollectionManager(object):
             self.remove_group_files(path_group)
 
         group_ref = (group.name, group.variant)
-        if group_ref in self._collection.group_refs:
-            self._collection.group_refs.remove(group_ref)
-
+        self._unlist_group(group_ref)
         self.dump_collection()
 
         figs_to_close = []
@@ -152,6 +240,7 @@ class PlotCollectionManager(object):
         group.validate()
         group.dump(filename=path_group)
         self._collection.group_refs.append(group_ref)
+        self._group_refs_created.append(group_ref)
         self.dump_collection()
 
         if self._show:
@@ -166,6 +255,7 @@ class PlotCollectionManager(object):
             size_cm=config.size_cm,
             name=config.name,
             variant=config.variant,
+            input_fingerprint=self._input_fingerprint,
             **kwargs)
 
         path_group = self.path_group(group=group)
@@ -173,9 +263,7 @@ class PlotCollectionManager(object):
             self.remove_group_files(path_group)
 
         group_ref = (group.name, group.variant)
-        if group_ref in self._collection.group_refs:
-            self._collection.group_refs.remove(group_ref)
-
+        self._unlist_group(group_ref)
         self.dump_collection()
 
         for item, automap in iter_item_figure:
@@ -193,6 +281,7 @@ class PlotCollectionManager(object):
         util.ensuredirs(path_group)
         group.dump(filename=path_group)
         self._collection.group_refs.append(group_ref)
+        self._group_refs_created.append(group_ref)
         self.dump_collection()
 
     def create_group_gmtpy(self, config, iter_item_figure):
@@ -209,7 +298,13 @@ class PlotCollectionManager(object):
                     pass
 
         os.unlink(path_group)
-        for path in self.paths_group_dirs(group=group):
+        paths = self.paths_group_dirs(group=group)
+        if not self._write_collection:
+            # in worker processes, the directory of the plot name is shared
+            # with groups of other variants being created concurrently
+            paths = paths[:1]
+
+        for path in paths:
             try:
                 os.rmdir(path)
             except OSError:
@@ -0,0 +1,233 @@
+'''
+Aggregation of large model ensembles into density grids.
+
+Plots of histories with millions of models are drawn as images of binned,
+optionally weighted, model densities instead of one marker per model. The
+bins are accumulated in chunks, so that no large temporary arrays are
+needed.
+'''
+
+import numpy as num
+from matplotlib import colors as mcolors
+
+from pyrocko.guts import Int, StringChoice
+
+from grond.meta import GrondError
+from .config import PlotConfig
+
+guts_prefix = 'grond'
+
+density_weightings = ['uniform', 'misfit_rank', 'bootstrap']
+
+
+class DensityPlotConfig(PlotConfig):
+    '''
+    Base class for plots which can aggregate models into density images.
+    '''
+
+    render_mode = StringChoice.T(
+        choices=['auto', 'markers', 'density'],
+        default='auto',
+        help='Draw every model individually (``markers``) or aggregate the '
+             'models into density grids (``density``). With ``auto``, '
+             'density grids are used for more than ``density_nmodels_min`` '
+             'models.')
+    density_nmodels_min = Int.T(
+        default=100000,
+        help='Number of models above which density grids are used with '
+             '``render_mode: auto``.')
+    density_nbins = Int.T(
+        default=200,
+        help='Number of bins along each axis of the density grids.')
+    density_weighting = StringChoice.T(
+        choices=density_weightings,
+        default='uniform',
+        help='Weight of the models in the density grids: ``uniform``, '
+             'by misfit rank (best model 1, worst model 0) or by the '
+             'fraction of bootstrap chains in which the model is among the '
+             '10% best models.')
+
+    def use_density(self, nmodels):
+        if self.render_mode == 'auto':
+            return nmodels > self.density_nmodels_min
+
+        return self.render_mode == 'density'
+
+
+def get_model_weights(
+        weighting, gms=None, bootstrap_misfits=None, quantile=0.1):
+
+    '''
+    Get weights of models for the density grids.
+
+    :param weighting: ``'uniform'``, ``'misfit_rank'`` or ``'bootstrap'``
+    :param gms: global misfits of the models, needed for ``'uniform'`` and
+        ``'misfit_rank'``
+    :param bootstrap_misfits: bootstrap misfits of the models,
+        ``bootstrap_misfits[imodel, ibootstrap]``, needed for ``'bootstrap'``
+    :param quantile: fraction of best models of each bootstrap chain counted
+        as members
+    :returns: array with the weight of each model
+    '''
+
+    if weighting == 'uniform':
+        return num.ones(gms.size)
+
+    elif weighting == 'misfit_rank':
+        nmodels = gms.size
+        ranks = num.empty(nmodels)
+        ranks[num.argsort(gms)] = num.arange(nmodels)
+        return 1.0 - ranks / max(1, nmodels - 1)
+
+    elif weighting == 'bootstrap':
+        if bootstrap_misfits is None:
+            raise GrondError(
+                'Bootstrap misfits needed for density weighting.')
+
+        thresholds = num.nanpercentile(
+            bootstrap_misfits, quantile * 100., axis=0)
+
+        return num.mean(bootstrap_misfits <= thresholds[num.newaxis, :],
+                        axis=1)
+
+    else:
+        raise GrondError('Invalid density weighting: %s' % weighting)
+
+
+def _bin_indices(xs, edges):
+    nbins = edges.size - 1
+    ixs = num.floor(
+        (xs - edges[0]) * (nbins / (edges[-1] - edges[0]))).astype(num.int64)
+
+    # right edge belongs to last bin, as in numpy.histogram
+    ixs[xs == edges[-1]] = nbins - 1
+    return ixs, (0 <= ixs) & (ixs < nbins)
+
+
+def histogram1d(xs, edges, weights=None, nchunk=1000000):
+    '''
+    Weighted histogram on equidistant bins, accumulated in chunks.
+
+    :param edges: equidistant bin edges
+    :returns: sum of weights in each bin
+    '''
+
+    xs = num.asarray(xs, dtype=float)
+    nbins = edges.size - 1
+    counts = num.zeros(nbins)
+    for i in range(0, xs.size, nchunk):
+        ixs, mask = _bin_indices(xs[i:i+nchunk], edges)
+        ws = weights[i:i+nchunk][mask] if weights is not None else None
+        counts += num.bincount(ixs[mask], weights=ws, minlength=nbins)
+
+    return counts
+
+
+def histogram2d(xs, ys, xedges, yedges, weights=None, nchunk=1000000):
+    '''
+    Weighted 2-D histogram on equidistant bins, accumulated in chunks.
+
+    :returns: sum of weights in each bin, ``counts[ix, iy]``
+    '''
+
+    xs = num.asarray(xs, dtype=float)
+    ys = num.asarray(ys, dtype=float)
+    nx = xedges.size - 1
+    ny = yedges.size - 1
+    counts = num.zeros(nx * ny)
+    for i in range(0, xs.size, nchunk):
+        ixs, xmask = _bin_indices(xs[i:i+nchunk], xedges)
+        iys, ymask = _bin_indices(ys[i:i+nchunk], yedges)
+        mask = num.logical_and(xmask, ymask)
+        ws = weights[i:i+nchunk][mask] if weights is not None else None
+        counts += num.bincount(
+            ixs[mask] * ny + iys[mask], weights=ws, minlength=nx * ny)
+
+    return counts.reshape((nx, ny))
+
+
+def gaussian_kde_binned(xs, xs_eval, weights=None, nbins=2000):
+    '''
+    Gaussian kernel density estimate from binned samples.
+
+    Equivalent to :py:class:`scipy.stats.gaussian_kde` with Scott's rule for
+    the bandwidth, but the cost does not grow with the product of the
+    number of samples and evaluation points. The samples are binned on
+    ``nbins`` equidistant bins, which should be much narrower than the
+    bandwidth.
+
+    :returns: density evaluated at ``xs_eval`` or ``None`` if all samples
+        have the same value
+    '''
+
+    xs = num.asarray(xs, dtype=float)
+    if weights is None:
+        weights = num.ones(xs.size)
+
+    wsum = num.sum(weights)
+    if xs.size == 0 or wsum <= 0.0:
+        return None
+
+    w2sum = num.sum(weights**2)
+    xmin, xmax = num.min(xs), num.max(xs)
+    if xmin == xmax or wsum**2 == w2sum:
+        return None
+
+    # unbiased weighted variance, as used by scipy
+    mean = num.sum(weights * xs) / wsum
+    std = num.sqrt(
+        num.sum(weights * (xs - mean)**2) / (wsum - w2sum / wsum))
+
+    neff = wsum**2 / w2sum
+    bandwidth = std * neff**(-1./5.)
+
+    edges = num.linspace(xmin, xmax, nbins + 1)
+    counts = histogram1d(xs, edges, weights)
+    centers = 0.5 * (edges[:-1] + edges[1:])
+
+    xs_eval = num.asarray(xs_eval, dtype=float)
+    pps = num.zeros(xs_eval.size)
+    for i in range(0, xs_eval.size, 100):
+        d = (xs_eval[i:i+100, num.newaxis] - centers[num.newaxis, :]) \
+            / bandwidth
+        pps[i:i+100] = num.sum(counts * num.exp(-0.5 * d**2), axis=1)
+
+    return pps / (wsum * bandwidth * num.sqrt(2.0 * num.pi))
+
+
+def draw_density(axes, counts, xedges, yedges, cmap, dynamic_range=1e4,
+                 **kwargs):
+    '''
+    Draw 2-D histogram as image, empty bins are left transparent.
+
+    The colour scale is logarithmic, covering ``dynamic_range`` below the
+    maximum.
+    '''
+
+    counts = num.ma.masked_less_equal(counts, 0.0)
+    vmax = counts.max() if counts.count() else 1.0
+    norm = mcolors.LogNorm(
+        vmin=max(counts.min() if counts.count() else 1.0,
+                 vmax / dynamic_range),
+        vmax=vmax)
+
+    return axes.imshow(
+        counts.T,
+        origin='lower',
+        extent=(xedges[0], xedges[-1], yedges[0], yedges[-1]),
+        aspect='auto',
+        interpolation='nearest',
+        cmap=cmap,
+        norm=norm,
+        **kwargs)
+
+
+__all__ = '''
+    DensityPlotConfig
+    density_weightings
+    get_model_weights
+    histogram1d
+    histogram2d
+    gaussian_kde_binned
+    draw_density
+'''.split()
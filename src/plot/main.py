@@ -1,8 +1,13 @@
 import logging
+import traceback
+import multiprocessing
+
 from grond.meta import GrondError, classes_with_have_get_plot_classes
 from grond.environment import Environment, GrondEnvironmentError
 from grond.plot.collection import PlotCollectionManager
 from grond.plot.config import PlotConfigCollection
+from grond.analysers.base import fingerprint
+from grond.version import __version__
 
 logger = logging.getLogger('grond.plots')
 
@@ -43,12 +48,81 @@ def get_plot_config_collection(env=None, plot_names=None):
     return collection
 
 
+def plot_fingerprint(plot, input_fingerprint):
+    '''
+    Digest of the inputs of a plot: the given fingerprint of the data to be
+    plotted, the plot configuration and the Grond version.
+    '''
+
+    return fingerprint(input_fingerprint, plot, __version__)
+
+
+g_plot_job = None
+
+
+def _init_plot_worker(env, plots, fingerprints, plots_path):
+    global g_plot_job
+    g_plot_job = env, plots, fingerprints, plots_path
+
+    # worker processes cannot run pools of their own
+    env.set_nprocs_modelling(1)
+
+
+def _make_plot(plot, env, input_fingerprint=None):
+    env.get_plot_collection_manager().set_input_fingerprint(
+        input_fingerprint)
+
+    try:
+        plot.make(env)
+    except (GrondEnvironmentError, GrondError) as e:
+        logger.warning('Cannot create plot %s: %s' % (
+            plot.name, str(e)))
+
+
+def _make_plot_worker(iplot):
+    env, plots, fingerprints, plots_path = g_plot_job
+    manager = PlotCollectionManager(plots_path, write_collection=False)
+    env.set_plot_collection_manager(manager)
+    error = None
+    try:
+        _make_plot(plots[iplot], env, fingerprints[iplot])
+    except Exception:
+        error = traceback.format_exc()
+
+    return iplot, manager.get_group_refs_created(), \
+        manager.get_group_refs_removed(), error
+
+
+def _get_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return multiprocessing.get_context()
+
+
 def make_plots(
         env,
         plot_config_collection=None,
         plot_names=None,
         plots_path=None,
-        show=False):
+        show=False,
+        nprocs=1,
+        input_fingerprint=None):
+
+    '''
+    Make plots and add them to the plot collection in ``plots_path``.
+
+    With ``nprocs > 1``, the plots are made in a pool of worker processes,
+    each writing its own plot groups. The collection index is updated once
+    all plots are done, in the order of the plot configurations, also if
+    some of them failed. Plots are always made sequentially with
+    ``show=True``.
+
+    If ``input_fingerprint`` is given, it is recorded together with the plot
+    configuration in the plot groups, see :py:func:`plot_fingerprint`, and
+    plots whose existing group has been made from the same inputs are
+    skipped.
+    '''
 
     if plot_config_collection is None:
         plot_config_collection = get_plot_config_collection(env, plot_names)
@@ -60,21 +134,72 @@ def make_plots(
     manager = PlotCollectionManager(plots_path, show=show)
     env.set_plot_collection_manager(manager)
 
-    for plot in plots:
-        try:
-            plot.make(env)
-        except (GrondEnvironmentError, GrondError) as e:
-            logger.warning('Cannot create plot %s: %s' % (
-                plot.name, str(e)))
+    if input_fingerprint is not None:
+        fingerprints = [
+            plot_fingerprint(plot, input_fingerprint) for plot in plots]
 
+        iplots = [
+            iplot for (iplot, plot) in enumerate(plots)
+            if show or not manager.is_group_current(
+                (plot.name, plot.variant), fingerprints[iplot])]
 
-def make_movie(dirname, xpar_name, ypar_name, movie_filename):
+        if len(iplots) < len(plots):
+            logger.info(
+                'Skipping %i of %i plots, their inputs did not change.' % (
+                    len(plots) - len(iplots), len(plots)))
+
+    else:
+        fingerprints = [None] * len(plots)
+        iplots = list(range(len(plots)))
+
+    nprocs = min(nprocs, len(iplots))
+    if nprocs > 1 and multiprocessing.current_process().daemon:
+        logger.warning(
+            'Cannot make plots in parallel from within a worker process.')
+        nprocs = 1
+
+    if show or nprocs <= 1:
+        for iplot in iplots:
+            _make_plot(plots[iplot], env, fingerprints[iplot])
+
+        return
+
+    group_refs = [None] * len(plots)
+    group_refs_removed = []
+    errors = []
+    try:
+        with _get_context().Pool(
+                nprocs, initializer=_init_plot_worker,
+                initargs=(env, plots, fingerprints, plots_path)) as pool:
+
+            for iplot, refs, refs_removed, error in pool.imap_unordered(
+                    _make_plot_worker, iplots):
+
+                group_refs[iplot] = refs
+                group_refs_removed.extend(refs_removed)
+                if error is not None:
+                    errors.append((plots[iplot].name, error))
+
+    finally:
+        manager.merge_group_refs(
+            (group_ref for refs in group_refs if refs
+             for group_ref in refs),
+            group_refs_removed)
+
+    if errors:
+        raise GrondError('Failed to make plots:\n%s' % '\n'.join(
+            'Plot %s:\n%s' % (name, error) for (name, error) in errors))
+
+
+def make_movie(dirname, xpar_name, ypar_name, movie_filename,
+               frame_stride=1, nprocs=1):
     env = Environment([dirname])
     optimiser = env.get_optimiser()
     problem = env.get_problem()
     history = env.get_history()
     movie_maker = optimiser.get_movie_maker(
-        problem, history, xpar_name, ypar_name, movie_filename)
+        problem, history, xpar_name, ypar_name, movie_filename,
+        frame_stride=frame_stride, nprocs=nprocs)
 
     movie_maker.render()
 
@@ -84,4 +209,5 @@ __all__ = [
     'get_plot_config_collection',
     'get_all_plot_classes',
     'make_plots',
+    'plot_fingerprint',
     'make_movie']
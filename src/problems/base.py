@@ -13,15 +13,18 @@ import os.path as op
 import os
 import time
 
-from pyrocko import gf, util, guts
+from pyrocko import gf, util, guts, orthodrome
 from pyrocko.guts import Object, String, List, Dict, Int
 
 from grond.meta import ADict, Parameter, GrondError, xjoin, Forbidden, \
     StringID, has_get_plot_classes
+from grond.timing import timed
 from ..targets import MisfitResult, MisfitTarget, TargetGroup, \
-    WaveformMisfitTarget, SatelliteMisfitTarget, GNSSCampaignMisfitTarget
+    WaveformMisfitTarget, SatelliteMisfitTarget, GNSSCampaignMisfitTarget, \
+    WOACTarget
 
 from grond import stats
+from .superposition import SuperpositionCache, process_superposition
 
 from grond.version import __version__
 
@@ -38,6 +41,482 @@ def nextpow2(i):
     return 2**int(math.ceil(math.log(i)/math.log(2.)))
 
 
+class TimingNotVectorisable(Exception):
+    pass
+
+
+g_timings = {}
+
+
+def get_timing(timing):
+    '''
+    Get parsed :py:class:`pyrocko.gf.Timing` object, cached by definition.
+    '''
+    if isinstance(timing, gf.Timing):
+        return timing
+
+    if timing not in g_timings:
+        g_timings[timing] = gf.Timing(timing)
+
+    return g_timings[timing]
+
+
+def evaluate_timing_many(store, timing, args):
+    '''
+    Evaluate travel-time definition for many GF index tuples at once.
+
+    :param store: :py:class:`pyrocko.gf.Store` object
+    :param timing: :py:class:`pyrocko.gf.Timing` object
+    :param args: tuple of arrays with GF indexing arguments
+    :returns: array with travel times, ``NaN`` where undefined
+
+    Only tabulated phases with a plain time offset can be interpolated in one
+    go. For other travel-time definitions, :py:exc:`TimingNotVectorisable` is
+    raised.
+    '''
+
+    if getattr(timing, 'offset_is', None) is not None \
+            or getattr(timing, 'offset_is_slowness', False) \
+            or not timing.phase_defs:
+
+        raise TimingNotVectorisable()
+
+    points = num.vstack(args).T
+    times = num.zeros((len(timing.phase_defs), points.shape[0]))
+    for iphase, phase_def in enumerate(timing.phase_defs):
+        toks = phase_def.split(':', 1)
+        if len(toks) == 2:
+            provider, phase_def = toks
+        else:
+            provider, phase_def = 'stored', toks[0]
+
+        if provider != 'stored':
+            raise TimingNotVectorisable()
+
+        times[iphase, :] = store.get_stored_phase(phase_def) \
+            .interpolate_many(points)
+
+    times += timing.offset
+
+    select = getattr(timing, 'select', '')
+    if select in ('first', 'last'):
+        times[num.isnan(times)] = num.inf if select == 'first' else -num.inf
+        if select == 'first':
+            t = num.min(times, axis=0)
+        else:
+            t = num.max(times, axis=0)
+
+        t[num.isinf(t)] = num.nan
+
+    else:
+        t = num.full(points.shape[0], num.nan)
+        for iphase in range(times.shape[0]-1, -1, -1):
+            mask = num.isfinite(times[iphase, :])
+            t[mask] = times[iphase, mask]
+
+    return t
+
+
+class ModellingPlan(object):
+    '''
+    Reusable mapping between misfit targets and modelling targets.
+
+    Holds the unique modelling targets to be sent to the GF engine, the index
+    array to scatter the engine results back to the (possibly duplicated)
+    modelling targets, and the slice bounds of each misfit target's share.
+
+    :param engine: :py:class:`pyrocko.gf.LocalEngine` object
+    :param source: source model, passed to ``prepare_modelling``
+    :param targets: list of misfit targets
+    :param mask: optional boolean mask to select targets for modelling
+    '''
+
+    def __init__(self, engine, source, targets, mask=None):
+        modelling_targets = []
+        self.bounds = []
+        self.irepeat = []
+        for itarget, target in enumerate(targets):
+            mtargets = target.prepare_modelling(engine, source, targets)
+            if target.repeat_prepare_modelling:
+                self.irepeat.append(itarget)
+
+            if mask is None or mask[itarget]:
+                imt = len(modelling_targets)
+                modelling_targets.extend(mtargets)
+                self.bounds.append((imt, imt + len(mtargets)))
+            else:
+                self.bounds.append(None)
+
+        self.modelling_targets = modelling_targets
+
+        u2m_map = {}
+        self.modelling_targets_unique = []
+        iunique = num.zeros(len(modelling_targets), dtype=num.int)
+        for imtarget, mtarget in enumerate(modelling_targets):
+            k = id(mtarget)
+            if k not in u2m_map:
+                u2m_map[k] = len(self.modelling_targets_unique)
+                self.modelling_targets_unique.append(mtarget)
+
+            iunique[imtarget] = u2m_map[k]
+
+        self.iunique = iunique
+
+    def prepare(self, engine, source, targets):
+        '''
+        Repeat preparation for targets which need it on every evaluation.
+        '''
+        for itarget in self.irepeat:
+            targets[itarget].prepare_modelling(engine, source, targets)
+
+    def get_modelling_targets(self, itarget):
+        imt_start, imt_end = self.bounds[itarget]
+        return self.modelling_targets[imt_start:imt_end]
+
+    def scatter(self, modelling_results_unique):
+        '''
+        Distribute results of the unique modelling targets.
+
+        :returns: list with the modelling results for each misfit target,
+            ``None`` for targets excluded from modelling
+        '''
+        results = num.empty(len(modelling_results_unique), dtype=num.object)
+        results[:] = modelling_results_unique
+        results = results[self.iunique]
+        return [
+            list(results[bounds[0]:bounds[1]])
+            if bounds is not None else None
+            for bounds in self.bounds]
+
+
+class SourceMapper(object):
+    '''
+    Mapping of parameter vectors to source objects.
+
+    Index arrays and relative/absolute flags of the source parameters are
+    set up once. New sources are shallow copies of the base source, which
+    avoids the overhead of a full guts clone.
+
+    :param base_source: source providing default and reference values
+    :param ranges: dict of :py:class:`pyrocko.gf.Range` objects
+    :param parameter_names: names of the entries of the parameter vectors
+    '''
+
+    def __init__(self, base_source, ranges, parameter_names):
+        self.base_source = base_source
+        self.parameter_names = list(parameter_names)
+        self._indices = dict(
+            (name, i) for (i, name) in enumerate(self.parameter_names))
+
+        self.keys = [
+            k for k in base_source.keys() if k in self.parameter_names]
+
+        self.iparameters = num.array(
+            [self.index(k) for k in self.keys], dtype=num.int)
+
+        base_values = num.array(
+            [base_source[k] for k in self.keys], dtype=num.float)
+
+        relative = [ranges[k].relative for k in self.keys]
+        self.iadd = num.array(
+            [i for (i, r) in enumerate(relative) if r == 'add'],
+            dtype=num.int)
+        self.imult = num.array(
+            [i for (i, r) in enumerate(relative) if r == 'mult'],
+            dtype=num.int)
+
+        self.base_add = base_values[self.iadd]
+        self.base_mult = base_values[self.imult]
+
+        self.object_keys = [
+            k for k in base_source.keys()
+            if isinstance(base_source[k], Object)]
+
+    def index(self, name):
+        '''
+        Get index of a parameter in the parameter vectors.
+        '''
+        return self._indices[name]
+
+    def indices(self, names):
+        return num.array([self.index(name) for name in names], dtype=num.int)
+
+    def get_attribute_values(self, xs, names):
+        '''
+        Get absolute values of source attributes, mapped or not.
+
+        :param xs: ``(n, nparameters)`` array
+        :param names: names of the source attributes
+        :returns: list of 1D arrays
+        '''
+
+        values = self.get_values(xs)
+        return [
+            values[:, self.keys.index(name)].copy() if name in self.keys
+            else num.full(xs.shape[0], getattr(self.base_source, name),
+                          dtype=num.float)
+            for name in names]
+
+    def get_values(self, xs):
+        '''
+        Get absolute values of the mapped source attributes.
+
+        :param xs: parameter vector or ``(n, nparameters)`` array
+        :returns: array of shape ``(nkeys,)`` or ``(n, nkeys)``
+        '''
+
+        values = num.array(xs[..., self.iparameters], dtype=num.float)
+        if self.iadd.size:
+            values[..., self.iadd] += self.base_add
+
+        if self.imult.size:
+            values[..., self.imult] *= self.base_mult
+
+        return values
+
+    def update_source(self, source, x=None, values=None, **kwargs):
+        '''
+        Set the mapped attributes of a source in place.
+
+        :param source: source object to be modified
+        :param x: parameter vector
+        :param values: absolute values, as returned by :py:meth:`get_values`,
+            can be given instead of ``x``
+        :param kwargs: additional attributes to be set
+        '''
+
+        if values is None:
+            values = self.get_values(x)
+
+        for k, v in zip(self.keys, values.tolist()):
+            setattr(source, k, v)
+
+        for k, v in kwargs.items():
+            setattr(source, k, v)
+
+        return source
+
+    def get_source(self, x=None, values=None, **kwargs):
+        '''
+        Get new source for a parameter vector.
+
+        Arguments are the same as for :py:meth:`update_source`.
+        '''
+
+        source = copy.copy(self.base_source)
+        for k in self.object_keys:
+            if k not in kwargs:
+                setattr(source, k, copy.copy(self.base_source[k]))
+
+        return self.update_source(source, x, values, **kwargs)
+
+    def get_sources(self, xs, kwargs_list=None):
+        '''
+        Get new sources for an ``(n, nparameters)`` array.
+
+        :param kwargs_list: optional list with dicts of additional attributes
+            for each source
+        '''
+
+        values = self.get_values(xs)
+        if kwargs_list is None:
+            kwargs_list = [{}] * xs.shape[0]
+
+        return [
+            self.get_source(values=v, **kwargs)
+            for (v, kwargs) in zip(values, kwargs_list)]
+
+
+class TargetDistances(object):
+    '''
+    Cached target coordinates for vectorised source-target distances.
+
+    Distances follow the ``distance_to`` methods of the targets: surface
+    distances between effective locations for waveform and phase ratio
+    targets, distances from the source origin to all observation points for
+    static targets. Amplitude constraint targets are skipped, other targets
+    are handled one by one.
+
+    :param targets: list of misfit targets
+    '''
+
+    def __init__(self, targets):
+        loc_targets = []
+        static_latlons = []
+        self.other_targets = []
+
+        for target in targets:
+            if isinstance(target, gf.Location):
+                loc_targets.append(target)
+            elif isinstance(target, gf.StaticTarget):
+                static_latlons.append(target.get_latlon())
+            elif isinstance(target, WOACTarget):
+                continue  # has no location
+            else:
+                self.other_targets.append(target)
+
+        self.lats = num.array([t.lat for t in loc_targets], dtype=num.float)
+        self.lons = num.array([t.lon for t in loc_targets], dtype=num.float)
+        self.north_shifts = num.array(
+            [t.north_shift for t in loc_targets], dtype=num.float)
+        self.east_shifts = num.array(
+            [t.east_shift for t in loc_targets], dtype=num.float)
+
+        effective_latlons = num.array(
+            [t.effective_latlon for t in loc_targets],
+            dtype=num.float).reshape((len(loc_targets), 2))
+
+        self.effective_lats = effective_latlons[:, 0]
+        self.effective_lons = effective_latlons[:, 1]
+
+        if static_latlons:
+            static_latlons = num.vstack(static_latlons)
+        else:
+            static_latlons = num.zeros((0, 2))
+
+        self.static_lats = static_latlons[:, 0]
+        self.static_lons = static_latlons[:, 1]
+
+    def distances(self, lats, lons, north_shifts, east_shifts, sources=None):
+        '''
+        Get distances between many source positions and all targets.
+
+        :param lats,lons,north_shifts,east_shifts: 1D arrays with the source
+            positions
+        :param sources: sources, only needed if there are targets which can
+            not be handled in a vectorised way
+        :returns: 2D array with one row per source
+        '''
+
+        n = lats.size
+        parts = []
+
+        if self.lats.size:
+            slats, tlats = num.broadcast_arrays(
+                lats[:, num.newaxis], self.lats[num.newaxis, :])
+            slons, tlons = num.broadcast_arrays(
+                lons[:, num.newaxis], self.lons[num.newaxis, :])
+
+            same_origin = num.logical_and(slats == tlats, slons == tlons)
+
+            dists = num.sqrt(
+                (north_shifts[:, num.newaxis]
+                 - self.north_shifts[num.newaxis, :])**2
+                + (east_shifts[:, num.newaxis]
+                   - self.east_shifts[num.newaxis, :])**2)
+
+            if not num.all(same_origin):
+                elats, elons = lats.copy(), lons.copy()
+                shifted = num.logical_or(north_shifts != 0., east_shifts != 0.)
+                if num.any(shifted):
+                    elats[shifted], elons[shifted] = orthodrome.ne_to_latlon(
+                        lats[shifted], lons[shifted],
+                        north_shifts[shifted], east_shifts[shifted])
+
+                ii = num.where(num.logical_not(same_origin))
+                dists[ii] = orthodrome.distance_accurate50m_numpy(
+                    elats[ii[0]], elons[ii[0]],
+                    self.effective_lats[ii[1]], self.effective_lons[ii[1]])
+
+            parts.append(dists)
+
+        if self.static_lats.size:
+            m = self.static_lats.size
+            parts.append(orthodrome.distance_accurate50m_numpy(
+                num.repeat(lats, m), num.repeat(lons, m),
+                num.tile(self.static_lats, n),
+                num.tile(self.static_lons, n)).reshape((n, m)))
+
+        if self.other_targets:
+            parts.append(num.array([
+                num.concatenate([
+                    num.atleast_1d(num.asarray(
+                        target.distance_to(source), dtype=num.float))
+                    for target in self.other_targets])
+                for source in sources], dtype=num.float).reshape((n, -1)))
+
+        if not parts:
+            return num.zeros((n, 0))
+
+        return num.hstack(parts)
+
+
+class TimingGroup(object):
+    '''
+    Waveform targets sharing a GF store and a travel-time definition.
+    '''
+
+    def __init__(self, store_id, timing, itargets, targets):
+        self.store_id = store_id
+        self.timing = timing
+        self.itargets = num.array(itargets, dtype=num.int)
+        self.targets = targets
+
+        self.lats = num.array([t.lat for t in targets], dtype=num.float)
+        self.lons = num.array([t.lon for t in targets], dtype=num.float)
+        self.north_shifts = num.array(
+            [t.north_shift for t in targets], dtype=num.float)
+        self.east_shifts = num.array(
+            [t.east_shift for t in targets], dtype=num.float)
+        self.depths = num.array([t.depth for t in targets], dtype=num.float)
+
+        elatlons = num.array(
+            [t.effective_latlon for t in targets], dtype=num.float)
+        self.effective_lats = elatlons[:, 0]
+        self.effective_lons = elatlons[:, 1]
+
+    def distances_to(self, source):
+        same = num.logical_and(
+            self.lats == source.lat, self.lons == source.lon)
+
+        dists = num.empty(same.size)
+        if num.any(same):
+            dists[same] = num.sqrt(
+                (source.north_shift - self.north_shifts[same])**2 +
+                (source.east_shift - self.east_shifts[same])**2)
+
+        other = num.logical_not(same)
+        if num.any(other):
+            slat, slon = source.effective_latlon
+            n = num.sum(other)
+            dists[other] = orthodrome.distance_accurate50m_numpy(
+                num.full(n, slat), num.full(n, slon),
+                self.effective_lats[other], self.effective_lons[other])
+
+        return dists
+
+    def make_indexing_args(self, store, source):
+        config = store.config
+        if isinstance(config, gf.ConfigTypeA):
+            dists = self.distances_to(source)
+            return (num.full(dists.size, source.depth), dists)
+
+        elif isinstance(config, gf.ConfigTypeB):
+            dists = self.distances_to(source)
+            return (self.depths, num.full(dists.size, source.depth), dists)
+
+        else:
+            return tuple(
+                num.array(x, dtype=num.float) for x in zip(*[
+                    config.make_indexing_args1(source, target)
+                    for target in self.targets]))
+
+    def evaluate(self, engine, source):
+        store = engine.get_store(self.store_id)
+        try:
+            return source.time + evaluate_timing_many(
+                store, self.timing, self.make_indexing_args(store, source))
+
+        except TimingNotVectorisable:
+            times = num.full(len(self.targets), num.nan)
+            for i, target in enumerate(self.targets):
+                t = store.t(self.timing, source, target)
+                if t is not None:
+                    times[i] = source.time + t
+
+            return times
+
+
 class ProblemConfig(Object):
     '''
     Base class for config section defining the objective function setup.
@@ -83,6 +562,12 @@ class Problem(Object):
         self._target_weights = None
         self._engine = None
         self._family_mask = None
+        self._timing_groups = None
+        self._modelling_plans = {}
+        self._targets_cached = None
+        self._superposition_cache = None
+        self._source_mapper = None
+        self._target_distances = None
 
         if hasattr(self, 'problem_waveform_parameters') and self.has_waveforms:
             self.problem_parameters =\
@@ -109,8 +594,30 @@ class Problem(Object):
     def copy(self):
         o = copy.copy(self)
         o._target_weights = None
+        o._modelling_plans = {}
+        o._superposition_cache = None
+        o._source_mapper = None
+        o._target_distances = None
         return o
 
+    def _check_targets(self):
+        '''
+        Reset data derived from the targets if these have been changed.
+        '''
+        targets = self.targets
+        targets_cached = self._targets_cached
+        if targets_cached is not None \
+                and len(targets) == len(targets_cached) \
+                and all(a is b for (a, b) in zip(targets, targets_cached)):
+            return
+
+        self._targets_cached = list(targets)
+        self._target_weights = None
+        self._family_mask = None
+        self._timing_groups = None
+        self._modelling_plans = {}
+        self._target_distances = None
+
     def set_target_parameter_values(self, x):
         nprob = len(self.problem_parameters)
         for target in self.targets:
@@ -131,6 +638,71 @@ class Problem(Object):
                 arr[ip] = d[p.name]
         return arr
 
+    def get_source_mapper(self):
+        '''
+        Get mapper for the current base source.
+
+        The mapper is rebuilt when ``base_source`` has been replaced, e.g.
+        by the synthetic tests.
+        '''
+
+        if self._source_mapper is None \
+                or self._source_mapper.base_source is not self.base_source:
+
+            self._source_mapper = SourceMapper(
+                self.base_source, self.ranges,
+                [p.name for p in self.parameters])
+
+        return self._source_mapper
+
+    def get_sources(self, xs):
+        return [self.get_source(x) for x in xs]
+
+    def get_m6s(self, xs, nchunk=10000):
+        '''
+        Get moment tensors of the sources for an ``(n, nparameters)`` array.
+
+        :returns: ``(n, 6)`` array with the moment tensor components
+            ``(mnn, mee, mdd, mne, mnd, med)``
+        '''
+
+        m6s = num.zeros((xs.shape[0], 6))
+        for i in range(0, xs.shape[0], nchunk):
+            m6s[i:i+nchunk, :] = [
+                source.pyrocko_moment_tensor().m6()
+                for source in self.get_sources(xs[i:i+nchunk, :])]
+
+        return m6s
+
+    def get_target_distances(self):
+        self._check_targets()
+        if self._target_distances is None:
+            self._target_distances = TargetDistances(self.targets)
+
+        return self._target_distances
+
+    def get_min_target_distances(self, xs):
+        '''
+        Get minimum source-target distance for many models.
+
+        :param xs: ``(n, nparameters)`` array of models
+        :returns: 1D array, ``inf`` where there are no targets
+        '''
+
+        target_distances = self.get_target_distances()
+        positions = self.get_source_mapper().get_attribute_values(
+            xs, ['lat', 'lon', 'north_shift', 'east_shift'])
+
+        sources = None
+        if target_distances.other_targets:
+            sources = self.get_sources(xs)
+
+        dists = target_distances.distances(*positions, sources=sources)
+        if dists.shape[1] == 0:
+            return num.full(xs.shape[0], num.inf)
+
+        return num.min(dists, axis=1)
+
     def dump_problem_info(self, dirname):
         fn = op.join(dirname, 'problem.yaml')
         util.ensuredirs(fn)
@@ -256,6 +828,90 @@ class Problem(Object):
             raise GrondError('Cannot get GF Store, modelling is not set up!')
         return self.get_engine().get_store(target.store_id)
 
+    def get_timing_groups(self, targets=None):
+        '''
+        Group waveform targets by GF store and travel-time definition.
+
+        :returns: list of :py:class:`TimingGroup` objects for the fit window
+            start, the fit window end and the synthetic picks, as tuples
+            ``(kind, group)`` with ``kind`` one of ``'tmin'``, ``'tmax'`` and
+            ``'tpick'``
+        '''
+        if targets is None:
+            self._check_targets()
+            if self._timing_groups is None:
+                self._timing_groups = self.get_timing_groups(self.targets)
+
+            return self._timing_groups
+
+        grouped = {}
+        for itarget, target in enumerate(targets):
+            if not isinstance(target, WaveformMisfitTarget):
+                continue
+
+            config = target.misfit_config
+            timings = [
+                ('tmin', config.tmin),
+                ('tmax', config.tmax)]
+
+            if config.pick_synthetic_traveltime and config.pick_phasename:
+                timings.append(('tpick', config.pick_synthetic_traveltime))
+
+            for kind, timing in timings:
+                if timing is None:
+                    continue
+
+                timing = get_timing(timing)
+                k = (kind, target.store_id, str(timing))
+                if k not in grouped:
+                    grouped[k] = (timing, [], [])
+
+                grouped[k][1].append(itarget)
+                grouped[k][2].append(target)
+
+        return [
+            (kind, TimingGroup(store_id, timing, itargets, group_targets))
+            for ((kind, store_id, _), (timing, itargets, group_targets))
+            in grouped.items()]
+
+    def get_waveform_timings(self, source, targets=None):
+        '''
+        Compute fit windows and synthetic pick times for waveform targets.
+
+        Travel times are evaluated with one vectorised lookup per GF store and
+        travel-time definition.
+
+        :param source: source model
+        :param targets: list of targets, defaults to the problem's targets.
+            Non-waveform targets are skipped.
+        :returns: arrays ``(tmin_fit, tmax_fit, tsyn_pick)`` of absolute
+            times, indexed by target, ``NaN`` where not applicable
+        '''
+        engine = self.get_engine()
+        ntargets = len(targets if targets is not None else self.targets)
+        times = dict(
+            (kind, num.full(ntargets, num.nan))
+            for kind in ('tmin', 'tmax', 'tpick'))
+
+        for kind, group in self.get_timing_groups(targets):
+            times[kind][group.itargets] = group.evaluate(engine, source)
+
+        return times['tmin'], times['tmax'], times['tpick']
+
+    def prepare_waveform_timings(self, source, targets=None):
+        '''
+        Hand batch-computed fit windows and picks to the waveform targets.
+        '''
+        targets = targets if targets is not None else self.targets
+        if not any(isinstance(t, WaveformMisfitTarget) for t in targets):
+            return
+
+        tmins, tmaxs, tpicks = self.get_waveform_timings(source, targets)
+        for itarget, target in enumerate(targets):
+            if isinstance(target, WaveformMisfitTarget):
+                target.set_timings(
+                    source, tmins[itarget], tmaxs[itarget], tpicks[itarget])
+
     def random_uniform(self, xbounds, rstate):
         x = rstate.uniform(0., 1., self.nparameters)
         x *= (xbounds[:, 1] - xbounds[:, 0])
@@ -265,6 +921,28 @@ class Problem(Object):
     def preconstrain(self, x):
         return x
 
+    def preconstrain_many(self, xs):
+        '''
+        Preconstrain several candidate models at once.
+
+        The default implementation calls :py:meth:`preconstrain` for each
+        model. Problems with vectorised constraints override this method.
+
+        :param xs: ``(n, nparameters)`` array of candidate models
+        :returns: tuple ``(xs, ok)`` with the preconstrained models and a
+            boolean array which is ``False`` for forbidden models
+        '''
+
+        xs_new = num.array(xs, dtype=num.float)
+        ok = num.ones(xs_new.shape[0], dtype=num.bool)
+        for i in range(xs_new.shape[0]):
+            try:
+                xs_new[i, :] = self.preconstrain(xs_new[i, :])
+            except Forbidden:
+                ok[i] = False
+
+        return xs_new, ok
+
     def extract(self, xs, i):
         if xs.ndim == 1:
             return self.extract(xs[num.newaxis, :], i)[0]
@@ -276,6 +954,7 @@ class Problem(Object):
                 xs, self.dependants[i-self.nparameters].name)
 
     def get_target_weights(self):
+        self._check_targets()
         if self._target_weights is None:
             self._target_weights = num.concatenate(
                 [target.get_combined_weight()
@@ -467,6 +1146,7 @@ class Problem(Object):
         return families, len(family_names)
 
     def get_family_mask(self):
+        self._check_targets()
         if self._family_mask is None:
             self._family_mask = self.make_family_mask()
 
@@ -480,57 +1160,102 @@ class Problem(Object):
 
         if mask is not None and targets is not None:
             raise ValueError('Mask cannot be defined with targets set.')
-        targets = targets if targets is not None else self.targets
 
+        with timed('plan'):
+            self.prepare_waveform_timings(source, targets)
+            plan = self.get_modelling_plan(engine, source, targets, mask)
+
+        targets = targets if targets is not None else self.targets
         for target in targets:
             target.set_result_mode(result_mode)
 
-        modelling_targets = []
-        t2m_map = {}
+        with timed('engine'):
+            modelling_results = plan.scatter(self.process_modelling(
+                engine, source, plan.modelling_targets_unique))
+
+        results = []
         for itarget, target in enumerate(targets):
-            t2m_map[target] = target.prepare_modelling(engine, source, targets)
-            if mask is None or mask[itarget]:
-                modelling_targets.extend(t2m_map[target])
+            if modelling_results[itarget] is not None:
+                with timed('processing.' + target.__class__.__name__):
+                    result = target.finalize_modelling(
+                        engine, source,
+                        plan.get_modelling_targets(itarget),
+                        modelling_results[itarget])
 
-        u2m_map = {}
-        for imtarget, mtarget in enumerate(modelling_targets):
-            if mtarget not in u2m_map:
-                u2m_map[mtarget] = []
+            else:
+                result = gf.SeismosizerError(
+                    'target was excluded from modelling')
+
+            results.append(result)
+
+        return results
+
+    def get_superposition_components(self, source):
+        '''
+        Decompose source for synthetics from cached elementary responses.
+
+        Problems offering such a mode return a list of
+        :py:class:`~grond.problems.superposition.SuperpositionComponent`
+        objects when it is enabled.
+
+        :returns: list of components or ``None`` to run the GF engine directly
+        '''
+        return None
+
+    def get_superposition_cache(self, nmax=64):
+        if self._superposition_cache is None:
+            self._superposition_cache = SuperpositionCache(nmax=nmax)
 
-            u2m_map[mtarget].append(imtarget)
+        return self._superposition_cache
 
-        modelling_targets_unique = list(u2m_map.keys())
+    def process_modelling(self, engine, source, modelling_targets):
+        '''
+        Compute synthetics for the modelling targets.
+
+        :returns: list of results, one for each modelling target
+        '''
+        components = self.get_superposition_components(source)
+        if components is not None:
+            return process_superposition(
+                self.get_superposition_cache(), engine, source,
+                modelling_targets, components, nthreads=self.nthreads)
 
-        resp = engine.process(source, modelling_targets_unique,
+        resp = engine.process(source, modelling_targets,
                               nthreads=self.nthreads)
-        modelling_results_unique = list(resp.results_list[0])
 
-        modelling_results = [None] * len(modelling_targets)
+        return list(resp.results_list[0])
 
-        for mtarget, mresult in zip(
-                modelling_targets_unique, modelling_results_unique):
+    def get_modelling_plan(self, engine, source, targets=None, mask=None):
+        '''
+        Get modelling plan for the problem's targets, cached by mask.
 
-            for itarget in u2m_map[mtarget]:
-                modelling_results[itarget] = mresult
+        Cached plans are dropped when the problem's targets are changed. If
+        *targets* is given, a new plan for these targets is created on every
+        call.
 
-        imt = 0
-        results = []
-        for itarget, target in enumerate(targets):
-            nmt_this = len(t2m_map[target])
-            if mask is None or mask[itarget]:
-                result = target.finalize_modelling(
-                    engine, source,
-                    t2m_map[target],
-                    modelling_results[imt:imt+nmt_this])
+        :returns: :py:class:`ModellingPlan` object, prepared for the current
+            evaluation
+        '''
+        if targets is not None:
+            return ModellingPlan(engine, source, targets, mask)
 
-                imt += nmt_this
-            else:
-                result = gf.SeismosizerError(
-                    'target was excluded from modelling')
+        if mask is None:
+            k = None
+        else:
+            k = num.asarray(mask, dtype=num.bool).tobytes()
 
-            results.append(result)
+        self._check_targets()
+        plan = self._modelling_plans.get(k, None)
+        if plan is None:
+            if len(self._modelling_plans) >= 16:
+                self._modelling_plans.clear()
 
-        return results
+            plan = ModellingPlan(engine, source, self.targets, mask)
+            self._modelling_plans[k] = plan
+        else:
+            plan.prepare(engine, source, self.targets)
+
+        return plan
 
     def misfits(self, x, mask=None):
         results = self.evaluate(x, mask=mask, result_mode='sparse')
@@ -1,19 +1,233 @@
 import numpy as num
 import math
 import logging
+import hashlib
+from collections import OrderedDict
 
 from pyrocko import gf, util, moment_tensor as mtm
-from pyrocko.guts import String, Float, Dict, StringChoice, Int
+from pyrocko.guts import String, Float, Dict, StringChoice, Int, Bool
 
 from grond.meta import Forbidden, expand_template, Parameter, \
     has_get_plot_classes
 
 from ..base import Problem, ProblemConfig
+from ..superposition import get_moment_tensor_component
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.problems.cmt.problem')
 km = 1e3
 as_km = dict(scale_factor=km, scale_unit='km')
+r2d = 180. / math.pi
+
+
+def symmat6_many(m6s):
+    '''
+    Create stack of symmetric 3x3 matrices from an ``(n, 6)`` array.
+    '''
+    ms = num.empty((m6s.shape[0], 3, 3))
+    for k, (i, j) in enumerate(
+            [(0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2)]):
+
+        ms[:, i, j] = m6s[:, k]
+        ms[:, j, i] = m6s[:, k]
+
+    return ms
+
+
+def standard_decomposition_ratios(ms):
+    '''
+    Signed ISO and CLVD ratios for a stack of moment tensors.
+
+    Array version of
+    :py:meth:`pyrocko.moment_tensor.MomentTensor.standard_decomposition`.
+
+    :param ms: ``(n, 3, 3)`` array of moment tensors
+    :returns: ``(ratio_iso, ratio_clvd)``, the ratios signed like the
+        isotropic moment and the largest CLVD eigenvalue, respectively
+    '''
+
+    epsilon = 1e-6
+    n = ms.shape[0]
+
+    trace_m = num.trace(ms, axis1=1, axis2=2)
+    moment_iso = num.abs(trace_m / 3.)
+
+    m_devi = ms.copy()
+    for i in range(3):
+        m_devi[:, i, i] -= trace_m / 3.
+
+    evals = num.linalg.eigvalsh(m_devi)
+
+    moment_devi = num.max(num.abs(evals), axis=1)
+    moment = moment_iso + moment_devi
+
+    iorder = num.argsort(num.abs(evals), axis=1)
+    evals_sorted = evals[num.arange(n)[:, num.newaxis], iorder]
+
+    e0, e1, e2 = evals_sorted.T
+    with num.errstate(divide='ignore', invalid='ignore'):
+        signed_moment_dc = e2 * (1.0 + 2.0 * num.minimum(0.0, e0 / e2))
+
+    signed_moment_dc[moment_devi < epsilon * moment_iso] = 0.
+    moment_dc = num.abs(signed_moment_dc)
+    moment_clvd = moment_devi - moment_dc
+
+    evals_clvd = num.sort(num.vstack(
+        (e0, e1 + signed_moment_dc, e2 - signed_moment_dc)).T, axis=1)
+
+    iclvd = num.argmax(num.abs(evals_clvd), axis=1)
+    sign_clvd = num.sign(evals_clvd[num.arange(n), iclvd])
+
+    with num.errstate(divide='ignore', invalid='ignore'):
+        ratio_iso = moment_iso / moment * num.sign(trace_m)
+        ratio_clvd = moment_clvd / moment * sign_clvd
+
+    return ratio_iso, ratio_clvd
+
+
+def unique_euler_many(alpha, beta, gamma):
+    '''
+    Array version of :py:func:`pyrocko.moment_tensor.unique_euler`.
+    '''
+
+    pi = math.pi
+
+    alpha = num.mod(alpha, 2.0*pi)
+
+    m1 = num.logical_and(0.5*pi < alpha, alpha <= pi)
+    m2 = num.logical_and(pi < alpha, alpha <= 1.5*pi)
+    m3 = num.logical_and(1.5*pi < alpha, alpha <= 2.0*pi)
+
+    alpha = num.choose(
+        m1 + 2*m2 + 3*m3, [alpha, pi - alpha, alpha - pi, 2.0*pi - alpha])
+    beta = num.where(m1 | m3, beta + pi, beta)
+    gamma = num.choose(
+        m1 + 2*m2 + 3*m3, [gamma, 2.0*pi - gamma, pi - gamma, pi + gamma])
+
+    alpha = num.mod(alpha, 2.0*pi)
+    beta = num.mod(beta, 2.0*pi)
+    gamma = num.mod(gamma+pi, 2.0*pi)-pi
+
+    alpha[num.abs(alpha - 0.5*pi) < 1e-10] = 0.5*pi
+    beta[num.abs(beta - pi) < 1e-10] = pi
+    beta[num.abs(beta - 2.*pi) < 1e-10] = 0.
+    beta[num.abs(beta) < 1e-10] = 0.
+
+    vertical = num.logical_and(alpha == 0.5*pi, beta >= pi)
+    beta[vertical] = num.mod(beta[vertical] - pi, 2.0*pi)
+    gamma[vertical] = num.mod(-gamma[vertical] + pi, 2.0*pi) - pi
+
+    horizontal = alpha < 1e-7
+    beta[horizontal] = num.mod(beta[horizontal] + gamma[horizontal], 2.0*pi)
+    gamma[horizontal] = 0.
+
+    return alpha, beta, gamma
+
+
+def matrix_to_euler_many(rotmats):
+    '''
+    Array version of :py:func:`pyrocko.moment_tensor.matrix_to_euler`.
+    '''
+
+    exs = rotmats[:, 0, :]
+    ezs = rotmats[:, 2, :]
+    enodes = num.zeros_like(ezs)
+    enodes[:, 0] = -ezs[:, 1]
+    enodes[:, 1] = ezs[:, 0]
+
+    degenerate = num.sqrt(num.sum(enodes**2, axis=1)) < 1e-10
+    enodes[degenerate] = exs[degenerate]
+
+    enodess = num.einsum('nij,nj->ni', rotmats, enodes)
+    cos_alpha = num.clip(ezs[:, 2], -1., 1.)
+
+    alpha = num.arccos(cos_alpha)
+    beta = num.mod(num.arctan2(enodes[:, 1], enodes[:, 0]), math.pi*2.)
+    gamma = num.mod(-num.arctan2(enodess[:, 1], enodess[:, 0]), math.pi*2.)
+
+    return unique_euler_many(alpha, beta, gamma)
+
+
+def both_strike_dip_rake_many(ms):
+    '''
+    Array version of
+    :py:meth:`pyrocko.moment_tensor.MomentTensor.both_strike_dip_rake`.
+
+    :param ms: ``(n, 3, 3)`` array of moment tensors
+    :returns: ``(n, 2, 3)`` array with the two strike-dip-rake triplets [deg]
+    '''
+
+    n = ms.shape[0]
+    _, evecs = num.linalg.eigh(ms)
+    evecs[num.linalg.det(evecs) < 0.] *= -1.
+
+    rotmat1 = num.einsum(
+        'nij,kj->nik', evecs, mtm.MomentTensor._u_evecs).transpose(0, 2, 1)
+    rotmat1[num.linalg.det(rotmat1) < 0.] *= -1.
+
+    rotmat2 = num.einsum('ij,njk->nik', mtm.MomentTensor._flip_dc, rotmat1)
+
+    # order like the lexicographic sort of the absolute matrix elements
+    # in MomentTensor._update
+    a1 = num.abs(rotmat1.reshape(n, 9))
+    a2 = num.abs(rotmat2.reshape(n, 9))
+    differ = a1 != a2
+    ifirst = num.argmax(differ, axis=1)
+    swap = num.logical_and(
+        differ[num.arange(n), ifirst],
+        a1[num.arange(n), ifirst] > a2[num.arange(n), ifirst])
+
+    rotmats = num.stack((rotmat1, rotmat2), axis=1)
+    rotmats[swap] = rotmats[swap, ::-1]
+
+    sdrs = num.empty((n, 2, 3))
+    for i in range(2):
+        alpha, beta, gamma = matrix_to_euler_many(rotmats[:, i])
+        sdrs[:, i, 0] = r2d*beta
+        sdrs[:, i, 1] = r2d*alpha
+        sdrs[:, i, 2] = -r2d*gamma
+
+    return sdrs
+
+
+def dsdr_many(sdr1, sdr2):
+    '''
+    Array version of :py:func:`pyrocko.moment_tensor.dsdr`.
+    '''
+
+    ds = num.abs(sdr1[..., 0] % 360. - sdr2[..., 0] % 360.)
+    ds = num.where(ds <= 180., ds, 360. - ds)
+
+    dr = num.abs(sdr1[..., 2] % 360. - sdr2[..., 2] % 360.)
+    dr = num.where(dr <= 180., dr, 360. - dr)
+
+    dd = num.abs(sdr1[..., 1] - sdr2[..., 1])
+
+    return num.sqrt(ds**2 + dr**2 + dd**2)
+
+
+def order_like_many(sdrs, sdrs_ref):
+    '''
+    Array version of :py:func:`pyrocko.moment_tensor.order_like`.
+
+    :param sdrs: ``(n, 2, 3)`` array of strike-dip-rake pairs
+    :param sdrs_ref: reference pair, as returned by
+        :py:meth:`pyrocko.moment_tensor.MomentTensor.both_strike_dip_rake`
+    '''
+
+    sdrs_ref = num.asarray(sdrs_ref, dtype=num.float)
+
+    d1 = num.minimum(
+        dsdr_many(sdrs[:, 0], sdrs_ref[0]),
+        dsdr_many(sdrs[:, 1], sdrs_ref[1]))
+    d2 = num.minimum(
+        dsdr_many(sdrs[:, 0], sdrs_ref[1]),
+        dsdr_many(sdrs[:, 1], sdrs_ref[0]))
+
+    swap = num.logical_not(d1 < d2)
+    sdrs = sdrs.copy()
+    sdrs[swap] = sdrs[swap, ::-1]
+    return sdrs
 
 
 class MTType(StringChoice):
@@ -26,6 +240,22 @@ class CMTProblemConfig(ProblemConfig):
     distance_min = Float.T(default=0.0)
     mt_type = MTType.T(default='full')
     nthreads = Int.T(default=1)
+    mt_superposition = Bool.T(
+        default=False,
+        help='Compose synthetics from six cached elementary moment tensor '
+             'responses per centroid location, time and duration, instead '
+             'of running the GF engine for every model.')
+    mt_superposition_cache_size = Int.T(
+        default=64,
+        help='Number of centroid configurations kept in the cache of '
+             'elementary responses.')
+    spectral_time_stf = Bool.T(
+        default=False,
+        help='Apply centroid time and STF duration analytically in the '
+             'frequency domain to cached impulse responses. The responses '
+             'are composed from six elementary moment tensors, as with '
+             '``mt_superposition``, but are only cached per centroid '
+             'location.')
 
     def get_problem(self, event, target_groups, targets):
         if event.depth is None:
@@ -47,7 +277,10 @@ class CMTProblemConfig(ProblemConfig):
             distance_min=self.distance_min,
             mt_type=self.mt_type,
             norm_exponent=self.norm_exponent,
-            nthreads=self.nthreads)
+            nthreads=self.nthreads,
+            mt_superposition=self.mt_superposition,
+            mt_superposition_cache_size=self.mt_superposition_cache_size,
+            spectral_time_stf=self.spectral_time_stf)
 
         return problem
 
@@ -81,70 +314,115 @@ class CMTProblem(Problem):
 
     distance_min = Float.T(default=0.0)
     mt_type = MTType.T(default='full')
+    mt_superposition = Bool.T(default=False)
+    mt_superposition_cache_size = Int.T(default=64)
+    spectral_time_stf = Bool.T(default=False)
 
     def __init__(self, **kwargs):
         Problem.__init__(self, **kwargs)
-        self.deps_cache = {}
+        self.deps_cache = OrderedDict()
+        self._deps_base_source = None
+
+    def get_superposition_cache(self):
+        return Problem.get_superposition_cache(
+            self, nmax=self.mt_superposition_cache_size)
+
+    def get_superposition_components(self, source):
+        # The moment tensor changes with every model, so cached impulse
+        # responses are always composed from six elementary moment tensors.
+        tref = self.base_source.time if self.spectral_time_stf else None
+        if self.mt_superposition or tref is not None:
+            component = get_moment_tensor_component(source, tref)
+        else:
+            return None
+
+        return [component] if component is not None else None
 
     def get_source(self, x):
-        d = self.get_parameter_dict(x)
-        rm6 = num.array([d.rmnn, d.rmee, d.rmdd, d.rmne, d.rmnd, d.rmed],
-                        dtype=num.float)
+        mapper = self.get_source_mapper()
+        rm6 = x[mapper.indices(
+            ['rmnn', 'rmee', 'rmdd', 'rmne', 'rmnd', 'rmed'])]
 
-        m0 = mtm.magnitude_to_moment(d.magnitude)
-        m6 = rm6 * m0
+        m0 = mtm.magnitude_to_moment(x[mapper.index('magnitude')])
+        stf = gf.HalfSinusoidSTF(duration=float(x[mapper.index('duration')]))
 
-        p = {}
-        for k in self.base_source.keys():
-            if k in d:
-                p[k] = float(
-                    self.ranges[k].make_relative(self.base_source[k], d[k]))
+        return mapper.get_source(x, m6=tuple((rm6 * m0).tolist()), stf=stf)
 
-        stf = gf.HalfSinusoidSTF(duration=float(d.duration))
+    def get_m6s(self, xs):
+        mapper = self.get_source_mapper()
+        rm6s = xs[:, mapper.indices(
+            ['rmnn', 'rmee', 'rmdd', 'rmne', 'rmnd', 'rmed'])]
 
-        source = self.base_source.clone(m6=m6, stf=stf, **p)
-        return source
+        m0s = mtm.magnitude_to_moment(xs[:, mapper.index('magnitude')])
+        return rm6s * m0s[:, num.newaxis]
 
-    def make_dependant(self, xs, pname):
-        cache = self.deps_cache
-        if xs.ndim == 1:
-            return self.make_dependant(xs[num.newaxis, :], pname)[0]
+    def get_sources(self, xs):
+        mapper = self.get_source_mapper()
+        m6s = self.get_m6s(xs)
+        durations = xs[:, mapper.index('duration')]
 
-        if pname not in self.dependant_names:
-            raise KeyError(pname)
+        return mapper.get_sources(xs, [
+            dict(
+                m6=tuple(m6.tolist()),
+                stf=gf.HalfSinusoidSTF(duration=float(duration)))
+            for (m6, duration) in zip(m6s, durations)])
+
+    def get_dependants(self, xs):
+        '''
+        Compute all dependant parameters for an ``(n, nparameters)`` array.
+
+        The results of the most recent calls are cached, as the dependants
+        are usually requested one by one for the same set of models.
+        '''
+
+        if self._deps_base_source is not self.base_source:
+            # strike, dip, rake are ordered like the base source's
+            self.deps_cache.clear()
+            self._deps_base_source = self.base_source
+
+        key = (xs.shape, hashlib.sha1(xs.tobytes()).digest())
+        if key in self.deps_cache:
+            return self.deps_cache[key]
 
-        mt = self.base_source.pyrocko_moment_tensor()
+        imag = self.parameter_names.index('magnitude')
+        irm6 = [self.parameter_names.index(name) for name in (
+            'rmnn', 'rmee', 'rmdd', 'rmne', 'rmnd', 'rmed')]
 
-        sdrs_ref = mt.both_strike_dip_rake()
+        m0 = mtm.magnitude_to_moment(xs[:, imag])
+        ms = symmat6_many(xs[:, irm6] * m0[:, num.newaxis])
 
-        y = num.zeros(xs.shape[0])
-        for i, x in enumerate(xs):
-            k = tuple(x.tolist())
-            if k not in cache:
-                source = self.get_source(x)
-                mt = source.pyrocko_moment_tensor()
-                res = mt.standard_decomposition()
-                sdrs = mt.both_strike_dip_rake()
-                if sdrs_ref:
-                    sdrs = mtm.order_like(sdrs, sdrs_ref)
+        sdrs = both_strike_dip_rake_many(ms)
+        sdrs_ref = self.base_source.pyrocko_moment_tensor() \
+            .both_strike_dip_rake()
 
-                cache[k] = mt, res, sdrs
+        if sdrs_ref:
+            sdrs = order_like_many(sdrs, sdrs_ref)
 
-            mt, res, sdrs = cache[k]
+        ratio_iso, ratio_clvd = standard_decomposition_ratios(ms)
 
-            if pname == 'rel_moment_iso':
-                ratio_iso, m_iso = res[0][1:3]
-                y[i] = ratio_iso * num.sign(m_iso[0, 0])
-            elif pname == 'rel_moment_clvd':
-                ratio_clvd, m_clvd = res[2][1:3]
-                evals, evecs = mtm.eigh_check(m_clvd)
-                ii = num.argmax(num.abs(evals))
-                y[i] = ratio_clvd * num.sign(evals[ii])
-            else:
-                isdr = {'strike': 0, 'dip': 1, 'rake': 2}[pname[:-1]]
-                y[i] = sdrs[int(pname[-1])-1][isdr]
+        deps = dict(
+            rel_moment_iso=ratio_iso,
+            rel_moment_clvd=ratio_clvd)
 
-        return y
+        for iplane in range(2):
+            for isdr, name in enumerate(['strike', 'dip', 'rake']):
+                deps['%s%i' % (name, iplane+1)] = sdrs[:, iplane, isdr]
+
+        while len(self.deps_cache) >= 4:
+            self.deps_cache.popitem(last=False)
+
+        self.deps_cache[key] = deps
+        return deps
+
+    def make_dependant(self, xs, pname):
+        if xs.ndim == 1:
+            return self.make_dependant(xs[num.newaxis, :], pname)[0]
+
+        if pname not in self.dependant_names:
+            raise KeyError(pname)
+
+        return self.get_dependants(
+            num.ascontiguousarray(xs, dtype=num.float))[pname].copy()
 
     def pack(self, source):
         m6 = source.m6
@@ -172,33 +450,36 @@ class CMTProblem(Problem):
         return x.tolist()
 
     def preconstrain(self, x):
-        d = self.get_parameter_dict(x)
-        m6 = num.array([d.rmnn, d.rmee, d.rmdd, d.rmne, d.rmnd, d.rmed],
-                       dtype=num.float)
+        xs, ok = self.preconstrain_many(
+            num.asarray(x, dtype=num.float)[num.newaxis, :])
 
-        m9 = mtm.symmat6(*m6)
+        if not ok[0]:
+            raise Forbidden()
+
+        return xs[0, :]
+
+    def preconstrain_many(self, xs):
+        xs = num.array(xs, dtype=num.float)
+        irm6 = [self.parameter_names.index(name) for name in (
+            'rmnn', 'rmee', 'rmdd', 'rmne', 'rmnd', 'rmed')]
+
+        m6s = xs[:, irm6]
         if self.mt_type == 'deviatoric':
-            trace_m = num.trace(m9)
-            m_iso = num.diag([trace_m / 3., trace_m / 3., trace_m / 3.])
-            m9 -= m_iso
+            m6s[:, :3] -= num.sum(m6s[:, :3], axis=1)[:, num.newaxis] / 3.
 
         elif self.mt_type == 'dc':
-            mt = mtm.MomentTensor(m=m9)
-            m9 = mt.standard_decomposition()[1][2]
+            for i in range(m6s.shape[0]):
+                mt = mtm.MomentTensor(m=mtm.symmat6(*m6s[i, :]))
+                m6s[i, :] = mtm.to6(mt.standard_decomposition()[1][2])
 
-        m0_unscaled = math.sqrt(num.sum(m9.A**2)) / math.sqrt(2.)
+        m0s_unscaled = num.sqrt(
+            num.sum(m6s[:, :3]**2, axis=1)
+            + 2. * num.sum(m6s[:, 3:]**2, axis=1)) / math.sqrt(2.)
 
-        m9 /= m0_unscaled
-        m6 = mtm.to6(m9)
-        d.rmnn, d.rmee, d.rmdd, d.rmne, d.rmnd, d.rmed = m6
-        x = self.get_parameter_array(d)
+        xs[:, irm6] = m6s / m0s_unscaled[:, num.newaxis]
 
-        source = self.get_source(x)
-        for t in self.targets:
-            if (self.distance_min > num.asarray(t.distance_to(source))).any():
-                raise Forbidden()
-
-        return x
+        ok = self.get_min_target_distances(xs) >= self.distance_min
+        return xs, ok
 
     def get_dependant_bounds(self):
         out = [
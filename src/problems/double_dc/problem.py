@@ -2,12 +2,13 @@ import numpy as num
 import logging
 
 from pyrocko import gf, util
-from pyrocko.guts import String, Float, Dict, Int
+from pyrocko.guts import String, Float, Dict, Int, Bool
 
 from grond.meta import Forbidden, expand_template, Parameter, \
     has_get_plot_classes
 
 from ..base import Problem, ProblemConfig
+from ..superposition import get_moment_tensor_component
 
 
 guts_prefix = 'grond'
@@ -21,6 +22,10 @@ class DoubleDCProblemConfig(ProblemConfig):
     ranges = Dict.T(String.T(), gf.Range.T())
     distance_min = Float.T(default=0.0)
     nthreads = Int.T(default=1)
+    spectral_time_stf = Bool.T(
+        default=False,
+        help='Apply source time and STF duration analytically in the '
+             'frequency domain to cached impulse responses.')
 
     def get_problem(self, event, target_groups, targets):
         if event.depth is None:
@@ -41,7 +46,8 @@ class DoubleDCProblemConfig(ProblemConfig):
             ranges=self.ranges,
             distance_min=self.distance_min,
             norm_exponent=self.norm_exponent,
-            nthreads=self.nthreads)
+            nthreads=self.nthreads,
+            spectral_time_stf=self.spectral_time_stf)
 
         return problem
 
@@ -71,20 +77,29 @@ class DoubleDCProblem(Problem):
 
     dependants = []
     distance_min = Float.T(default=0.0)
+    spectral_time_stf = Bool.T(default=False)
 
     def get_source(self, x):
-        d = self.get_parameter_dict(x)
-        p = {}
-        for k in self.base_source.keys():
-            if k in d:
-                p[k] = float(
-                    self.ranges[k].make_relative(self.base_source[k], d[k]))
+        mapper = self.get_source_mapper()
+        stf1 = gf.HalfSinusoidSTF(
+            duration=float(x[mapper.index('duration1')]))
+        stf2 = gf.HalfSinusoidSTF(
+            duration=float(x[mapper.index('duration2')]))
 
-        stf1 = gf.HalfSinusoidSTF(duration=float(d.duration1))
-        stf2 = gf.HalfSinusoidSTF(duration=float(d.duration2))
+        return mapper.get_source(x, stf1=stf1, stf2=stf2)
 
-        source = self.base_source.clone(stf1=stf1, stf2=stf2, **p)
-        return source
+    def get_superposition_components(self, source):
+        if not self.spectral_time_stf:
+            return None
+
+        components = [
+            get_moment_tensor_component(subsource, self.base_source.time)
+            for subsource in source.split()]
+
+        if None in components:
+            return None
+
+        return components
 
     def make_dependant(self, xs, pname):
         if xs.ndim == 1:
@@ -111,12 +126,16 @@ class DoubleDCProblem(Problem):
         return x.tolist()
 
     def preconstrain(self, x):
-        source = self.get_source(x)
-        if any(self.distance_min > source.distance_to(t)
-               for t in self.targets):
+        x = num.array(x, dtype=num.float)
+        if self.get_min_target_distances(x[num.newaxis, :])[0] \
+                < self.distance_min:
             raise Forbidden()
 
-        return num.array(x, dtype=num.float)
+        return x
+
+    def preconstrain_many(self, xs):
+        xs = num.array(xs, dtype=num.float)
+        return xs, self.get_min_target_distances(xs) >= self.distance_min
 
     @classmethod
     def get_plot_classes(cls):
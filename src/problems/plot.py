@@ -11,6 +11,8 @@ from pyrocko.plot import mpl_margins, mpl_color, mpl_init, mpl_graph_color
 from pyrocko.plot import beachball, hudson
 
 from grond.plot.config import PlotConfig
+from grond.plot.density import DensityPlotConfig, density_weightings, \
+    get_model_weights, histogram2d, gaussian_kde_binned, draw_density
 from grond.plot.section import SectionPlotConfig, SectionPlot
 from grond.plot.collection import PlotItem
 from grond import meta, core, stats
@@ -48,7 +50,7 @@ def eigh_sorted(mat):
     return evals[iorder], evecs[:, iorder]
 
 
-class JointparPlot(PlotConfig):
+class JointparPlot(DensityPlotConfig):
     '''
     Source problem parameter's tradeoff plots.
     '''
@@ -63,6 +65,10 @@ class JointparPlot(PlotConfig):
     show_ellipses = Bool.T(default=False)
     nsubplots = Int.T(default=6)
     show_reference = Bool.T(default=True)
+    density_weighting = StringChoice.T(
+        choices=density_weightings,
+        default='misfit_rank',
+        help='Weight of the models in the density grids.')
 
     def make(self, environ):
         cm = environ.get_plot_collection_manager()
@@ -126,15 +132,30 @@ parameter bounds and shows the model space of the optimsation. %s''' % sref)
 
         gms = gms[isort]
         models = models[isort, :]
+        bootstrap_misfits = history.bootstrap_misfits
+        if bootstrap_misfits is not None:
+            bootstrap_misfits = bootstrap_misfits[isort, :]
 
         if misfit_cutoff is not None:
             ibest = gms < misfit_cutoff
             gms = gms[ibest]
             models = models[ibest]
+            if bootstrap_misfits is not None:
+                bootstrap_misfits = bootstrap_misfits[ibest, :]
 
         nmodels = models.shape[0]
         kwargs = {}
 
+        use_density = self.use_density(nmodels)
+        if use_density:
+            if color_parameter != 'misfit':
+                logger.info(
+                    'Plot jointpar: color_parameter is ignored when drawing '
+                    'density grids.')
+
+            weights = get_model_weights(
+                self.density_weighting, gms, bootstrap_misfits)
+
         if color_parameter == 'dist':
             mx = num.mean(models, axis=0)
             cov = num.cov(models.T)
@@ -291,11 +312,23 @@ parameter bounds and shows the model space of the optimsation. %s''' % sref)
                 fx = problem.extract(models, jpar)
                 fy = problem.extract(models, ipar)
 
-                axes.scatter(
-                    xpar.scaled(fx),
-                    ypar.scaled(fy),
-                    c=icolor,
-                    s=msize, alpha=0.5, cmap=cmap, edgecolors='none', **kwargs)
+                if use_density:
+                    xedges = num.linspace(xmin, xmax, self.density_nbins + 1)
+                    yedges = num.linspace(ymin, ymax, self.density_nbins + 1)
+                    draw_density(
+                        axes,
+                        histogram2d(
+                            xpar.scaled(fx), ypar.scaled(fy),
+                            xedges, yedges, weights),
+                        xedges, yedges, cmap='coolwarm')
+
+                else:
+                    axes.scatter(
+                        xpar.scaled(fx),
+                        ypar.scaled(fy),
+                        c=icolor,
+                        s=msize, alpha=0.5, cmap=cmap, edgecolors='none',
+                        **kwargs)
 
                 if show_ellipses:
                     cov = num.cov((xpar.scaled(fx), ypar.scaled(fy)))
@@ -331,7 +364,7 @@ parameter bounds and shows the model space of the optimsation. %s''' % sref)
         return figs_flat
 
 
-class HistogramPlot(PlotConfig):
+class HistogramPlot(DensityPlotConfig):
     '''
     Histograms or Gaussian kernel densities (default) of all parameters
     (marginal distributions of model parameters).
@@ -434,6 +467,14 @@ space.
 
         rstats = make_stats(problem, models, misfits, pnames=pnames)
 
+        use_density = self.use_density(history.nmodels)
+        weights = None
+        if use_density:
+            weights = get_model_weights(
+                self.density_weighting,
+                problem.combine_misfits(misfits),
+                history.bootstrap_misfits)
+
         for iselected in range(nselected):
             ipar = smap[iselected]
             par = problem.combined[ipar]
@@ -451,17 +492,21 @@ space.
             axes.set_xlim(*fixlim(*par.scaled((vmin, vmax))))
 
             if method == 'gaussian_kde':
-                try:
-                    kde = scipy.stats.gaussian_kde(vs)
-                except Exception:
+                vps = num.linspace(vmin, vmax, 600)
+                if use_density:
+                    pps = gaussian_kde_binned(vs, vps, weights)
+                else:
+                    try:
+                        pps = scipy.stats.gaussian_kde(vs)(vps)
+                    except Exception:
+                        pps = None
+
+                if pps is None:
                     logger.warn(
                         'Cannot create plot histogram with gaussian_kde: '
                         'possibly all samples have the same value.')
                     continue
 
-                vps = num.linspace(vmin, vmax, 600)
-                pps = kde(vps)
-
                 axes.plot(
                     par.scaled(vps), par.inv_scaled(pps), color=stats_color)
 
@@ -469,7 +514,8 @@ space.
                 pps, edges = num.histogram(
                     vs,
                     bins=num.linspace(vmin, vmax, num=40),
-                    density=True)
+                    density=True,
+                    weights=weights)
                 vps = 0.5 * (edges[:-1] + edges[1:])
 
                 axes.bar(par.scaled(vps), par.inv_scaled(pps),
@@ -842,7 +888,97 @@ high (blue) misfit.
         return [[item, fig]]
 
 
-class MTFuzzyPlot(PlotConfig):
+def fuzzy_beachball_amps(
+        m6s, weights=None, grid_resolution=200, projection='lambert',
+        nchunk=1000):
+
+    '''
+    Weighted stack of P wave polarities of many moment tensors.
+
+    Same as :py:func:`pyrocko.plot.beachball.mts2amps` with
+    ``beachball_type='full'`` and ``mask=True``, but the radiation patterns
+    are evaluated for chunks of moment tensors at once.
+    '''
+
+    if weights is None:
+        weights = num.ones(m6s.shape[0])
+
+    nx = ny = grid_resolution
+    x = num.linspace(-1., 1., nx)
+    y = num.linspace(-1., 1., ny)
+
+    vecs2 = num.zeros((nx * ny, 2))
+    vecs2[:, 0] = num.tile(x, ny)
+    vecs2[:, 1] = num.repeat(y, nx)
+
+    ii_ok = vecs2[:, 0]**2 + vecs2[:, 1]**2 <= 1.0
+    vn, ve, vd = beachball.inverse_project(vecs2[ii_ok, :], projection).T
+
+    # quadratic form v^T M v for m6 = (mnn, mee, mdd, mne, mnd, med)
+    qs = num.vstack((vn**2, ve**2, vd**2, 2.*vn*ve, 2.*vn*vd, 2.*ve*vd))
+
+    amps_ok = num.zeros(qs.shape[1])
+    for i in range(0, m6s.shape[0], nchunk):
+        amps_ok += num.dot(
+            weights[i:i+nchunk],
+            num.dot(m6s[i:i+nchunk, :], qs) > 0.)
+
+    amps = num.full(nx * ny, num.nan)
+    amps[ii_ok] = amps_ok / num.sum(weights)
+    return amps.reshape((ny, nx)), x, y
+
+
+def plot_fuzzy_beachball_density(
+        axes, m6s, weights, best_mt, size, position,
+        color_t='red', color_p='white', edgecolor='black', best_color='red',
+        linewidth=2, projection='lambert', grid_resolution=200):
+
+    '''
+    Draw fuzzy beachball from stacked polarities, see
+    :py:func:`pyrocko.plot.beachball.plot_fuzzy_beachball_mpl_pixmap`.
+    '''
+
+    size = size * 0.5
+    amps, x, y = fuzzy_beachball_amps(
+        m6s, weights,
+        grid_resolution=grid_resolution,
+        projection=projection)
+
+    cmap = mcolors.LinearSegmentedColormap.from_list(
+        'fuzzy', [color_p, color_t], N=256)
+
+    axes.imshow(
+        amps.T,
+        extent=(
+            position[0] + y[0] * size,
+            position[0] + y[-1] * size,
+            position[1] - x[0] * size,
+            position[1] - x[-1] * size),
+        cmap=cmap,
+        zorder=-0.1)
+
+    best_amps, bx, by = beachball.mts2amps(
+        [best_mt],
+        grid_resolution=grid_resolution,
+        projection=projection,
+        beachball_type='full',
+        mask=False)
+
+    axes.contour(
+        position[0] + by * size, position[1] + bx * size, best_amps.T,
+        levels=[0.],
+        colors=[best_color],
+        linewidths=linewidth)
+
+    phi = num.linspace(0., 2 * math.pi, 361)
+    axes.plot(
+        position[0] + num.cos(phi) * size,
+        position[1] + num.sin(phi) * size,
+        linewidth=linewidth,
+        color=edgecolor)
+
+
+class MTFuzzyPlot(DensityPlotConfig):
     '''Fuzzy, propabalistic moment tensor plot '''
 
     name = 'mt_fuzzy'
@@ -850,6 +986,11 @@ class MTFuzzyPlot(PlotConfig):
     cluster_attribute = meta.StringID.T(
         optional=True,
         help='name of attribute to use as cluster IDs')
+    density_nsamples = Int.T(
+        default=20000,
+        help='Maximum number of models stacked when drawing density grids. '
+             'Larger ensembles are represented by a random sample, drawn '
+             'with probabilities proportional to the model weights.')
 
     def make(self, environ):
         cm = environ.get_plot_collection_manager()
@@ -877,15 +1018,15 @@ best solution (indicated in red).
         by_cluster = history.imodels_by_cluster(
             self.cluster_attribute)
 
+        use_density = self.use_density(history.nmodels)
+        if use_density:
+            gms = problem.combine_misfits(history.misfits)
+            bootstrap_misfits = history.bootstrap_misfits
+
         for icluster, percentage, imodels in by_cluster:
             misfits = history.misfits[imodels]
             models = history.models[imodels]
 
-            mts = []
-            for ix, x in enumerate(models):
-                source = problem.get_source(x)
-                mts.append(source.pyrocko_moment_tensor())
-
             best_mt = stats.get_best_source(
                 problem, models, misfits).pyrocko_moment_tensor()
 
@@ -898,14 +1039,45 @@ best solution (indicated in red).
             else:
                 color = 'black'
 
-            beachball.plot_fuzzy_beachball_mpl_pixmap(
-                mts, axes, best_mt,
-                beachball_type='full',
-                size=8.*math.sqrt(percentage/100.),
-                position=(5., 5.),
-                color_t=color,
-                edgecolor='black',
-                best_color=mpl_color('scarletred2'))
+            if use_density:
+                weights = get_model_weights(
+                    self.density_weighting,
+                    gms[imodels],
+                    bootstrap_misfits[imodels]
+                    if bootstrap_misfits is not None else None)
+
+                if models.shape[0] > self.density_nsamples \
+                        and num.sum(weights) > 0.0:
+
+                    rstate = num.random.RandomState(123)
+                    isamples = rstate.choice(
+                        models.shape[0], size=self.density_nsamples,
+                        p=weights / num.sum(weights))
+
+                    models = models[isamples, :]
+                    weights = num.ones(self.density_nsamples)
+
+                plot_fuzzy_beachball_density(
+                    axes, problem.get_m6s(models), weights, best_mt,
+                    size=8.*math.sqrt(percentage/100.),
+                    position=(5., 5.),
+                    color_t=color,
+                    edgecolor='black',
+                    best_color=mpl_color('scarletred2'))
+
+            else:
+                mts = [
+                    source.pyrocko_moment_tensor()
+                    for source in problem.get_sources(models)]
+
+                beachball.plot_fuzzy_beachball_mpl_pixmap(
+                    mts, axes, best_mt,
+                    beachball_type='full',
+                    size=8.*math.sqrt(percentage/100.),
+                    position=(5., 5.),
+                    color_t=color,
+                    edgecolor='black',
+                    best_color=mpl_color('scarletred2'))
 
             if self.cluster_attribute is not None:
                 axes.annotate(
@@ -86,16 +86,7 @@ class RectangularProblem(Problem):
         return arr
 
     def get_source(self, x):
-        d = self.get_parameter_dict(x)
-        p = {}
-        for k in self.base_source.keys():
-            if k in d:
-                p[k] = float(
-                    self.ranges[k].make_relative(self.base_source[k], d[k]))
-
-        source = self.base_source.clone(**p)
-
-        return source
+        return self.get_source_mapper().get_source(x)
 
     def random_uniform(self, xbounds, rstate):
         x = num.zeros(self.nparameters)
@@ -0,0 +1,466 @@
+'''
+Synthetics from linear superposition of cached elementary responses.
+
+Forward models which are linear in some of the source parameters can be
+composed from a small set of elementary synthetics. These are computed once
+per source configuration of the non-linear parameters and then combined with
+a matrix product for every new set of linear parameters.
+
+Centroid time shifts and half-sinusoid source time functions can be applied
+to cached impulse responses in the frequency domain, so that changes of these
+parameters do not require new GF lookups either.
+'''
+
+import math
+import logging
+from collections import OrderedDict
+
+import numpy as num
+
+from pyrocko import gf
+
+logger = logging.getLogger('grond.problems.superposition')
+
+
+def nextpow2(i):
+    return 2**int(math.ceil(math.log(i)/math.log(2.)))
+
+
+def source_key(source):
+    '''
+    Get hashable key from the property values of a source.
+    '''
+    return tuple(
+        tuple(v.tolist()) if isinstance(v, num.ndarray) else v
+        for v in (getattr(source, k) for k in source.T.propnames))
+
+
+def half_sinusoid_spectrum(omega, duration):
+    '''
+    Spectrum of a unit-area half-sinusoid pulse centered at zero.
+    '''
+    u = omega * duration / math.pi
+    denom = 1.0 - u**2
+    singular = num.abs(denom) < 1e-6
+    denom[singular] = 1.0
+    spec = num.cos(0.5 * math.pi * u) / denom
+    spec[singular] = 0.25 * math.pi
+    return spec
+
+
+def apply_time_stf(tr, tshift, duration=0.0, anchor=0.0):
+    '''
+    Shift trace in time and convolve it with a half-sinusoid STF.
+
+    The operation is carried out in the frequency domain on the first
+    differences of the trace, so that the trace is implicitly extended with
+    its end values, as the GF engine does.
+
+    :param tr: :py:class:`pyrocko.gf.SeismosizerTrace` object
+    :param tshift: time shift [s]
+    :param duration: duration of the half-sinusoid STF [s]
+    :param anchor: anchor of the STF, as in
+        :py:class:`pyrocko.gf.HalfSinusoidSTF`
+    :returns: new :py:class:`pyrocko.gf.SeismosizerTrace` object
+    '''
+
+    deltat = tr.deltat
+    data = num.asarray(tr.data, dtype=num.float)
+    if data.size == 0:
+        return tr
+
+    pre = (anchor + 1.0) * duration * 0.5
+    ishift = int(math.floor((tshift - pre) / deltat))
+    tres = tshift - anchor * duration * 0.5 - ishift * deltat
+
+    n = data.size + int(math.ceil(duration / deltat)) + 2
+    nfft = nextpow2(2 * n)
+
+    ddata = num.zeros(data.size)
+    ddata[1:] = num.diff(data)
+
+    omega = 2.0 * math.pi * num.fft.rfftfreq(nfft, deltat)
+    spec = num.fft.rfft(ddata, nfft) * num.exp(-1.0j * omega * tres)
+    if duration > 0.0:
+        spec *= half_sinusoid_spectrum(omega, duration)
+
+    data_new = data[0] + num.cumsum(num.fft.irfft(spec, nfft)[:n])
+
+    return gf.SeismosizerTrace(
+        codes=tr.codes,
+        data=data_new,
+        deltat=deltat,
+        tmin=tr.tmin + ishift * deltat)
+
+
+def add_traces(trs):
+    '''
+    Sum traces on their common time span, extending them with end values.
+    '''
+    if len(trs) == 1:
+        return trs[0]
+
+    deltat = trs[0].deltat
+    tmin = min(tr.tmin for tr in trs)
+    ioffsets = [int(round((tr.tmin - tmin) / deltat)) for tr in trs]
+    n = max(ioff + tr.data.size for (ioff, tr) in zip(ioffsets, trs))
+
+    data = num.zeros(n)
+    for ioff, tr in zip(ioffsets, trs):
+        if tr.data.size == 0:
+            continue
+
+        data[:ioff] += tr.data[0]
+        data[ioff:ioff+tr.data.size] += tr.data
+        data[ioff+tr.data.size:] += tr.data[-1]
+
+    return gf.SeismosizerTrace(
+        codes=trs[0].codes, data=data, deltat=deltat, tmin=tmin)
+
+
+def add_statics(statics):
+    '''
+    Sum dicts of static displacements.
+    '''
+    result = dict((k, v.copy()) for (k, v) in statics[0].items())
+    for other in statics[1:]:
+        for k in result.keys():
+            result[k] += other[k]
+
+    return result
+
+
+class SuperpositionComponent(object):
+    '''
+    Part of a source model composed from cached elementary responses.
+
+    :param key: hashable key identifying the elementary sources
+    :param make_sources: callable returning the list of elementary sources
+    :param weights: weights of the elementary sources
+    :param tshift: if not ``None``, time shift to be applied to the combined
+        dynamic response
+    :param stf: optional :py:class:`pyrocko.gf.HalfSinusoidSTF` to be applied
+        to the combined dynamic response
+    '''
+
+    def __init__(self, key, make_sources, weights, tshift=None, stf=None):
+        self.key = key
+        self.make_sources = make_sources
+        self.weights = weights
+        self.tshift = tshift
+        self.stf = stf
+
+    def apply(self, response):
+        combined = response.combine(self.weights)
+        if response.kind == 'dynamic' and self.tshift is not None:
+            if self.stf is not None:
+                combined = apply_time_stf(
+                    combined, self.tshift,
+                    self.stf.duration, self.stf.anchor)
+            else:
+                combined = apply_time_stf(combined, self.tshift)
+
+        return combined
+
+
+def get_impulse_component(source, tref, amplitude=None):
+    '''
+    Get component for a source with time and STF applied analytically.
+
+    All other source parameters are part of the cache key, except for the
+    linear amplitude parameter named by ``amplitude``. The impulse response
+    is computed for unit amplitude and scaled after lookup, so that models
+    differing only in time, STF duration and amplitude share the cached
+    response.
+
+    :param source: source with optional :py:class:`pyrocko.gf.HalfSinusoidSTF`
+    :param tref: reference time at which the impulse response is computed
+    :param amplitude: optional name of a source attribute the synthetics
+        depend on linearly, e.g. ``'volume_change'``
+    :returns: :py:class:`SuperpositionComponent` or ``None`` if the source's
+        STF can not be applied analytically
+    '''
+
+    stf = source.stf
+    if stf is not None and not (
+            isinstance(stf, gf.HalfSinusoidSTF)
+            and getattr(stf, 'exponent', 1) == 1):
+
+        return None
+
+    if amplitude is not None:
+        impulse = source.clone(time=tref, stf=None, **{amplitude: 1.0})
+        weights = num.array([getattr(source, amplitude)], dtype=float)
+    else:
+        impulse = source.clone(time=tref, stf=None)
+        weights = num.ones(1)
+
+    return SuperpositionComponent(
+        source_key(impulse), lambda: [impulse], weights,
+        tshift=source.time - tref, stf=stf)
+
+
+def get_moment_tensor_component(source, tref=None):
+    '''
+    Get component for a point source composed from six elementary moment
+    tensors.
+
+    The elementary responses only depend on the centroid location. If
+    ``tref`` is given, centroid time and STF are applied analytically to
+    impulse responses computed at ``tref``, otherwise they are part of the
+    configuration of the elementary sources.
+
+    :param source: point source, providing ``pyrocko_moment_tensor``
+    :param tref: optional reference time for the impulse responses
+    :returns: :py:class:`SuperpositionComponent` or ``None`` if the source's
+        STF can not be applied analytically
+    '''
+
+    key = (
+        source.lat, source.lon,
+        source.north_shift, source.east_shift, source.depth)
+
+    if tref is not None:
+        impulse = get_impulse_component(source, tref)
+        if impulse is None:
+            return None
+
+        tshift, stf = impulse.tshift, impulse.stf
+        time, elementary_stf = tref, None
+    else:
+        key += (source.time, source_key(source.stf) if source.stf else None)
+        tshift, stf = None, None
+        time, elementary_stf = source.time, source.stf
+
+    def make_sources():
+        sources = []
+        for i in range(6):
+            m6 = num.zeros(6)
+            m6[i] = 1.0
+            sources.append(gf.MTSource(
+                lat=source.lat,
+                lon=source.lon,
+                north_shift=source.north_shift,
+                east_shift=source.east_shift,
+                depth=source.depth,
+                time=time,
+                stf=elementary_stf,
+                m6=m6))
+
+        return sources
+
+    return SuperpositionComponent(
+        key, make_sources, source.pyrocko_moment_tensor().m6(),
+        tshift=tshift, stf=stf)
+
+
+def get_plain_target(target):
+    '''
+    Get a copy of a target which does no post-processing.
+
+    :returns: plain :py:class:`pyrocko.gf.Target`,
+        :py:class:`pyrocko.gf.SatelliteTarget` or
+        :py:class:`pyrocko.gf.StaticTarget`
+    '''
+
+    if isinstance(target, gf.Target):
+        cls = gf.Target
+    elif isinstance(target, gf.SatelliteTarget):
+        cls = gf.SatelliteTarget
+    elif isinstance(target, gf.StaticTarget):
+        cls = gf.StaticTarget
+    else:
+        raise TypeError(
+            'Cannot handle target of type %s.' % target.__class__.__name__)
+
+    return cls(**dict((k, getattr(target, k)) for k in cls.T.propnames))
+
+
+class ElementaryResponse(object):
+    '''
+    Stack of elementary synthetics for a single modelling target.
+
+    Dynamic responses are resampled to a common time span, extending each
+    trace with its end values, as the post-processing of the GF engine does.
+
+    :param results: list of :py:class:`pyrocko.gf.Result` objects, one per
+        elementary source
+    '''
+
+    def __init__(self, results):
+        res0 = results[0]
+        if isinstance(res0, gf.StaticResult):
+            self.kind = 'static'
+            self.statics = dict(
+                (k, num.vstack([res.result[k] for res in results]))
+                for k in res0.result.keys())
+        else:
+            self.kind = 'dynamic'
+            trs = [res.trace for res in results]
+            deltat = trs[0].deltat
+            tmin = min(tr.tmin for tr in trs)
+            ioffsets = [int(round((tr.tmin - tmin) / deltat)) for tr in trs]
+            n = max(ioff + tr.data.size for (ioff, tr) in zip(ioffsets, trs))
+
+            data = num.zeros((len(trs), n))
+            for i, (ioff, tr) in enumerate(zip(ioffsets, trs)):
+                if tr.data.size == 0:
+                    continue
+
+                data[i, :ioff] = tr.data[0]
+                data[i, ioff:ioff+tr.data.size] = tr.data
+                data[i, ioff+tr.data.size:] = tr.data[-1]
+
+            self.codes = trs[0].codes
+            self.deltat = deltat
+            self.tmin = tmin
+            self.data = data
+
+    def combine(self, weights):
+        '''
+        Combine the elementary responses.
+
+        :param weights: 1D array with one weight per elementary source
+        :returns: :py:class:`pyrocko.gf.SeismosizerTrace` for dynamic targets,
+            dict of arrays for static targets, as passed to the targets'
+            ``post_process`` methods by the GF engine
+        '''
+
+        if self.kind == 'static':
+            return dict(
+                (k, num.dot(weights, v)) for (k, v) in self.statics.items())
+        else:
+            return gf.SeismosizerTrace(
+                codes=self.codes,
+                data=num.dot(weights, self.data),
+                deltat=self.deltat,
+                tmin=self.tmin)
+
+
+class SuperpositionCache(object):
+    '''
+    LRU cache of elementary responses, keyed by source configuration.
+
+    :param nmax: maximum number of source configurations to keep
+    '''
+
+    def __init__(self, nmax=64):
+        self.nmax = nmax
+        self._cache = OrderedDict()
+        self.nhits = 0
+        self.nmisses = 0
+
+    def clear(self):
+        self._cache.clear()
+
+    def get(self, key, targets, make_sources, engine, nthreads=1):
+        '''
+        Get elementary responses for given targets.
+
+        :param key: hashable key identifying the source configuration
+        :param targets: list of modelling targets
+        :param make_sources: callable returning the list of elementary
+            sources, only called on cache miss
+        :param engine: :py:class:`pyrocko.gf.LocalEngine` object
+        :returns: list with an :py:class:`ElementaryResponse` or a
+            :py:class:`pyrocko.gf.SeismosizerError` for each target
+        '''
+
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            entry_targets, responses = entry
+            if len(entry_targets) == len(targets) and all(
+                    a is b for (a, b) in zip(entry_targets, targets)):
+
+                self._cache[key] = entry
+                self.nhits += 1
+                return responses
+
+        self.nmisses += 1
+        responses = self.make_responses(
+            make_sources(), targets, engine, nthreads)
+
+        self._cache[key] = (list(targets), responses)
+        while len(self._cache) > self.nmax:
+            self._cache.popitem(last=False)
+
+        return responses
+
+    def make_responses(self, sources, targets, engine, nthreads):
+        plain_targets = [get_plain_target(target) for target in targets]
+        resp = engine.process(sources, plain_targets, nthreads=nthreads)
+
+        responses = []
+        for itarget in range(len(targets)):
+            results = [
+                resp.results_list[isource][itarget]
+                for isource in range(len(sources))]
+
+            errors = [
+                res for res in results
+                if isinstance(res, gf.SeismosizerError)]
+
+            if errors:
+                responses.append(errors[0])
+            else:
+                responses.append(ElementaryResponse(results))
+
+        return responses
+
+
+def process_superposition(
+        cache, engine, source, targets, components, nthreads=1):
+    '''
+    Compose synthetics from cached elementary responses.
+
+    The combined responses of all components are summed and handed to the
+    targets' post-processing.
+
+    :param cache: :py:class:`SuperpositionCache` object
+    :param components: list of :py:class:`SuperpositionComponent` objects
+    :returns: list of results, as returned by the GF engine
+    '''
+
+    responses = [
+        cache.get(
+            component.key, targets, component.make_sources, engine,
+            nthreads=nthreads)
+        for component in components]
+
+    results = []
+    for itarget, target in enumerate(targets):
+        target_responses = [
+            component_responses[itarget]
+            for component_responses in responses]
+
+        errors = [
+            response for response in target_responses
+            if isinstance(response, gf.SeismosizerError)]
+
+        if errors:
+            results.append(errors[0])
+            continue
+
+        parts = [
+            component.apply(response)
+            for (component, response) in zip(components, target_responses)]
+
+        if target_responses[0].kind == 'static':
+            combined = add_statics(parts)
+        else:
+            combined = add_traces(parts)
+
+        try:
+            results.append(target.post_process(engine, source, combined))
+
+        except gf.SeismosizerError as e:
+            results.append(e)
+
+    return results
+
+
+__all__ = '''
+    ElementaryResponse
+    SuperpositionComponent
+    SuperpositionCache
+'''.split()
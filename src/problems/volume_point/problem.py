@@ -1,12 +1,13 @@
 import logging
 
 from pyrocko import gf, util
-from pyrocko.guts import String, Float, Dict, Int
+from pyrocko.guts import String, Float, Dict, Int, Bool
 
 from grond.meta import expand_template, Parameter, \
     has_get_plot_classes
 
 from ..base import Problem, ProblemConfig
+from ..superposition import get_impulse_component
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.problems.volume_point')
@@ -19,6 +20,10 @@ class VolumePointProblemConfig(ProblemConfig):
     ranges = Dict.T(String.T(), gf.Range.T())
     distance_min = Float.T(default=0.0)
     nthreads = Int.T(default=1)
+    spectral_time_stf = Bool.T(
+        default=False,
+        help='Apply source time and STF duration analytically in the '
+             'frequency domain to cached impulse responses.')
 
     def get_problem(self, event, target_groups, targets):
         if event.depth is None:
@@ -39,7 +44,8 @@ class VolumePointProblemConfig(ProblemConfig):
             ranges=self.ranges,
             distance_min=self.distance_min,
             norm_exponent=self.norm_exponent,
-            nthreads=self.nthreads)
+            nthreads=self.nthreads,
+            spectral_time_stf=self.spectral_time_stf)
 
         return problem
 
@@ -60,6 +66,7 @@ class VolumePointProblem(Problem):
     ]
 
     distance_min = Float.T(default=0.0)
+    spectral_time_stf = Bool.T(default=False)
 
     def pack(self, source):
         arr = self.get_parameter_array(source)
@@ -69,17 +76,22 @@ class VolumePointProblem(Problem):
         return arr
 
     def get_source(self, x):
-        d = self.get_parameter_dict(x)
-
-        p = {k: float(self.ranges[k].make_relative(self.base_source[k], d[k]))
-             for k in self.base_source.keys() if k in d}
+        mapper = self.get_source_mapper()
 
         stf = None
         if self.has_waveforms:
-            stf = gf.HalfSinusoidSTF(duration=float(d.duration))
+            stf = gf.HalfSinusoidSTF(
+                duration=float(x[mapper.index('duration')]))
+
+        return mapper.get_source(x, stf=stf)
+
+    def get_superposition_components(self, source):
+        if not (self.spectral_time_stf and self.has_waveforms):
+            return None
 
-        source = self.base_source.clone(stf=stf, **p)
-        return source
+        component = get_impulse_component(
+            source, self.base_source.time, amplitude='volume_change')
+        return [component] if component is not None else None
 
     @classmethod
     def get_plot_classes(cls):
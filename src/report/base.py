@@ -2,6 +2,7 @@ from __future__ import print_function
 import logging
 import os.path as op
 import shutil
+import hashlib
 import os
 import tarfile
 import threading
@@ -15,6 +16,7 @@ from pyrocko.model import Event
 from pyrocko.guts import Object, String, Unicode
 
 from grond.meta import HasPaths, Path, expand_template, GrondError
+from grond.analysers.base import fingerprint
 
 from grond import core, environment
 from grond.problems import ProblemInfoNotAvailable, ProblemDataNotAvailable
@@ -34,6 +36,9 @@ class ReportIndexEntry(Object):
     event_best = Event.T(optional=True)
     grond_version = String.T(optional=True)
     run_info = RunInfo.T(optional=True)
+    input_fingerprint = String.T(
+        optional=True,
+        help='digest of the inputs the entry has been made from')
 
 
 class ReportConfig(HasPaths):
@@ -113,8 +118,70 @@ def copytree(src, dst):
             shutil.copy(srcname, dstname)
 
 
+rundir_config_files = [
+    'config.yaml', 'problem.yaml', 'optimiser.yaml', 'run_info.yaml',
+    'timings.yaml']
+
+rundir_history_files = [
+    'models', 'misfits', 'bootstraps', 'choices',
+    'harvest/models', 'harvest/misfits', 'harvest/bootstraps',
+    'harvest/choices']
+
+
+def rundir_fingerprint(rundir_path, nbytes_tail=1024*1024):
+    '''
+    Digest of the contents of a rundir which go into its report.
+
+    Configuration files are hashed completely. The model history files are
+    only appended to, they are represented by their length and a hash of
+    their last ``nbytes_tail`` bytes.
+    '''
+
+    args = []
+    for fn in rundir_config_files + rundir_history_files:
+        path = op.join(rundir_path, fn)
+        if not op.exists(path):
+            args.append((fn, None))
+            continue
+
+        size = op.getsize(path)
+        with open(path, 'rb') as f:
+            if fn in rundir_history_files:
+                f.seek(max(0, size - nbytes_tail))
+
+            args.append((fn, size, hashlib.sha1(f.read()).hexdigest()))
+
+    return fingerprint(*args)
+
+
+def remove_stale_plot_groups(manager, plot_config_collection):
+    '''
+    Remove plot groups not belonging to any of the given plot configs.
+    '''
+
+    current = set(
+        (plot.name, plot.variant)
+        for plot in plot_config_collection.plot_configs)
+
+    for group_ref in manager.get_group_refs():
+        if tuple(group_ref) not in current:
+            logger.info('Removing stale plot group: %s.%s' % group_ref)
+            manager.remove_group(group_ref)
+
+
 def report(env, report_config=None, update_without_plotting=False,
-           make_index=True, make_archive=True):
+           make_index=True, make_archive=True, nprocs_plots=1, force=False):
+
+    '''
+    Create or update the report entry of a run.
+
+    Unless ``force`` is set, an existing entry of a rundir is updated
+    incrementally: parameter files and exports are only rewritten, and
+    plots only remade, if their inputs changed, see
+    :py:func:`rundir_fingerprint` and
+    :py:func:`grond.plot.plot_fingerprint`. Entries not made from a rundir
+    are always regenerated completely.
+    '''
 
     if report_config is None:
         report_config = ReportConfig()
@@ -133,9 +200,56 @@ def report(env, report_config=None, update_without_plotting=False,
             event_name=event_name,
             problem_name=problem.name))
 
-    if op.exists(entry_path) and not update_without_plotting:
+    input_fingerprint = None
+    if not force:
+        try:
+            input_fingerprint = fingerprint(
+                rundir_fingerprint(env.get_rundir_path()), __version__)
+
+        except environment.NoRundirAvailable:
+            pass
+
+    entry_current = False
+    if input_fingerprint is not None:
+        fn = op.join(entry_path, 'index.yaml')
+        if op.exists(fn):
+            try:
+                rie = guts.load(filename=fn)
+                entry_current = rie.input_fingerprint == input_fingerprint
+            except Exception:
+                pass
+
+    elif op.exists(entry_path) and not update_without_plotting:
         shutil.rmtree(entry_path)
 
+    if entry_current:
+        logger.info(
+            'Inputs of report entry did not change, only checking plots.')
+
+        if not update_without_plotting:
+            make_report_plots(
+                env, report_config, entry_path, input_fingerprint,
+                nprocs_plots)
+
+    else:
+        make_report_entry(
+            env, report_config, entry_path, input_fingerprint,
+            update_without_plotting, nprocs_plots)
+
+    logger.info('Done creating report entry for run "%s".' % problem.name)
+
+    if make_index:
+        report_index(report_config)
+
+    if make_archive:
+        report_archive(report_config)
+
+
+def make_report_entry(
+        env, report_config, entry_path, input_fingerprint,
+        update_without_plotting, nprocs_plots):
+
+    problem = env.get_problem()
     try:
         problem.dump_problem_info(entry_path)
 
@@ -178,12 +292,9 @@ def report(env, report_config=None, update_without_plotting=False,
             pass
 
         if not update_without_plotting:
-            from grond import plot
-            pcc = report_config.plot_config_collection.get_weeded(env)
-            plot.make_plots(
-                env,
-                plots_path=op.join(entry_path, 'plots'),
-                plot_config_collection=pcc)
+            make_report_plots(
+                env, report_config, entry_path, input_fingerprint,
+                nprocs_plots)
 
         try:
             run_info = env.get_run_info()
@@ -194,7 +305,8 @@ def report(env, report_config=None, update_without_plotting=False,
             path='.',
             problem_name=problem.name,
             grond_version=problem.grond_version,
-            run_info=run_info)
+            run_info=run_info,
+            input_fingerprint=input_fingerprint)
 
         fn = op.join(entry_path, 'event.solution.best.yaml')
         if op.exists(fn):
@@ -216,13 +328,21 @@ def report(env, report_config=None, update_without_plotting=False,
         if op.exists(entry_path):
             shutil.rmtree(entry_path)
 
-    logger.info('Done creating report entry for run "%s".' % problem.name)
 
-    if make_index:
-        report_index(report_config)
+def make_report_plots(
+        env, report_config, entry_path, input_fingerprint, nprocs_plots):
 
-    if make_archive:
-        report_archive(report_config)
+    from grond import plot
+    pcc = report_config.plot_config_collection.get_weeded(env)
+    plot.make_plots(
+        env,
+        plots_path=op.join(entry_path, 'plots'),
+        plot_config_collection=pcc,
+        nprocs=nprocs_plots,
+        input_fingerprint=input_fingerprint)
+
+    if input_fingerprint is not None:
+        remove_stale_plot_groups(env.get_plot_collection_manager(), pcc)
 
 
 def report_index(report_config=None):
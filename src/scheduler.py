@@ -0,0 +1,392 @@
+'''
+Scheduling of multiple events on a common core budget.
+
+Events are started in the order of decreasing estimated cost, if costs are
+given, otherwise in the given order. Each running event gets at least one
+thread and the remaining cores are distributed among the running events in
+proportion to their estimated cost. Events may update their estimate once
+they have set up their targets, see :py:meth:`ThreadBudget.set_cost`, so
+that the estimate does not require loading the datasets of all events in
+advance. Cores which are freed by finished events are handed to the events
+still running.
+'''
+
+import sys
+import time
+import logging
+import threading
+import traceback
+import multiprocessing
+
+from pyrocko import gf
+
+from grond.meta import GrondError
+
+logger = logging.getLogger('grond.scheduler')
+
+
+def estimate_target_cost(target, engine=None):
+    '''
+    Rough relative cost of forward modelling a target.
+
+    Dynamic targets are weighted with the sampling rate of their GF store,
+    static targets with the number of observation points.
+    '''
+
+    if isinstance(target, gf.StaticTarget):
+        return 0.01 * target.ncoords
+
+    elif isinstance(target, gf.Target):
+        if engine is not None:
+            try:
+                store_config = engine.get_store_config(target.store_id)
+                return store_config.sample_rate
+
+            except Exception:
+                pass
+
+        return 1.0
+
+    return 0.0
+
+
+def estimate_problem_cost(problem, engine=None):
+    '''
+    Rough relative cost of processing an event, from its problem's targets.
+    '''
+
+    cost = sum(estimate_target_cost(t, engine) for t in problem.targets)
+    return max(cost, 1.0)
+
+
+def allocate_threads(ncores, costs):
+    '''
+    Distribute cores among running events.
+
+    :param ncores: total number of cores
+    :param costs: dict with the estimated costs of the running events
+    :returns: dict with the number of threads for each event, at least one
+    '''
+
+    keys = sorted(costs.keys())
+    if not keys:
+        return {}
+
+    nextra = max(0, ncores - len(keys))
+    total = sum(costs[k] for k in keys)
+    if total <= 0.0:
+        shares = dict((k, float(nextra) / len(keys)) for k in keys)
+    else:
+        shares = dict((k, nextra * costs[k] / total) for k in keys)
+
+    nthreads = dict((k, 1 + int(shares[k])) for k in keys)
+    nleft = ncores - sum(nthreads.values())
+    for k in sorted(keys, key=lambda k: int(shares[k]) - shares[k]):
+        if nleft <= 0:
+            break
+
+        nthreads[k] += 1
+        nleft -= 1
+
+    return nthreads
+
+
+class ThreadBudget(object):
+    '''
+    Number of threads granted to an event, shared with its worker process.
+
+    :param shared: shared integer array with the thread counts of all events
+    :param index: index of the event
+    :param interval: polling interval [s]
+    :param shared_costs: optional shared array with the cost estimates of
+        all events
+    '''
+
+    def __init__(self, shared, index, interval=2.0, shared_costs=None):
+        self._shared = shared
+        self._shared_costs = shared_costs
+        self._index = index
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self):
+        return max(1, self._shared[self._index])
+
+    def set_cost(self, cost):
+        '''
+        Update the cost estimate of the event, e.g. once its targets are
+        known. The scheduler redistributes the cores accordingly.
+        '''
+
+        if self._shared_costs is not None:
+            self._shared_costs[self._index] = cost
+
+    def attach(self, problem):
+        '''
+        Keep ``problem.nthreads`` up to date with the granted thread count.
+        '''
+
+        def update():
+            while True:
+                problem.nthreads = self.get()
+                if self._stop.wait(self._interval):
+                    break
+
+        problem.nthreads = self.get()
+        self._thread = threading.Thread(target=update)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def detach(self):
+        self._stop.set()
+
+
+class EventStats(object):
+    def __init__(self, name, cost):
+        self.name = name
+        self.cost = cost
+        self.tstart = None
+        self.tstop = None
+        self.thread_seconds = 0.0
+        self.cpu_time = None
+        self.error = None
+        self.exitcode = None
+
+    @property
+    def failed(self):
+        return self.error is not None or self.exitcode not in (None, 0)
+
+    @property
+    def duration(self):
+        if self.tstart is None or self.tstop is None:
+            return 0.0
+
+        return self.tstop - self.tstart
+
+    @property
+    def mean_threads(self):
+        if self.duration <= 0.0:
+            return 0.0
+
+        return self.thread_seconds / self.duration
+
+    @property
+    def utilisation(self):
+        if self.cpu_time is None or self.thread_seconds <= 0.0:
+            return None
+
+        return self.cpu_time / self.thread_seconds
+
+
+def _run_event(function, ievent, args, shared, shared_costs, q_out):
+    budget = ThreadBudget(shared, ievent, shared_costs=shared_costs)
+    cpu_start = time.process_time()
+    error = None
+    try:
+        if function(ievent, *args, thread_budget=budget) is False:
+            error = 'processing failed, see log'
+
+    except Exception as e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+        logger.error(
+            'Event %i failed:\n%s' % (ievent, traceback.format_exc()))
+
+    finally:
+        budget.detach()
+        q_out.put((ievent, time.process_time() - cpu_start, error))
+
+    if error is not None:
+        sys.exit(1)
+
+
+class EventScheduler(object):
+    '''
+    Process events in parallel on a common core budget.
+
+    :param ncores: total number of cores to use
+    :param event_names: names of the events
+    :param costs: optional initial cost estimates of the events, by default
+        all events are assumed to be equally expensive
+    :param nparallel: optional limit of the number of events processed at
+        the same time, by default up to ``ncores`` events run in parallel
+    :param poll_interval: interval at which finished events are checked [s]
+    '''
+
+    def __init__(self, ncores, event_names, costs=None, nparallel=None,
+                 poll_interval=0.5):
+
+        if costs is None:
+            costs = [1.0] * len(event_names)
+
+        self.ncores = max(1, ncores)
+        self.nparallel = min(nparallel or self.ncores, self.ncores)
+        self.poll_interval = poll_interval
+        self.stats = [
+            EventStats(name, cost) for (name, cost) in zip(event_names, costs)]
+
+    def _get_context(self):
+        try:
+            return multiprocessing.get_context('fork')
+        except ValueError:
+            return multiprocessing.get_context()
+
+    def run(self, function, args=()):
+        '''
+        Call ``function(ievent, *args, thread_budget=budget)`` for all events.
+
+        An event fails if the function raises an exception or returns
+        ``False``.
+
+        Each event is processed in a separate process. The function should
+        pass the :py:class:`ThreadBudget` to the problem it sets up, see
+        :py:meth:`ThreadBudget.attach`.
+
+        All events are processed, even if some of them fail. Failures are
+        reported at the end by raising a :py:exc:`~grond.meta.GrondError`
+        naming the failed events.
+        '''
+
+        ctx = self._get_context()
+        nevents = len(self.stats)
+        shared = ctx.Array('i', nevents)
+        shared_costs = ctx.Array('d', [s.cost for s in self.stats])
+        q_out = ctx.Queue()
+
+        pending = sorted(
+            range(nevents), key=lambda i: self.stats[i].cost, reverse=True)
+
+        running = {}
+        nthreads = {}
+        tstart = time.time()
+        tlast = tstart
+
+        def reallocate():
+            nthreads.clear()
+            nthreads.update(allocate_threads(
+                self.ncores,
+                dict((i, self.stats[i].cost) for i in running)))
+
+            for i, n in nthreads.items():
+                shared[i] = n
+
+        while pending or running:
+            while pending and len(running) < self.nparallel:
+                ievent = pending.pop(0)
+                running[ievent] = None
+                reallocate()
+                proc = ctx.Process(
+                    target=_run_event,
+                    args=(function, ievent, args, shared, shared_costs,
+                          q_out))
+
+                self.stats[ievent].tstart = time.time()
+                proc.start()
+                running[ievent] = proc
+                logger.info(
+                    'Scheduler: started event "%s" (%i pending), threads: %s'
+                    % (self.stats[ievent].name, len(pending),
+                       self._format_allocation(nthreads)))
+
+            time.sleep(self.poll_interval)
+
+            tnow = time.time()
+            for i in running:
+                self.stats[i].thread_seconds += nthreads[i] * (tnow - tlast)
+
+            tlast = tnow
+
+            self._collect(q_out)
+
+            finished = [i for (i, proc) in running.items()
+                        if not proc.is_alive()]
+
+            for ievent in finished:
+                proc = running.pop(ievent)
+                proc.join()
+                self.stats[ievent].tstop = tnow
+                self.stats[ievent].exitcode = proc.exitcode
+
+            updated = []
+            for ievent in running:
+                if shared_costs[ievent] != self.stats[ievent].cost:
+                    self.stats[ievent].cost = shared_costs[ievent]
+                    updated.append(ievent)
+
+            if finished or updated:
+                reallocate()
+                if running:
+                    logger.info(
+                        'Scheduler: reassigned threads: %s'
+                        % self._format_allocation(nthreads))
+
+        self._collect(q_out, wait=True)
+        self.duration = time.time() - tstart
+        self.log_report()
+
+        failed = [s for s in self.stats if s.failed]
+        if failed:
+            raise GrondError(
+                'Processing failed for %i of %i events:\n%s' % (
+                    len(failed), nevents, '\n'.join(
+                        '  %s: %s' % (
+                            s.name,
+                            s.error or 'worker exited with code %s'
+                            % s.exitcode)
+                        for s in failed)))
+
+    def _collect(self, q_out, wait=False):
+        while True:
+            try:
+                if wait and any(
+                        s.cpu_time is None and not s.failed
+                        for s in self.stats):
+
+                    ievent, cpu_time, error = q_out.get(timeout=1.0)
+                else:
+                    ievent, cpu_time, error = q_out.get_nowait()
+
+            except Exception:
+                break
+
+            self.stats[ievent].cpu_time = cpu_time
+            self.stats[ievent].error = error
+
+    def _format_allocation(self, nthreads):
+        return ', '.join(
+            '%s: %i' % (self.stats[i].name, n)
+            for (i, n) in sorted(nthreads.items()))
+
+    def get_report(self):
+        lines = ['%-25s %10s %10s %8s %8s' % (
+            'Event', 'Cost', 'Time [s]', 'Threads', 'Util.')]
+
+        cpu_total = 0.0
+        for s in self.stats:
+            util = s.utilisation
+            if s.cpu_time is not None:
+                cpu_total += s.cpu_time
+
+            lines.append('%-25s %10.3g %10.1f %8.2f %8s%s' % (
+                s.name, s.cost, s.duration, s.mean_threads,
+                '%.0f%%' % (util * 100.) if util is not None else '-',
+                '  failed' if s.failed else ''))
+
+        if self.duration > 0.0:
+            lines.append(
+                'Total time: %.1f s, overall core utilisation: %.0f%%' % (
+                    self.duration,
+                    100. * cpu_total / (self.duration * self.ncores)))
+
+        return '\n'.join(lines)
+
+    def log_report(self):
+        logger.info('Scheduler report:\n%s' % self.get_report())
+
+
+__all__ = '''
+    EventScheduler
+    ThreadBudget
+    allocate_threads
+    estimate_problem_cost
+'''.split()
@@ -1,8 +1,9 @@
 import copy
+import math
 
 import numpy as num
 
-from pyrocko import gf
+from pyrocko import gf, orthodrome
 from pyrocko.guts_array import Array
 from pyrocko.guts import Object, Float, Dict
 
@@ -75,6 +76,10 @@ class MisfitTarget(Object):
     can_bootstrap_weights = False
     can_bootstrap_residuals = False
 
+    # set to True if prepare_modelling has side effects which are needed for
+    # every evaluation, see grond.problems.base.ModellingPlan
+    repeat_prepare_modelling = False
+
     plot_misfits_cumulative = True
 
     def __init__(self, **kwargs):
@@ -174,6 +179,114 @@ class MisfitTarget(Object):
         raise NotImplementedError('must be overloaded in subclass')
 
 
+def get_station_geometry(lats, lons, depths, origin):
+    '''
+    Distances and azimuths from stations to an origin, for arrays of stations.
+
+    Gives the same results as :py:meth:`pyrocko.model.Location.distance_to`,
+    :py:meth:`~pyrocko.model.Location.distance_3d_to` and
+    :py:meth:`~pyrocko.model.Location.azibazi_to` of station locations.
+
+    :returns: tuple ``(distances, distances_3d, azimuths, backazimuths)``
+    '''
+
+    lats = num.asarray(lats, dtype=float)
+    lons = num.asarray(lons, dtype=float)
+    depths = num.asarray(depths, dtype=float)
+    n = lats.size
+
+    distances = num.zeros(n)
+    distances_3d = num.zeros(n)
+    azimuths = num.zeros(n)
+    backazimuths = num.zeros(n)
+
+    # stations at the reference point of the origin: cartesian offsets
+    same = num.logical_and(lats == origin.lat, lons == origin.lon)
+    if num.any(same):
+        north_shift = getattr(origin, 'north_shift', 0.0)
+        east_shift = getattr(origin, 'east_shift', 0.0)
+        distances[same] = math.sqrt(north_shift**2 + east_shift**2)
+        distances_3d[same] = num.sqrt(
+            north_shift**2 + east_shift**2 + (depths[same] - origin.depth)**2)
+        azimuths[same] = math.degrees(math.atan2(east_shift, north_shift))
+        backazimuths[same] = azimuths[same] + 180.
+
+    other = ~same
+    if num.any(other):
+        olat, olon = getattr(
+            origin, 'effective_latlon', (origin.lat, origin.lon))
+
+        slats, slons = lats[other], lons[other]
+        olats = num.full_like(slats, olat)
+        olons = num.full_like(slons, olon)
+
+        distances[other] = orthodrome.distance_accurate50m_numpy(
+            slats, slons, olats, olons)
+
+        sx, sy, sz = orthodrome.geodetic_to_ecef(slats, slons, -depths[other])
+        ox, oy, oz = orthodrome.geodetic_to_ecef(olat, olon, -origin.depth)
+        distances_3d[other] = num.sqrt(
+            (sx - ox)**2 + (sy - oy)**2 + (sz - oz)**2)
+
+        azimuths[other], backazimuths[other] = orthodrome.azibazi_numpy(
+            slats, slons, olats, olons)
+
+    return distances, distances_3d, azimuths, backazimuths
+
+
+def select_stations(
+        ds, origin,
+        distance_min=None,
+        distance_max=None,
+        distance_3d_min=None,
+        distance_3d_max=None,
+        depth_min=None,
+        depth_max=None):
+
+    '''
+    Select stations of a dataset by distance to the origin and by depth.
+
+    The coordinates of the stations are taken as arrays from the dataset and
+    all criteria are evaluated at once.
+
+    :returns: tuple ``(stations, reasons, azimuths)``, where ``reasons``
+        gives for each station the reason for its exclusion or ``None`` if
+        it is selected, and ``azimuths`` the azimuths from the stations to
+        the origin
+    '''
+
+    stations, lats, lons, depths = ds.get_station_coordinates()
+    distances, distances_3d, azimuths, _ = get_station_geometry(
+        lats, lons, depths, origin)
+
+    reasons = [None] * len(stations)
+    selected = num.ones(len(stations), dtype=bool)
+    for values, limit, is_min, reason in [
+            (distances, distance_min, True, 'distance < distance_min'),
+            (distances, distance_max, False, 'distance > distance_max'),
+            (distances_3d, distance_3d_min, True,
+             'distance_3d < distance_3d_min'),
+            (distances_3d, distance_3d_max, False,
+             'distance_3d > distance_3d_max'),
+            (depths, depth_min, True, 'depth < depth_min'),
+            (depths, depth_max, False, 'depth > depth_max')]:
+
+        if limit is None:
+            continue
+
+        if is_min:
+            excluded = num.logical_and(selected, values < limit)
+        else:
+            excluded = num.logical_and(selected, values > limit)
+
+        for i in num.nonzero(excluded)[0]:
+            reasons[i] = reason
+
+        selected[excluded] = False
+
+    return stations, reasons, azimuths
+
+
 __all__ = '''
     TargetGroup
     MisfitTarget
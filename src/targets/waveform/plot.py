@@ -12,6 +12,7 @@ from pyrocko.plot import mpl_init, mpl_color
 from pyrocko.guts import Tuple, Float, Int, String
 
 from grond import core, meta
+from grond.forward_cache import evaluate_models
 from .target import WaveformMisfitResult, WaveformMisfitTarget
 from ..plot import StationDistributionPlot
 
@@ -220,20 +221,19 @@ class CheckWaveformsPlot(PlotConfig):
         environ.setup_modelling()
 
         problem = environ.get_problem()
-        results_list = []
-        sources = []
         if self.n_random_synthetics == 0:
-            x = problem.get_reference_model()
-            sources.append(problem.base_source)
-            results = problem.evaluate(x)
-            results_list.append(results)
+            xs = [problem.get_reference_model()]
+            sources = [problem.base_source]
+            results_list = environ.evaluate_models(xs)
 
         else:
-            for _ in range(self.n_random_synthetics):
-                x = problem.get_random_model()
-                sources.append(problem.get_source(x))
-                results = problem.evaluate(x)
-                results_list.append(results)
+            xs = [problem.get_random_model()
+                  for _ in range(self.n_random_synthetics)]
+            sources = [problem.get_source(x) for x in xs]
+
+            # random models are not worth caching
+            results_list = evaluate_models(
+                problem, xs, nprocs=environ.get_nprocs_modelling())
 
         cm.create_group_mpl(self, self.draw_figures(
             sources, problem.targets, results_list),
@@ -388,7 +388,7 @@ class FitsWaveformEnsemblePlot(PlotConfig):
         history = environ.get_history(subset='harvest')
         cm.create_group_mpl(
             self,
-            self.draw_figures(ds, history),
+            self.draw_figures(ds, history, environ.evaluate_models),
             title=u'Waveform fits for the ensemble',
             section='fits',
             feather_icon='activity',
@@ -423,7 +423,7 @@ residuals for time domain comparisons (red filled), spectra of observed and
 synthetic traces for amplitude spectrum comparisons, or cross correlation
 traces.''')
 
-    def draw_figures(self, ds, history):
+    def draw_figures(self, ds, history, evaluate=None):
 
         color_parameter = self.color_parameter
         misfit_cutoff = self.misfit_cutoff
@@ -475,12 +475,18 @@ traces.''')
         target_to_results = defaultdict(list)
         all_syn_trs = []
 
+        if evaluate is None:
+            def evaluate(xs):
+                return evaluate_models(problem, xs)
+
+        results_list = evaluate(list(models))
+
         dtraces = []
         for imodel in range(nmodels):
             model = models[imodel, :]
 
             source = problem.get_source(model)
-            results = problem.evaluate(model)
+            results = results_list[imodel]
 
             dtraces.append([])
 
@@ -808,7 +814,7 @@ class FitsWaveformPlot(PlotConfig):
         history = environ.get_history(subset='harvest')
         cm.create_group_mpl(
             self,
-            self.draw_figures(ds, history),
+            self.draw_figures(ds, history, environ.evaluate_models),
             title=u'Waveform fits for best model',
             section='fits',
             feather_icon='activity',
@@ -847,7 +853,7 @@ relative misfit contribution to the global misfit of the optimisation (bottom
 box, red).
 ''')
 
-    def draw_figures(self, ds, history):
+    def draw_figures(self, ds, history, evaluate=None):
 
         fontsize = self.font_size
         fontsize_title = self.font_size_title
@@ -887,7 +893,11 @@ box, red).
         target_to_result = {}
         all_syn_trs = []
         all_syn_specs = []
-        results = problem.evaluate(xbest)
+        if evaluate is None:
+            def evaluate(xs):
+                return evaluate_models(problem, xs)
+
+        results, = evaluate([xbest])
 
         dtraces = []
         for target, result in zip(problem.targets, results):
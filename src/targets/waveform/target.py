@@ -11,7 +11,8 @@ from pyrocko.guts_array import Array
 
 from grond.dataset import NotFound
 
-from ..base import (MisfitConfig, MisfitTarget, MisfitResult, TargetGroup)
+from ..base import (MisfitConfig, MisfitTarget, MisfitResult, TargetGroup,
+                    select_stations)
 from grond.meta import has_get_plot_classes
 
 guts_prefix = 'grond'
@@ -79,9 +80,9 @@ class WaveformMisfitConfig(MisfitConfig):
         return self.fmin / self.ffactor, self.fmax * self.ffactor
 
 
-def log_exclude(target, reason):
+def log_exclude(path, codes, reason):
     logger.debug('Excluding potential target %s: %s' % (
-        target.string_id(), reason))
+        '.'.join((path,) + codes), reason))
 
 
 class WaveformTargetGroup(TargetGroup):
@@ -116,12 +117,30 @@ class WaveformTargetGroup(TargetGroup):
         logger.debug('Selecting waveform targets...')
         origin = event
         targets = []
-
-        for st in ds.get_stations():
+        path = self.path or default_path
+
+        stations, reasons, azimuths = select_stations(
+            ds, origin,
+            distance_min=self.distance_min,
+            distance_max=self.distance_max,
+            distance_3d_min=self.distance_3d_min,
+            distance_3d_max=self.distance_3d_max,
+            depth_min=self.depth_min,
+            depth_max=self.depth_max)
+
+        for st, reason, azi in zip(stations, reasons, azimuths):
             for cha in self.channels:
 
                 nslc = st.nsl() + (cha,)
 
+                if ds.is_blacklisted(nslc):
+                    log_exclude(path, nslc, 'blacklisted')
+                    continue
+
+                if reason is not None:
+                    log_exclude(path, nslc, reason)
+                    continue
+
                 target = WaveformMisfitTarget(
                     quantity='displacement',
                     codes=nslc,
@@ -133,48 +152,13 @@ class WaveformTargetGroup(TargetGroup):
                     misfit_config=self.misfit_config,
                     manual_weight=self.weight,
                     normalisation_family=self.normalisation_family,
-                    path=self.path or default_path)
-
-                if ds.is_blacklisted((st.nsl() + (cha,))):
-                    log_exclude(target, 'blacklisted')
-                    continue
-
-                if self.distance_min is not None and \
-                   target.distance_to(origin) < self.distance_min:
-                    log_exclude(target, 'distance < distance_min')
-                    continue
-
-                if self.distance_max is not None and \
-                   target.distance_to(origin) > self.distance_max:
-                    log_exclude(target, 'distance > distance_max')
-                    continue
-
-                if self.distance_3d_min is not None and \
-                   target.distance_3d_to(origin) < self.distance_3d_min:
-                    log_exclude(target, 'distance_3d < distance_3d_min')
-                    continue
-
-                if self.distance_3d_max is not None and \
-                   target.distance_3d_to(origin) > self.distance_3d_max:
-                    log_exclude(target, 'distance_3d > distance_3d_max')
-                    continue
+                    path=path)
 
-                if self.depth_min is not None and \
-                   target.depth < self.depth_min:
-                    log_exclude(target, 'depth < depth_min')
-                    continue
-
-                if self.depth_max is not None and \
-                   target.depth > self.depth_max:
-                    log_exclude(target, 'depth > depth_max')
-                    continue
-
-                azi, _ = target.azibazi_to(origin)
                 if cha == 'R':
-                    target.azimuth = azi - 180.
+                    target.azimuth = float(azi) - 180.
                     target.dip = 0.
                 elif cha == 'T':
-                    target.azimuth = azi - 90.
+                    target.azimuth = float(azi) - 90.
                     target.dip = 0.
                 elif cha == 'Z':
                     target.azimuth = 0.
@@ -264,6 +248,7 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         gf.Target.__init__(self, **kwargs)
         MisfitTarget.__init__(self, **kwargs)
         self._piggyback_subtargets = []
+        self._timings = None
 
     def string_id(self):
         return '.'.join(x for x in (self.path,) + self.codes)
@@ -283,11 +268,35 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
             self._combined_weight = num.array([w], dtype=num.float)
         return self._combined_weight
 
+    def set_timings(self, source, tmin_fit, tmax_fit, tsyn_pick):
+        '''
+        Set precomputed fit window and synthetic pick time for a source.
+
+        Used by :py:meth:`grond.Problem.prepare_waveform_timings`, which
+        computes these for all targets at once. Values are only used for
+        sources at the same location and time.
+        '''
+        self._timings = (
+            timings_key(source), float(tmin_fit), float(tmax_fit),
+            float(tsyn_pick))
+
+    def get_timings(self, source):
+        if self._timings is not None \
+                and self._timings[0] == timings_key(source):
+            return self._timings[1:]
+
+        return None
+
     def get_taper_params(self, engine, source):
-        store = engine.get_store(self.store_id)
         config = self.misfit_config
-        tmin_fit = source.time + store.t(config.tmin, source, self)
-        tmax_fit = source.time + store.t(config.tmax, source, self)
+        timings = self.get_timings(source)
+        if timings is not None and num.all(num.isfinite(timings[:2])):
+            tmin_fit, tmax_fit = timings[:2]
+        else:
+            store = engine.get_store(self.store_id)
+            tmin_fit = source.time + store.t(config.tmin, source, self)
+            tmax_fit = source.time + store.t(config.tmax, source, self)
+
         if config.fmin > 0.0:
             tfade = 1.0/config.fmin
         else:
@@ -322,9 +331,13 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         ds = self.get_dataset()
 
         if config.pick_synthetic_traveltime and config.pick_phasename:
-            store = engine.get_store(self.store_id)
-            tsyn = source.time + store.t(
-                config.pick_synthetic_traveltime, source, self)
+            timings = self.get_timings(source)
+            if timings is not None and num.isfinite(timings[2]):
+                tsyn = timings[2]
+            else:
+                store = engine.get_store(self.store_id)
+                tsyn = source.time + store.t(
+                    config.pick_synthetic_traveltime, source, self)
 
             marker = ds.get_pick(
                 source.name,
@@ -635,6 +648,12 @@ def _process(tr, tmin, tmax, taper, domain):
     return tr_proc, trspec_proc
 
 
+def timings_key(source):
+    return (
+        source.time, source.lat, source.lon,
+        source.north_shift, source.east_shift, source.depth)
+
+
 def backazimuth_for_waveform(azimuth, nslc):
     if nslc[-1] == 'R':
         backazimuth = azimuth + 180.
@@ -56,6 +56,7 @@ class WOACTarget(MisfitTarget):
     norm_exponent = Int.T(default=2)
 
     can_bootstrap_weights = True
+    repeat_prepare_modelling = True
 
     def __init__(self, **kwargs):
         MisfitTarget.__init__(self, **kwargs)
@@ -6,7 +6,7 @@ from pyrocko.guts import Float, Tuple, String, Bool
 from pyrocko import gf
 
 from ..base import (
-    MisfitTarget, TargetGroup, MisfitResult)
+    MisfitTarget, TargetGroup, MisfitResult, select_stations)
 from . import measure as fm
 from grond import dataset
 from grond.meta import has_get_plot_classes
@@ -15,9 +15,9 @@ guts_prefix = 'grond'
 logger = logging.getLogger('grond.targets.waveform_phase_ratio.target')
 
 
-def log_exclude(target, reason):
+def log_exclude(path, codes, reason):
     logger.debug('Excluding potential target %s: %s' % (
-        target.string_id(), reason))
+        '.'.join((path,) + codes), reason))
 
 
 class PhaseRatioTargetGroup(TargetGroup):
@@ -57,14 +57,32 @@ class PhaseRatioTargetGroup(TargetGroup):
         logger.debug('Selecting phase ratio targets...')
         origin = event
         targets = []
-
-        for st in ds.get_stations():
+        path = self.path or default_path
+
+        stations, reasons, azimuths = select_stations(
+            ds, origin,
+            distance_min=self.distance_min,
+            distance_max=self.distance_max,
+            distance_3d_min=self.distance_3d_min,
+            distance_3d_max=self.distance_3d_max,
+            depth_min=self.depth_min,
+            depth_max=self.depth_max)
+
+        for st, reason, azi in zip(stations, reasons, azimuths):
             blacklisted = False
             for measure in [self.measure_a, self.measure_b]:
                 for cha in measure.channels:
                     if ds.is_blacklisted((st.nsl() + (cha,))):
                         blacklisted = True
 
+            if blacklisted:
+                log_exclude(path, st.nsl(), 'blacklisted')
+                continue
+
+            if reason is not None:
+                log_exclude(path, st.nsl(), reason)
+                continue
+
             target = PhaseRatioTarget(
                 codes=st.nsl(),
                 lat=st.lat,
@@ -76,47 +94,11 @@ class PhaseRatioTargetGroup(TargetGroup):
                 measure_b=self.measure_b,
                 manual_weight=self.weight,
                 normalisation_family=self.normalisation_family,
-                path=self.path or default_path,
-                backazimuth=0.0,
+                path=path,
+                backazimuth=float(azi),
                 fit_log_ratio=self.fit_log_ratio,
                 fit_log_ratio_waterlevel=self.fit_log_ratio_waterlevel)
 
-            if blacklisted:
-                log_exclude(target, 'blacklisted')
-                continue
-
-            if self.distance_min is not None and \
-               target.distance_to(origin) < self.distance_min:
-                log_exclude(target, 'distance < distance_min')
-                continue
-
-            if self.distance_max is not None and \
-               target.distance_to(origin) > self.distance_max:
-                log_exclude(target, 'distance > distance_max')
-                continue
-
-            if self.distance_3d_min is not None and \
-               target.distance_3d_to(origin) < self.distance_3d_min:
-                log_exclude(target, 'distance_3d < distance_3d_min')
-                continue
-
-            if self.distance_3d_max is not None and \
-               target.distance_3d_to(origin) > self.distance_3d_max:
-                log_exclude(target, 'distance_3d > distance_3d_max')
-                continue
-
-            if self.depth_min is not None and \
-               target.depth < self.depth_min:
-                log_exclude(target, 'depth < depth_min')
-                continue
-
-            if self.depth_max is not None and \
-               target.depth > self.depth_max:
-                log_exclude(target, 'depth > depth_max')
-                continue
-
-            bazi, _ = target.azibazi_to(origin)
-            target.backazimuth = bazi
             target.set_dataset(ds)
             targets.append(target)
 
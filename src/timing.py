@@ -0,0 +1,325 @@
+'''
+Timing breakdown of optimisation runs.
+
+While optimising, the time spent in the phases of each iteration (sample
+generation, preconstraining, forward modelling, post-processing per target
+type, misfit combination and history writes) is measured with
+:py:class:`timed` blocks. The durations are summed per iteration and phase
+and aggregated into histograms with logarithmically spaced bins, which are
+written to ``<rundir>/timings.yaml``. They are shown by the monitor and in
+the report, e.g. to find out whether a run is limited by the GF stores, the
+data processing or the Python code of the sampler.
+
+Durations are only recorded while a :py:class:`TimingRecorder` is active,
+see :py:func:`set_recorder`. A :py:class:`timed` block costs about a
+microsecond, which is negligible compared to the forward modelling.
+'''
+
+import os
+import math
+import time
+import uuid
+import logging
+import os.path as op
+from collections import OrderedDict
+
+import numpy as num
+
+from pyrocko import guts
+from pyrocko.guts import Object, String, Int, Float, List
+
+from grond.version import __version__
+from grond.meta import GrondError
+
+guts_prefix = 'grond'
+logger = logging.getLogger('grond.timing')
+
+timings_filename = 'timings.yaml'
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+class PhaseTimings(Object):
+    '''
+    Aggregated durations of one phase of the optimisation iterations.
+    '''
+
+    name = String.T(
+        help='Name of the phase, e.g. ``engine`` or '
+             '``processing.WaveformMisfitTarget``.')
+    count = Int.T(
+        default=0,
+        help='Number of iterations in which the phase was run.')
+    total = Float.T(
+        default=0.,
+        help='Total time spent in the phase [s].')
+    min = Float.T(
+        optional=True,
+        help='Shortest duration of the phase in an iteration [s].')
+    max = Float.T(
+        optional=True,
+        help='Longest duration of the phase in an iteration [s].')
+    histogram = List.T(
+        Int.T(),
+        help='Number of iterations in each duration bin.')
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+
+        return self.total / self.count
+
+
+class RunTimings(Object):
+    '''
+    Per-phase timing histograms of an optimisation run.
+
+    The duration bins are spaced logarithmically, starting at
+    ``10**log10_tmin`` seconds, with ``nbins_per_decade`` bins per decade.
+    Durations outside of the bins are counted in the first or last bin.
+    '''
+
+    niterations = Int.T(
+        default=0,
+        help='Number of timed iterations.')
+    log10_tmin = Float.T(default=-6.)
+    nbins_per_decade = Int.T(default=5)
+    nbins = Int.T(default=50)
+    phases = List.T(PhaseTimings.T())
+
+    def get_bin_edges(self):
+        return 10**(self.log10_tmin + num.arange(self.nbins + 1)
+                    / float(self.nbins_per_decade))
+
+    def get_phase(self, name):
+        for phase in self.phases:
+            if phase.name == name:
+                return phase
+
+        return None
+
+    def get_iteration_phase(self):
+        return self.get_phase('iteration')
+
+    def get_breakdown_phases(self):
+        '''
+        Get the timed parts of the iterations, longest first.
+        '''
+
+        return sorted(
+            (phase for phase in self.phases if phase.name != 'iteration'),
+            key=lambda phase: phase.total, reverse=True)
+
+    def summary(self, nphases=4):
+        '''
+        One-line summary: mean time per iteration and the main phases.
+        '''
+
+        iteration = self.get_iteration_phase()
+        if iteration is None or not iteration.count or not iteration.total:
+            return None
+
+        parts = []
+        for phase in self.get_breakdown_phases()[:nphases]:
+            parts.append('%s %.0f%%' % (
+                phase.name, 100. * phase.total / iteration.total))
+
+        return 'Time per iteration: %s (%s)' % (
+            format_duration(iteration.mean), ', '.join(parts))
+
+
+def format_duration(t):
+    if t < 1e-3:
+        return '%.0f us' % (t * 1e6)
+    elif t < 1.0:
+        return '%.1f ms' % (t * 1e3)
+    else:
+        return '%.2f s' % t
+
+
+class TimingRecorder(object):
+    '''
+    Accumulator for the timings of the optimisation iterations.
+
+    :param path: file to write the timings to, usually
+        ``<rundir>/timings.yaml``, or ``None``
+    :param interval: minimum time between writes of the timings file [s]
+    '''
+
+    def __init__(self, path=None, interval=10.):
+        self.path = path
+        self.interval = interval
+        self.timings = RunTimings()
+        self._iteration = OrderedDict()
+        self._phases = OrderedDict()
+        self._tlast_write = clock()
+        self._t_iteration = None
+
+    def add(self, name, duration):
+        it = self._iteration
+        it[name] = it.get(name, 0.0) + duration
+
+    def start_iteration(self):
+        self._iteration.clear()
+        self._t_iteration = clock()
+
+    def end_iteration(self):
+        t = clock()
+        self.add('iteration', t - self._t_iteration)
+
+        timings = self.timings
+        nbins = timings.nbins
+        for name, duration in self._iteration.items():
+            stats = self._phases.get(name, None)
+            if stats is None:
+                stats = self._phases[name] = [
+                    0, 0.0, duration, duration, [0] * nbins]
+
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = min(stats[2], duration)
+            stats[3] = max(stats[3], duration)
+            if duration > 0.0:
+                ibin = int(math.floor(
+                    (math.log10(duration) - timings.log10_tmin)
+                    * timings.nbins_per_decade))
+            else:
+                ibin = 0
+
+            stats[4][min(max(ibin, 0), nbins - 1)] += 1
+
+        timings.niterations += 1
+        self._iteration.clear()
+
+        if self.path is not None and t - self._tlast_write > self.interval:
+            self.write()
+
+    def get_timings(self):
+        timings = self.timings
+        timings.phases = [
+            PhaseTimings(
+                name=name,
+                count=count,
+                total=total,
+                min=tmin,
+                max=tmax,
+                histogram=list(histogram))
+
+            for (name, (count, total, tmin, tmax, histogram))
+            in self._phases.items()]
+
+        return timings
+
+    def write(self):
+        self._tlast_write = clock()
+        try:
+            write_timings(self.get_timings(), self.path)
+        except GrondError as e:
+            logger.warning(str(e))
+
+
+g_recorder = None
+
+
+def set_recorder(recorder):
+    '''
+    Activate a :py:class:`TimingRecorder`, or deactivate timing with
+    ``None``.
+
+    :returns: the previously active recorder
+    '''
+
+    global g_recorder
+    recorder_old = g_recorder
+    g_recorder = recorder
+    return recorder_old
+
+
+def get_recorder():
+    return g_recorder
+
+
+class timed(object):
+    '''
+    Context manager adding the duration of a block to the active recorder.
+
+    Several blocks with the same name in one iteration are summed up.
+    '''
+
+    __slots__ = ['name', 't0']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *args):
+        if g_recorder is not None:
+            g_recorder.add(self.name, clock() - self.t0)
+
+
+def read_timings(path):
+    try:
+        timings = guts.load(filename=path)
+    except (OSError, IOError):
+        raise GrondError(
+            'Cannot read Grond timings file: %s' % path)
+
+    if not isinstance(timings, RunTimings):
+        raise GrondError(
+            'Invalid Grond timings in file "%s".' % path)
+
+    return timings
+
+
+def write_timings(timings, path):
+    tmp_path = path + '.%s.tmp' % uuid.uuid4().hex
+    try:
+        guts.dump(
+            timings,
+            filename=tmp_path,
+            header='Grond timings file, version %s' % __version__)
+
+        os.rename(tmp_path, path)
+
+    except (OSError, IOError):
+        if op.exists(tmp_path):
+            os.unlink(tmp_path)
+
+        raise GrondError(
+            'Cannot write Grond timings file: %s' % path)
+
+
+def load_rundir_timings(rundir):
+    '''
+    Get the timings of a run, or ``None`` if they are not available.
+    '''
+
+    path = op.join(rundir, timings_filename)
+    if not op.exists(path):
+        return None
+
+    try:
+        return read_timings(path)
+    except GrondError as e:
+        logger.warning(str(e))
+        return None
+
+
+__all__ = '''
+    PhaseTimings
+    RunTimings
+    TimingRecorder
+    set_recorder
+    get_recorder
+    timed
+    read_timings
+    write_timings
+    load_rundir_timings
+'''.split()
@@ -0,0 +1,397 @@
+import shutil
+import tempfile
+
+import numpy as num
+
+from grond.analysers.base import Analyser, AnalyserCache
+from grond.analysers.target_balancing.analyser import \
+    TargetBalancingAnalyser, TargetBalancingAnalyserResult
+
+from .test_problem import TempEngine, get_synthetic_cmt_problem, \
+    get_waveform_targets
+
+
+class TempDir(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='grond-test-analysers-')
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def get_weights(results):
+    return [result.weight for result in results]
+
+
+def get_balancing_weights(problem):
+    return num.array([
+        target.analyser_results['target_balancing'].weight
+        for target in problem.waveform_targets])
+
+
+def test_analyser_cache():
+    targets = get_waveform_targets([('{stored:P}', '{stored:S}', None)])
+    results = [
+        TargetBalancingAnalyserResult(weight=float(i))
+        for i in range(len(targets))]
+
+    with TempDir() as path:
+        cache = AnalyserCache(path)
+        assert cache.get('test', 'fp1', targets) is None
+
+        cache.put('test', 'fp1', targets, results)
+        assert get_weights(cache.get('test', 'fp1', targets)) \
+            == get_weights(results)
+
+        assert get_weights(AnalyserCache(path).get('test', 'fp1', targets)) \
+            == get_weights(results)
+
+        assert cache.get('test', 'fp2', targets) is None
+        assert cache.get('other', 'fp1', targets) is None
+        assert cache.get('test', 'fp1', targets[1:]) is None
+        assert cache.get('test', 'fp1', targets[::-1]) is None
+
+        with open(cache.entry_path('test', 'fp1'), 'w') as f:
+            f.write('--- !grond.Nonsense {')
+
+        assert cache.get('test', 'fp1', targets) is None
+
+        analyser = Analyser()
+        analyser.put_cached_results('test', 'fp3', targets, results)
+        assert analyser.get_cached_results('test', 'fp3', targets) is None
+
+        analyser.set_cache(cache)
+        analyser.put_cached_results('test', 'fp3', targets, results)
+        assert get_weights(analyser.get_cached_results(
+            'test', 'fp3', targets)) == get_weights(results)
+
+
+def test_target_balancing_cache():
+    with TempEngine() as engine, TempDir() as path:
+        problem = get_synthetic_cmt_problem(engine)
+        ds = problem.waveform_targets[0].get_dataset()
+
+        analyser = TargetBalancingAnalyser(niter=4, nbatch=2)
+        analyser.set_cache(AnalyserCache(path))
+
+        fp = analyser.get_fingerprint(problem)
+        assert all(analyser.get_data_availability(problem))
+
+        analyser.analyse(problem, ds)
+        weights = get_balancing_weights(problem)
+        assert num.all(num.isfinite(weights))
+
+        # hit, nothing is evaluated
+        def fail(problem):
+            assert False, 'cached weights expected'
+
+        analyser.get_mean_amplitudes = fail
+        for target in problem.waveform_targets:
+            target.analyser_results = {}
+
+        analyser.analyse(problem, ds)
+        num.testing.assert_equal(get_balancing_weights(problem), weights)
+
+        # missing data of one station changes the weights
+        ds.add_blacklist(['S3'])
+        assert analyser.get_data_availability(problem) == [
+            target.codes[1] != 'S3' for target in problem.waveform_targets]
+
+        assert analyser.get_fingerprint(problem) != fp
+
+        analyser = TargetBalancingAnalyser(niter=4, nbatch=2)
+        analyser.set_cache(AnalyserCache(path))
+        analyser.analyse(problem, ds)
+
+        weights = get_balancing_weights(problem)
+        for target, weight in zip(problem.waveform_targets, weights):
+            assert num.isfinite(weight) == (target.codes[1] != 'S3')
+
+
+def get_random_catalog(nevents, rstate):
+    from pyrocko import model
+
+    events = []
+    for iev in range(nevents):
+        magnitude = rstate.uniform(3., 7.)
+        events.append(model.Event(
+            name='ev%i' % iev,
+            time=float(rstate.randint(0, 1000)) * 10.,
+            lat=rstate.uniform(-20., 20.),
+            lon=rstate.uniform(-20., 20.),
+            magnitude=magnitude if iev % 7 != 0 else None))
+
+    return events
+
+
+def get_distance(ev, location):
+    from pyrocko import orthodrome
+
+    return orthodrome.distance_accurate50m_numpy(
+        num.array([ev.lat]), num.array([ev.lon]),
+        location.lat, location.lon)[0]
+
+
+def select_events(events, tmin, tmax, magmin, location, distance_max):
+    selected = []
+    for ev in events:
+        if not tmin <= ev.time <= tmax:
+            continue
+
+        if magmin is not None and (
+                ev.magnitude is None or ev.magnitude < magmin):
+            continue
+
+        if distance_max is not None \
+                and get_distance(ev, location) > distance_max:
+            continue
+
+        selected.append(ev)
+
+    return selected
+
+
+def test_event_catalog_index():
+    from pyrocko import gf, model
+    from grond.analysers.noise_analyser.analyser import EventCatalogIndex, \
+        get_catalog_index
+
+    rstate = num.random.RandomState(38)
+    events = get_random_catalog(500, rstate)
+    index = EventCatalogIndex(events)
+    assert len(index) == len(events)
+    assert num.all(num.diff(index.times) >= 0.)
+
+    nselected = 0
+    for itrial in range(300):
+        tmin = float(rstate.randint(-10, 1000)) * 10.
+        if itrial % 3 == 0:
+            tmin += rstate.uniform(0., 10.)
+
+        tmax = tmin + [0., 10., 500., 5000.][itrial % 4]
+        magmin = [None, 5.][itrial % 2]
+        location = gf.Location(
+            lat=rstate.uniform(-20., 20.), lon=rstate.uniform(-20., 20.))
+        distance_max = [None, 500e3, 2000e3][itrial % 3]
+
+        # thresholds at actual values, to check the inclusive comparisons
+        ev = events[rstate.randint(1, len(events))]
+        if itrial % 5 == 0 and ev.magnitude is not None:
+            magmin = ev.magnitude
+
+        if itrial % 5 == 1:
+            distance_max = get_distance(ev, location)
+
+        selected = index.get_events(
+            tmin, tmax, magmin=magmin, location=location,
+            distance_max=distance_max)
+
+        selected_ref = select_events(
+            events, tmin, tmax, magmin, location, distance_max)
+
+        assert sorted(ev.name for ev in selected) \
+            == sorted(ev.name for ev in selected_ref)
+
+        assert [ev.time for ev in selected] \
+            == sorted(ev.time for ev in selected)
+
+        nselected += len(selected)
+
+    assert nselected > 100
+
+    assert EventCatalogIndex([]).get_events(
+        0., 1000., magmin=5., location=location, distance_max=1e6) == []
+
+    with TempDir() as path:
+        fn = path + '/catalog.txt'
+        model.dump_events(events, filename=fn)
+        index = get_catalog_index(fn)
+        assert get_catalog_index(fn) is index
+        assert len(index) == len(events)
+        assert [ev.name for ev in index.get_events(0., 200.)] \
+            == [ev.name for ev in select_events(
+                sorted(events, key=lambda ev: ev.time),
+                0., 200., None, None, None)]
+
+
+def windowed_variance_reference(data, nwindows, statistic):
+    '''
+    Windowed variance computed row by row and window by window.
+    '''
+
+    ntraces, nsamples = data.shape
+    nwin = nsamples // max(nwindows, 1)
+    var = []
+    for row in data:
+        if nwindows <= 1:
+            windows = [row]
+        else:
+            windows = [row[i*nwin:(i+1)*nwin] for i in range(nwindows)]
+
+        wvar = []
+        for window in windows:
+            samples = window[num.isfinite(window)]
+            if samples.size != 0:
+                wvar.append(num.var(samples))
+
+        if not wvar:
+            var.append(num.nan)
+        elif statistic == 'mean':
+            var.append(num.mean(wvar))
+        else:
+            var.append(num.median(wvar))
+
+    return num.array(var)
+
+
+def test_windowed_variance():
+    from grond.analysers.noise_analyser.analyser import windowed_variance
+
+    rstate = num.random.RandomState(39)
+    data = rstate.normal(size=(10, 103)) \
+        * rstate.uniform(0.5, 5., size=(10, 1))
+    data[rstate.uniform(size=data.shape) < 0.1] = num.nan
+
+    # no samples, samples only in the first window, samples only in the
+    # trailing samples not filling a window
+    data[1, :] = num.nan
+    data[2, 10:] = num.nan
+    data[3, :100] = num.nan
+
+    for nwindows in (0, 1, 2, 3, 5, 7, 200):
+        for statistic in ('mean', 'median'):
+            var = windowed_variance(data, nwindows, statistic)
+            var_ref = windowed_variance_reference(data, nwindows, statistic)
+            num.testing.assert_allclose(var, var_ref, rtol=1e-12)
+
+    assert num.isnan(windowed_variance(data, 5, 'mean')[3])
+    assert num.isfinite(windowed_variance(data, 1, 'mean')[3])
+
+    # mean and median differ for unequal windows
+    data = num.concatenate([
+        rstate.normal(scale=scale, size=(1, 50)) for scale in (1., 2., 10.)],
+        axis=1)
+
+    var_mean = windowed_variance(data, 3, 'mean')
+    var_median = windowed_variance(data, 3, 'median')
+    assert var_mean[0] > var_median[0]
+    num.testing.assert_allclose(
+        var_median, windowed_variance_reference(data, 3, 'median'))
+
+    assert num.all(num.isnan(windowed_variance(
+        num.full((3, 10), num.nan), 2, 'median')))
+
+
+def test_stack_traces():
+    from pyrocko import trace
+    from grond.analysers.noise_analyser.analyser import stack_traces, \
+        windowed_variance
+
+    rstate = num.random.RandomState(39)
+    traces = []
+    for nsamples in (100, 60, None, 1, 99):
+        if nsamples is None:
+            traces.append(None)
+        else:
+            traces.append(trace.Trace(
+                ydata=rstate.normal(size=nsamples), deltat=0.5))
+
+    data = stack_traces(traces)
+    assert data.shape == (5, 100)
+    for row, tr in zip(data, traces):
+        if tr is None:
+            assert num.all(num.isnan(row))
+        else:
+            num.testing.assert_equal(row[:tr.ydata.size], tr.ydata)
+            assert num.all(num.isnan(row[tr.ydata.size:]))
+
+    # padding is ignored
+    var = windowed_variance(data, 1, 'mean')
+    assert num.isnan(var[2])
+    for v, tr in zip(var, traces):
+        if tr is not None:
+            num.testing.assert_allclose(v, num.var(tr.ydata), rtol=1e-12)
+
+    # windows of the stack, windows past the end of a trace are ignored
+    for statistic in ('mean', 'median'):
+        var = windowed_variance(data, 4, statistic)
+        for v, tr in zip(var, traces):
+            if tr is None:
+                assert num.isnan(v)
+                continue
+
+            wvar = [
+                num.var(tr.ydata[i*25:(i+1)*25])
+                for i in range(4) if i*25 < tr.ydata.size]
+
+            v_ref = num.mean(wvar) if statistic == 'mean' \
+                else num.median(wvar)
+
+            num.testing.assert_allclose(v, v_ref, rtol=1e-12)
+
+    assert stack_traces([]).shape == (0, 0)
+    assert stack_traces([None, None]).shape == (2, 0)
+
+
+def get_balancing_weights_reference(problem, niter):
+    '''
+    Target balancing weights with one random model at a time, as computed
+    before the models were drawn and evaluated in batches.
+    '''
+
+    from grond.meta import Forbidden
+
+    wproblem = TargetBalancingAnalyser(niter=niter).get_wproblem(problem)
+    xbounds = wproblem.get_parameter_bounds()
+    rstate = num.random.RandomState(123)
+
+    mss = num.zeros((niter, wproblem.ntargets))
+    isbad_mask = None
+    for iiter in range(niter):
+        while True:
+            x = [rstate.uniform(xmin, xmax) for (xmin, xmax) in xbounds]
+            try:
+                x = wproblem.preconstrain(x)
+                break
+
+            except Forbidden:
+                pass
+
+        if isbad_mask is not None and num.any(isbad_mask):
+            isok_mask = num.logical_not(isbad_mask)
+        else:
+            isok_mask = None
+
+        mss[iiter, :] = wproblem.misfits(x, mask=isok_mask)[:, 1]
+        isbad_mask = num.isnan(mss[iiter, :])
+
+    weights = 1. / num.mean(mss, axis=0)
+    families, nfamilies = wproblem.get_family_mask()
+    for ifamily in range(nfamilies):
+        weights[families == ifamily] /= (
+            num.nansum(weights[families == ifamily]) /
+            num.nansum(num.isfinite(weights[families == ifamily])))
+
+    return weights
+
+
+def test_target_balancing_batches():
+    with TempEngine() as engine:
+        problem = get_synthetic_cmt_problem(engine)
+        ds = problem.waveform_targets[0].get_dataset()
+
+        for blacklist in ([], ['S3']):
+            ds.add_blacklist(blacklist)
+            weights_ref = get_balancing_weights_reference(problem, 9)
+
+            # last batch incomplete, more workers than models in a batch
+            for nworkers, nbatch in ((1, 1), (1, 4), (2, 4), (3, 2), (2, 50)):
+                analyser = TargetBalancingAnalyser(
+                    niter=9, nworkers=nworkers, nbatch=nbatch)
+
+                analyser.analyse(problem, ds)
+                num.testing.assert_allclose(
+                    get_balancing_weights(problem), weights_ref, rtol=1e-12)
+
+            assert num.sum(num.isnan(weights_ref)) == len(blacklist)
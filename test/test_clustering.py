@@ -0,0 +1,216 @@
+import numpy as num
+
+from grond.clustering import dbscan
+
+
+def dbscan_reference(simmat, nmin, eps, ncluster_limit):
+    '''
+    DBSCAN on the full similarity matrix, as implemented before the
+    neighbour graph was introduced.
+    '''
+
+    CORE, NOT_CORE, EDGE, ISLE, REACHED = range(1, 6)
+
+    nev = len(simmat)
+    reachables = [
+        [j for j in range(nev) if simmat[i, j] <= eps and i != j]
+        for i in range(nev)]
+
+    types = [
+        CORE if len(reachables[i]) >= nmin else NOT_CORE
+        for i in range(nev)]
+
+    for i in range(nev):
+        for j in range(nev):
+            if i in reachables[j] and types[j] == CORE \
+                    and types[i] == NOT_CORE:
+                types[i] = EDGE
+
+        if types[i] == NOT_CORE:
+            types[i] = ISLE
+
+    eventsclusters = num.zeros(nev, dtype=int)
+    actualcluster = -1
+    for i in range(nev):
+        if types[i] == ISLE:
+            eventsclusters[i] = -1
+        elif types[i] == CORE:
+            actualcluster += 1
+            eventsclusters[i] = actualcluster
+            pointingevents = [i]
+            while pointingevents:
+                newpointingevents = []
+                for j in pointingevents:
+                    for k in reachables[j]:
+                        if types[k] == CORE:
+                            newpointingevents.append(k)
+                            eventsclusters[k] = actualcluster
+                            types[k] = REACHED
+                        elif types[k] == EDGE:
+                            eventsclusters[k] = actualcluster
+                            types[k] = REACHED
+
+                pointingevents = newpointingevents
+
+    n_clusters = actualcluster + 1
+    clustersizes = [
+        (icl, num.sum(eventsclusters == icl)) for icl in range(n_clusters)]
+
+    resorted = sorted(clustersizes, key=lambda tup: tup[1], reverse=True)
+    resorting = {-1: -1}
+    for icl, (iclold, _) in enumerate(resorted):
+        if ncluster_limit is None or icl < ncluster_limit:
+            resorting[iclold] = icl
+        else:
+            resorting[iclold] = -1
+
+    return num.array([resorting[evcl] for evcl in eventsclusters])
+
+
+def distance_matrix(points):
+    return num.sqrt(num.sum(
+        (points[:, num.newaxis, :] - points[num.newaxis, :, :])**2, axis=-1))
+
+
+def test_dbscan_graph_random():
+    rstate = num.random.RandomState(41)
+    for itrial in range(200):
+        if itrial % 2 == 0:
+            points = rstate.uniform(0., 1., size=(rstate.randint(1, 60), 2))
+        else:
+            points = num.concatenate([
+                rstate.normal(center, 0.05, size=(rstate.randint(1, 20), 2))
+                for center in rstate.uniform(0., 1., size=(4, 2))])
+
+        simmat = distance_matrix(points)
+        if itrial % 5 == 0:
+            # not symmetric
+            simmat *= rstate.uniform(0.8, 1.2, size=simmat.shape)
+
+        eps = rstate.uniform(0.02, 0.3)
+        nmin = rstate.randint(1, 8)
+        ncluster_limit = [None, 1, 2, 5][itrial % 4]
+
+        labels_ref = dbscan_reference(simmat, nmin, eps, ncluster_limit)
+        labels = dbscan.dbscan(simmat, nmin, eps, ncluster_limit)
+        assert num.all(labels == labels_ref)
+
+        indptr, indices = dbscan.neighbour_graph(simmat, eps, nblock=7)
+        labels = dbscan.dbscan_graph(indptr, indices, nmin, ncluster_limit)
+        assert num.all(labels == labels_ref)
+
+
+def test_dbscan_graph_border():
+    # two clusters of four and six events and one event between them, which
+    # is reachable from both clusters but is not a core event itself
+    x = num.array([
+        0., 0.05, 0.1, 0.15,
+        0.3,
+        0.45, 0.5, 0.55, 0.6, 0.65, 0.7,
+        2.0])
+
+    points = num.zeros((x.size, 2))
+    points[:, 0] = x
+
+    rstate = num.random.RandomState(42)
+    for itrial in range(20):
+        iperm = rstate.permutation(x.size)
+        simmat = distance_matrix(points[iperm])
+        ievent_border = num.flatnonzero(iperm == 4)[0]
+        ievent_isle = num.flatnonzero(iperm == x.size - 1)[0]
+
+        for ncluster_limit in (None, 1):
+            labels_ref = dbscan_reference(simmat, 3, 0.151, ncluster_limit)
+            labels = dbscan.dbscan(simmat, 3, 0.151, ncluster_limit)
+            assert num.all(labels == labels_ref)
+            assert labels[ievent_isle] == -1
+
+            if ncluster_limit is None:
+                assert num.sum(labels == 0) + num.sum(labels == 1) == 11
+                assert labels[ievent_border] in (0, 1)
+            else:
+                # larger cluster is kept, smaller one becomes noise
+                assert num.all(labels[num.argsort(iperm)][5:11] == 0)
+                assert num.max(labels) == 0
+
+
+def get_random_events(nevents, rstate):
+    from pyrocko import model, moment_tensor as mtm
+
+    events = []
+    for iev in range(nevents):
+        events.append(model.Event(
+            lat=rstate.uniform(10., 13.),
+            lon=rstate.uniform(20., 23.),
+            depth=rstate.uniform(0., 30e3),
+            moment_tensor=mtm.MomentTensor.random_mt(
+                magnitude=rstate.uniform(4., 6.))))
+
+    return events
+
+
+def test_neighbour_graph():
+    from grond.clustering import metrics
+
+    rstate = num.random.RandomState(42)
+    events = get_random_events(150, rstate)
+    ilower = num.tril_indices(len(events), -1)
+
+    for metric in ('mt_l2norm', 'hypocentral', 'epicentral', 'kagan_angle'):
+        simmat = metrics.compute_similarity_matrix(events, metric)
+        distances = num.sort(simmat[ilower])
+        for quantile in (0.0, 0.01, 0.1, 0.5):
+            # threshold at an actual distance, to check the <= comparison
+            eps = distances[int(quantile * (distances.size - 1))]
+            indptr_ref, indices_ref = dbscan.neighbour_graph(simmat, eps)
+            for nblock, nthreads in ((1000, 1), (40, 1), (40, 3)):
+                indptr, indices = metrics.compute_neighbour_graph(
+                    events, metric, eps, nthreads=nthreads, nblock=nblock)
+
+                assert num.all(indptr == indptr_ref), metric
+                assert num.all(indices == indices_ref), metric
+
+
+def test_metric_matrices():
+    from pyrocko import orthodrome, moment_tensor as mtm
+    from grond.clustering import metrics
+
+    rstate = num.random.RandomState(40)
+    events = get_random_events(30, rstate)
+    events[1].lat, events[1].lon = events[0].lat, events[0].lon
+
+    nev = len(events)
+    kagan = num.zeros((nev, nev))
+    hypo = num.zeros((nev, nev))
+    epi = num.zeros((nev, nev))
+    for i, ev_a in enumerate(events):
+        for j, ev_b in enumerate(events):
+            kagan[i, j] = min(mtm.kagan_angle(
+                ev_a.moment_tensor, ev_b.moment_tensor) / 120., 1.)
+
+            if i != j:
+                distance_km = orthodrome.distance_accurate50m(
+                    ev_a, ev_b) / 1000.
+            else:
+                distance_km = 0.
+
+            ddepth_km = (ev_a.depth - ev_b.depth) / 1000.
+            hypo[i, j] = min(
+                num.sqrt(distance_km**2 + ddepth_km**2) / 1000., 1.)
+            epi[i, j] = min(distance_km / 1000., 1.)
+
+    for metric, simmat_ref in (
+            ('kagan_angle', kagan),
+            ('hypocentral', hypo),
+            ('epicentral', epi)):
+
+        simmat = metrics.compute_similarity_matrix(events, metric)
+        num.testing.assert_allclose(simmat, simmat_ref, rtol=0., atol=1e-12)
+
+        # blocks limited by the memory budget
+        assert metrics.get_block_size(
+            metric, nthreads=2, memory_max=50000) < 10
+
+        simmat = metrics.compute_similarity_matrix(
+            events, metric, nthreads=2, memory_max=50000)
+        num.testing.assert_allclose(simmat, simmat_ref, rtol=0., atol=1e-12)
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import os.path as op
+
+import numpy as num
+
+from pyrocko import model
+from pyrocko.guts import Object, Float
+
+from grond.dataset import DatasetConfig
+from grond.forward_cache import ForwardCache, evaluate_models, \
+    problem_fingerprint
+
+
+class DummyProblem(Object):
+    '''
+    Problem without targets, counting its evaluations.
+    '''
+
+    offset = Float.T(default=0.)
+
+    def __init__(self, **kwargs):
+        Object.__init__(self, **kwargs)
+        self.targets = []
+        self.base_source = model.Event(name='ev1')
+        self.nevaluations = 0
+
+    def get_engine(self):
+        return 'dummy engine'
+
+    def evaluate(self, x):
+        self.nevaluations += 1
+        return [num.sum(x) + self.offset, x * 2.]
+
+
+class TempDir(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='grond-test-forward-cache-')
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def assert_results_equal(results, results_ref):
+    assert results[0] == results_ref[0]
+    assert num.all(results[1] == results_ref[1])
+
+
+def test_forward_cache_put_get():
+    with TempDir() as path:
+        problem = DummyProblem()
+        cache = ForwardCache(path, problem)
+
+        x = num.array([1., 2., 3.])
+        assert cache.get(x) is None
+
+        cache.put(x, problem.evaluate(x))
+        assert_results_equal(cache.get(x), [6., x * 2.])
+        assert cache.get(x + 1.) is None
+
+        # same setup, same entries
+        assert_results_equal(ForwardCache(path, problem).get(x), [6., x * 2.])
+
+        # changed setup, entries of the old setup are removed
+        cache2 = ForwardCache(path, DummyProblem(offset=1.))
+        assert cache2.fingerprint != cache.fingerprint
+        assert cache2.get(x) is None
+        assert os.listdir(path) == []
+
+
+def test_forward_cache_prune():
+    with TempDir() as path:
+        problem = DummyProblem()
+        cache = ForwardCache(path, problem, nentries_max=3)
+        xs = [num.array([float(i)]) for i in range(5)]
+        for i, x in enumerate(xs):
+            fn = cache.entry_path(x)
+            cache.put(x, problem.evaluate(x))
+            os.utime(fn, (1000. + i, 1000. + i))
+
+        # least recently used entries are removed
+        assert [cache.get(x) is not None for x in xs] == [
+            False, False, True, True, True]
+
+
+def test_evaluate_models():
+    with TempDir() as path:
+        problem = DummyProblem()
+        cache = ForwardCache(path, problem)
+        xs = [num.array([float(i), 1.]) for i in range(4)]
+
+        results_ref = [problem.evaluate(x) for x in xs]
+        problem.nevaluations = 0
+
+        results = evaluate_models(problem, xs[:2], cache=cache)
+        assert problem.nevaluations == 2
+
+        results = evaluate_models(problem, xs, cache=cache)
+        assert problem.nevaluations == 4
+        for r, r_ref in zip(results, results_ref):
+            assert_results_equal(r, r_ref)
+
+        results = evaluate_models(problem, xs, cache=cache)
+        assert problem.nevaluations == 4
+        for r, r_ref in zip(results, results_ref):
+            assert_results_equal(r, r_ref)
+
+        # misses evaluated in worker processes
+        results = evaluate_models(
+            problem, [x + 10. for x in xs], cache=cache, nprocs=2)
+
+        assert problem.nevaluations == 4
+        for r, x in zip(results, xs):
+            assert_results_equal(cache.get(x + 10.), r)
+            assert_results_equal(r, [num.sum(x + 10.), (x + 10.) * 2.])
+
+        results = evaluate_models(problem, xs, cache=None)
+        assert problem.nevaluations == 8
+
+
+def test_fingerprint_dataset_files():
+    with TempDir() as path:
+        os.makedirs(op.join(path, 'data', 'ev1', 'raw'))
+        fn_events = op.join(path, 'data', 'ev1', 'event.txt')
+        fn_waveform = op.join(path, 'data', 'ev1', 'raw', 'a.mseed')
+        for fn in (fn_events, fn_waveform):
+            with open(fn, 'w') as f:
+                f.write('x')
+
+        dataset_config = DatasetConfig(
+            events_path='data/${event_name}/event.txt',
+            waveform_paths=['data/${event_name}/raw'])
+        dataset_config.set_basepath(path)
+
+        problem = DummyProblem()
+
+        def get_fingerprint():
+            return problem_fingerprint(problem, dataset_config)
+
+        fp = get_fingerprint()
+        assert get_fingerprint() == fp
+
+        os.utime(fn_waveform, (1000., 1000.))
+        fp_mtime = get_fingerprint()
+        assert fp_mtime != fp
+
+        with open(fn_waveform, 'w') as f:
+            f.write('xy')
+
+        os.utime(fn_waveform, (1000., 1000.))
+        fp_size = get_fingerprint()
+        assert fp_size not in (fp, fp_mtime)
+
+        with open(op.join(path, 'data', 'ev1', 'raw', 'b.mseed'), 'w') as f:
+            f.write('x')
+
+        assert get_fingerprint() not in (fp, fp_mtime, fp_size)
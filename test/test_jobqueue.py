@@ -0,0 +1,191 @@
+import os
+import os.path as op
+import shutil
+import tempfile
+
+from grond.jobqueue import JobQueue, JobResult
+
+
+def make_result(event_name):
+    return JobResult(
+        event_name=event_name, host='test', pid=os.getpid(),
+        time_start=0., time_stop=1., ok=True)
+
+
+def make_stale(queue, event_name, age=1000.):
+    t = queue.fs_time() - age
+    lock_path = queue.lock_path(event_name)
+    for fn in ('heartbeat', 'owner', ''):
+        os.utime(op.join(lock_path, fn), (t, t))
+
+
+class TempQueue(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='grond-test-queue-')
+        JobQueue.create(self.path, 'config.gronf', ['ev1', 'ev2'])
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def test_claim():
+    with TempQueue() as path:
+        q1 = JobQueue(path)
+        q2 = JobQueue(path)
+
+        assert q1.claim('ev1')
+        assert not q2.claim('ev1')
+        assert q2.claim('ev2')
+        assert q1.get_status() == ([], ['ev1', 'ev2'], [])
+
+        q1.release('ev1', make_result('ev1'))
+        assert not op.exists(q1.lock_path('ev1'))
+        assert q1.is_done('ev1')
+        assert not q2.claim('ev1')
+
+
+def test_reclaim_stale():
+    with TempQueue() as path:
+        q1 = JobQueue(path)
+        q2 = JobQueue(path, stale_timeout=100.)
+
+        assert q1.claim('ev1')
+        assert not q2.claim('ev1')
+
+        make_stale(q1, 'ev1')
+        assert q2.claim('ev1')
+        assert q2.was_reclaimed('ev1')
+        token = q2.get_owner_token(q2.lock_path('ev1'))
+        assert token is not None and token == q2._tokens['ev1']
+        assert not [fn for fn in os.listdir(op.join(path, 'locks'))
+                    if fn.startswith('ev1.')]
+
+
+def test_reclaim_race():
+    with TempQueue() as path:
+        q1 = JobQueue(path)
+        q2 = JobQueue(path, stale_timeout=100.)
+        q3 = JobQueue(path, stale_timeout=100.)
+
+        assert q1.claim('ev1')
+        make_stale(q1, 'ev1')
+        lock_path = q1.lock_path('ev1')
+        state_stale = q2.get_lock_state(lock_path)
+
+        # q3 reclaims the event after q2 has seen the stale lock
+        assert q3.claim('ev1')
+        token = q3.get_owner_token(lock_path)
+
+        get_lock_state = q2.get_lock_state
+        states = [state_stale]
+
+        def get_lock_state_delayed(path):
+            if states:
+                return states.pop()
+
+            return get_lock_state(path)
+
+        q2.get_lock_state = get_lock_state_delayed
+        assert not q2.claim('ev1')
+        assert q2.get_owner_token(lock_path) == token
+
+
+def test_release_non_owner():
+    with TempQueue() as path:
+        q1 = JobQueue(path)
+        q2 = JobQueue(path, stale_timeout=100.)
+
+        assert q1.claim('ev1')
+        make_stale(q1, 'ev1')
+        assert q2.claim('ev1')
+        token = q2.get_owner_token(q2.lock_path('ev1'))
+
+        # slow first worker finishes after its event has been reclaimed
+        q1.release('ev1', make_result('ev1'))
+        assert q1.is_done('ev1')
+        assert q1.get_owner_token(q1.lock_path('ev1')) == token
+
+        q2.release('ev1', make_result('ev1'))
+        assert not op.exists(q2.lock_path('ev1'))
+
+
+class FakeGo(object):
+    '''
+    Replacement of :py:func:`grond.core.go` recording its calls.
+    '''
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    def __call__(self, env, force=False, preserve=False, status='state'):
+        event_name = env.args[1]
+        self.calls.append((event_name, force))
+        return [event_name] if event_name in self.failing else []
+
+    def __enter__(self):
+        from grond import core, environment
+
+        self._saved = core.go, environment.Environment
+        core.go = self
+        environment.Environment = FakeEnvironment
+        return self
+
+    def __exit__(self, *args):
+        from grond import core, environment
+
+        core.go, environment.Environment = self._saved
+
+
+class FakeEnvironment(object):
+    def __init__(self, args):
+        self.args = args
+
+
+def read_result(queue, event_name):
+    from pyrocko import guts
+    return guts.load(filename=queue.done_path(event_name))
+
+
+def test_work_failed():
+    from grond.jobqueue import work
+
+    with TempQueue() as path, FakeGo(failing=['ev2']) as go:
+        assert work(path, wait=False) == 2
+        assert go.calls == [('ev1', False), ('ev2', False)]
+
+        q = JobQueue(path)
+        assert read_result(q, 'ev1').ok
+        assert not read_result(q, 'ev2').ok
+
+
+def test_work_reclaimed():
+    from grond.jobqueue import work
+
+    with TempQueue() as path, FakeGo() as go:
+        q1 = JobQueue(path)
+        assert q1.claim('ev1')
+        assert not q1.was_reclaimed('ev1')
+
+        # worker died while processing ev1
+        make_stale(q1, 'ev1')
+
+        assert work(path, wait=False, stale_timeout=100.) == 2
+        assert go.calls == [('ev1', True), ('ev2', False)]
+        assert read_result(q1, 'ev1').ok
+
+
+def test_submit_force():
+    from grond.jobqueue import work
+
+    with TempQueue() as path, FakeGo() as go:
+        assert work(path, wait=False) == 2
+        assert work(path, wait=False) == 0
+
+        JobQueue.create(path, 'config.gronf', ['ev2'], force=True)
+        q = JobQueue(path)
+        assert q.get_status() == (['ev2'], [], ['ev1'])
+
+        assert work(path, wait=False) == 1
+        assert go.calls == [('ev1', False), ('ev2', False), ('ev2', True)]
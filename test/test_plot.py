@@ -0,0 +1,339 @@
+import os
+import shutil
+import tempfile
+import os.path as op
+
+import numpy as num
+
+import matplotlib
+matplotlib.use('Agg')
+
+from pyrocko.guts import Bool  # noqa
+from grond.meta import GrondError  # noqa
+from grond.plot.config import PlotConfig  # noqa
+from grond.plot.collection import PlotCollectionManager, PlotItem  # noqa
+
+g_made = []
+
+
+class DummyPlot(PlotConfig):
+    '''
+    Plot with a single empty figure, optionally failing before it is drawn.
+    '''
+
+    name = 'test_plot'
+    size_cm = (5., 5.)
+    fail = Bool.T(default=False)
+
+    def make(self, environ):
+        environ.get_plot_collection_manager().create_group_mpl(
+            self, self.draw_figures(), title='Test plot', section='test')
+
+    def draw_figures(self):
+        from matplotlib import pyplot as plt
+
+        if self.fail:
+            raise RuntimeError('plot %s failed' % self.variant)
+
+        g_made.append(self.variant)
+        fig = plt.figure()
+        yield PlotItem(name='fig_1'), fig
+
+
+class DummyEnvironment(object):
+    '''
+    Minimal environment as needed by :py:func:`grond.plot.make_plots`.
+    '''
+
+    def __init__(self):
+        self._manager = None
+
+    def set_plot_collection_manager(self, manager):
+        self._manager = manager
+
+    def get_plot_collection_manager(self):
+        return self._manager
+
+    def set_nprocs_modelling(self, nprocs):
+        pass
+
+
+class TempDir(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='grond-test-plots-')
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def get_index(path):
+    return PlotCollectionManager(path).get_group_refs()
+
+
+def group_exists(path, variant):
+    return op.exists(op.join(path, 'test_plot', variant))
+
+
+def make_test_plots(path, plots, nprocs, input_fingerprint=None):
+    from grond.plot import make_plots
+    from grond.plot.config import PlotConfigCollection
+
+    env = DummyEnvironment()
+    make_plots(
+        env,
+        plot_config_collection=PlotConfigCollection(plot_configs=plots),
+        plots_path=path,
+        nprocs=nprocs,
+        input_fingerprint=input_fingerprint)
+
+    return env.get_plot_collection_manager()
+
+
+def get_made(path, plots, input_fingerprint):
+    del g_made[:]
+    make_test_plots(path, plots, 1, input_fingerprint)
+    return sorted(g_made)
+
+
+def test_make_plots_parallel_failure():
+    with TempDir() as path:
+        make_test_plots(
+            path, [DummyPlot(variant=v) for v in 'abc'], nprocs=2)
+
+        assert sorted(get_index(path)) == [
+            ('test_plot', 'a'), ('test_plot', 'b'), ('test_plot', 'c')]
+
+        # the old files of b are removed before it fails, a and c are remade
+        try:
+            make_test_plots(path, [
+                DummyPlot(variant='a'),
+                DummyPlot(variant='b', fail=True),
+                DummyPlot(variant='c')], nprocs=2)
+
+            assert False, 'GrondError expected'
+
+        except GrondError as e:
+            assert 'plot b failed' in str(e)
+
+        assert sorted(get_index(path)) == [
+            ('test_plot', 'a'), ('test_plot', 'c')]
+
+        assert not group_exists(path, 'b')
+        for ref in get_index(path):
+            assert group_exists(path, ref[1])
+
+        assert os.listdir(op.join(path, 'test_plot', 'a'))
+
+
+def write_file(path, data, mode='w'):
+    with open(path, mode) as f:
+        f.write(data)
+
+
+def test_rundir_fingerprint():
+    from grond.report.base import rundir_fingerprint
+
+    with TempDir() as rundir:
+        os.mkdir(op.join(rundir, 'harvest'))
+        write_file(op.join(rundir, 'config.yaml'), 'config')
+        write_file(op.join(rundir, 'problem.yaml'), 'problem')
+        write_file(op.join(rundir, 'models'), 'x' * 100)
+        write_file(op.join(rundir, 'misfits'), 'y' * 100)
+
+        fps = [rundir_fingerprint(rundir, nbytes_tail=10)]
+        assert rundir_fingerprint(rundir, nbytes_tail=10) == fps[-1]
+
+        def changed():
+            fp = rundir_fingerprint(rundir, nbytes_tail=10)
+            isnew = fp not in fps
+            fps.append(fp)
+            return isnew
+
+        # history grows
+        write_file(op.join(rundir, 'models'), 'x', 'a')
+        assert changed()
+
+        # change within the tail, same size
+        write_file(op.join(rundir, 'misfits'), 'y' * 99 + 'z')
+        assert changed()
+
+        write_file(op.join(rundir, 'problem.yaml'), 'problem2')
+        assert changed()
+
+        write_file(op.join(rundir, 'harvest', 'models'), 'x')
+        assert changed()
+
+        write_file(op.join(rundir, 'run_info.yaml'), 'info')
+        assert changed()
+
+        # other files are ignored
+        write_file(op.join(rundir, 'log'), 'log')
+        assert not changed()
+
+
+def test_make_plots_fingerprint():
+    from grond.report.base import remove_stale_plot_groups
+    from grond.plot.config import PlotConfigCollection
+
+    with TempDir() as path:
+        plots = [DummyPlot(variant=v) for v in 'ab']
+        assert get_made(path, plots, 'fp1') == ['a', 'b']
+
+        # nothing changed
+        assert get_made(path, plots, 'fp1') == []
+
+        manager = PlotCollectionManager(path)
+        for plot in plots:
+            assert not manager.is_group_current(
+                (plot.name, plot.variant), 'fp1')
+
+        # changed inputs, e.g. a longer history
+        assert get_made(path, plots, 'fp2') == ['a', 'b']
+        assert get_made(path, plots, 'fp2') == []
+
+        # changed plot configuration
+        plots[1].font_size = 12.
+        assert get_made(path, plots, 'fp2') == ['b']
+        assert get_made(path, plots, 'fp2') == []
+
+        # incomplete group
+        for fn in os.listdir(op.join(path, 'test_plot', 'a')):
+            if fn.endswith('.png'):
+                os.unlink(op.join(path, 'test_plot', 'a', fn))
+
+        assert get_made(path, plots, 'fp2') == ['a']
+
+        # without fingerprint, all plots are made
+        assert get_made(path, plots, None) == ['a', 'b']
+        assert get_made(path, plots, 'fp2') == ['a', 'b']
+
+        # stale groups
+        assert get_made(path, plots + [DummyPlot(variant='c')], 'fp2') \
+            == ['c']
+
+        manager = make_test_plots(path, plots, 1, 'fp2')
+        remove_stale_plot_groups(
+            manager, PlotConfigCollection(plot_configs=plots))
+
+        assert sorted(get_index(path)) == [
+            ('test_plot', 'a'), ('test_plot', 'b')]
+
+        assert not group_exists(path, 'c')
+        assert group_exists(path, 'a')
+        assert get_made(path, plots, 'fp2') == []
+
+
+def test_histograms():
+    from grond.plot.density import histogram1d, histogram2d
+
+    rstate = num.random.RandomState(46)
+
+    # exactly representable edges, samples on the edges are binned as in
+    # numpy.histogram
+    xedges = num.linspace(-2., 2., 33)
+    yedges = num.linspace(0., 1., 9)
+    n = 10000
+    xs = rstate.normal(size=n)
+    ys = rstate.uniform(-0.1, 1.1, size=n)
+    xs[:200] = rstate.choice(xedges, size=200)
+    ys[100:300] = rstate.choice(yedges, size=200)
+    weights = rstate.uniform(0., 2., size=n)
+
+    for ws in (None, weights):
+        for nchunk in (1000000, 999, 1):
+            if nchunk == 1 and ws is None:
+                continue
+
+            counts_ref, _ = num.histogram(xs, xedges, weights=ws)
+            counts = histogram1d(xs, xedges, weights=ws, nchunk=nchunk)
+            num.testing.assert_allclose(counts, counts_ref, rtol=1e-12)
+
+            counts_ref, _, _ = num.histogram2d(
+                xs, ys, bins=[xedges, yedges], weights=ws)
+            counts = histogram2d(
+                xs, ys, xedges, yedges, weights=ws, nchunk=nchunk)
+            assert counts.shape == (32, 8)
+            num.testing.assert_allclose(counts, counts_ref, rtol=1e-12)
+
+    num.testing.assert_equal(
+        histogram1d(num.zeros(0), xedges), num.zeros(32))
+
+    # arbitrary edges
+    xedges = num.linspace(-1.3, 2.7, 31)
+    xs = rstate.normal(size=n)
+    num.testing.assert_allclose(
+        histogram1d(xs, xedges, weights=weights),
+        num.histogram(xs, xedges, weights=weights)[0], rtol=1e-12)
+
+
+def test_gaussian_kde_binned():
+    from scipy.stats import gaussian_kde
+    from grond.plot.density import gaussian_kde_binned
+
+    rstate = num.random.RandomState(46)
+    xs = num.concatenate([
+        rstate.normal(0., 1., size=700),
+        rstate.normal(5., 0.5, size=300)])
+
+    xs_eval = num.linspace(-4., 8., 500)
+
+    # few samples, to check the bias correction of the variance
+    for xs_ in (xs, xs[::50]):
+        for weights in (None, rstate.uniform(0., 1., size=xs_.size)):
+            pps_ref = gaussian_kde(xs_, weights=weights)(xs_eval)
+            pps = gaussian_kde_binned(xs_, xs_eval, weights=weights)
+            num.testing.assert_allclose(
+                pps, pps_ref, rtol=0., atol=1e-3 * num.max(pps_ref))
+
+    assert gaussian_kde_binned(num.zeros(0), xs_eval) is None
+    assert gaussian_kde_binned(num.ones(10), xs_eval) is None
+    assert gaussian_kde_binned(xs, xs_eval, weights=num.zeros(xs.size)) \
+        is None
+
+    weights = num.zeros(xs.size)
+    weights[10] = 1.
+    assert gaussian_kde_binned(xs, xs_eval, weights=weights) is None
+
+
+def test_model_weights():
+    from grond.plot.density import get_model_weights
+
+    rstate = num.random.RandomState(46)
+    nmodels = 101
+    gms = rstate.uniform(size=nmodels)
+
+    num.testing.assert_equal(
+        get_model_weights('uniform', gms=gms), num.ones(nmodels))
+
+    weights = get_model_weights('misfit_rank', gms=gms)
+    for imodel in range(nmodels):
+        nbetter = num.sum(gms < gms[imodel])
+        assert weights[imodel] == 1.0 - nbetter / (nmodels - 1)
+
+    assert weights[num.argmin(gms)] == 1.0
+    assert weights[num.argmax(gms)] == 0.0
+    num.testing.assert_equal(
+        get_model_weights('misfit_rank', gms=num.array([1.])), [1.])
+
+    # with 101 models, the 10 % quantile is the 11th best model of each chain
+    nbootstrap = 20
+    bootstrap_misfits = rstate.uniform(size=(nmodels, nbootstrap))
+    nmember = num.zeros(nmodels)
+    for ibootstrap in range(nbootstrap):
+        nmember[num.argsort(bootstrap_misfits[:, ibootstrap])[:11]] += 1
+
+    num.testing.assert_allclose(
+        get_model_weights('bootstrap', bootstrap_misfits=bootstrap_misfits),
+        nmember / nbootstrap, rtol=1e-12)
+
+    for kwargs in (
+            dict(weighting='bootstrap', gms=gms),
+            dict(weighting='nonsense', gms=gms)):
+
+        try:
+            get_model_weights(**kwargs)
+            assert False, 'GrondError expected'
+
+        except GrondError:
+            pass
@@ -1,4 +1,7 @@
 from __future__ import print_function
+import shutil
+import tempfile
+import os.path as op
 import nose.tools as t
 
 import numpy as num
@@ -7,6 +10,8 @@ from numpy.testing import assert_almost_equal as assert_ae
 from pyrocko import gf
 from grond.toy import scenario, ToyProblem
 
+km = 1e3
+
 
 def test_combine_misfits():
     source, targets = scenario('wellposed', 'noisefree')
@@ -78,3 +83,464 @@ def test_combine_misfits():
         assert_ae(gm_2_contrib[1, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 0, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 1, :], gm_contrib)
+
+
+def test_get_source_base_source_changed():
+    from pyrocko import moment_tensor as mtm
+    from grond.problems.cmt.problem import CMTProblem
+
+    ranges = dict(
+        time=gf.Range('-5 .. 5 | add'),
+        north_shift=gf.Range('-15e3 .. 15e3'),
+        east_shift=gf.Range('-15e3 .. 15e3'),
+        depth=gf.Range('2e3 .. 25e3'),
+        magnitude=gf.Range('5 .. 6'),
+        rmnn=gf.Range('-1.41421 .. 1.41421'),
+        rmee=gf.Range('-1.41421 .. 1.41421'),
+        rmdd=gf.Range('-1.41421 .. 1.41421'),
+        rmne=gf.Range('-1 .. 1'),
+        rmnd=gf.Range('-1 .. 1'),
+        rmed=gf.Range('-1 .. 1'),
+        duration=gf.Range('1. .. 5.'))
+
+    problem = CMTProblem(
+        name='cmt',
+        base_source=gf.MTSource(lat=10., lon=20., depth=10e3, time=1000.),
+        targets=[],
+        ranges=ranges)
+
+    x = num.array(problem.random_uniform(
+        problem.get_parameter_bounds(), num.random.RandomState(23)))
+
+    problem.get_source(x)
+
+    problem.base_source = gf.MTSource(
+        lat=11., lon=21., depth=12e3, time=1010.)
+
+    # packing as done before the source mapper was introduced
+    d = problem.get_parameter_dict(x)
+    m0 = mtm.magnitude_to_moment(d.magnitude)
+    p = dict(
+        (k, float(ranges[k].make_relative(problem.base_source[k], d[k])))
+        for k in problem.base_source.keys() if k in d)
+
+    source_ref = problem.base_source.clone(
+        m6=num.array([d.rmnn, d.rmee, d.rmdd, d.rmne, d.rmnd, d.rmed]) * m0,
+        stf=gf.HalfSinusoidSTF(duration=float(d.duration)),
+        **p)
+
+    source = problem.get_source(x)
+    for k in ('lat', 'lon', 'time', 'depth', 'north_shift', 'east_shift'):
+        assert_ae(getattr(source, k), getattr(source_ref, k))
+
+    assert_ae(source.m6, source_ref.m6)
+    assert_ae(source.stf.duration, source_ref.stf.duration)
+
+    sources = problem.get_sources(x[num.newaxis, :])
+    assert_ae(sources[0].time, source_ref.time)
+
+
+def test_preconstrain_many():
+    from pyrocko import moment_tensor as mtm
+    from grond.meta import Forbidden
+    from grond.problems.cmt.problem import CMTProblem
+    from grond.targets.waveform.target import WaveformMisfitTarget, \
+        WaveformMisfitConfig
+    from grond.optimisers.highscore.optimiser import UniformSamplerPhase
+
+    targets = [
+        WaveformMisfitTarget(
+            codes=('', 'S%i' % i, '', 'Z'),
+            lat=10. + 0.1 * i, lon=20. + 0.05 * i,
+            store_id='dummy', path='all',
+            misfit_config=WaveformMisfitConfig(fmin=0.01, fmax=0.1))
+        for i in range(5)]
+
+    ranges = dict(
+        time=gf.Range('-5 .. 5 | add'),
+        north_shift=gf.Range('-30e3 .. 30e3'),
+        east_shift=gf.Range('-30e3 .. 30e3'),
+        depth=gf.Range('2e3 .. 25e3'),
+        magnitude=gf.Range('5 .. 6'),
+        rmnn=gf.Range('-1.41421 .. 1.41421'),
+        rmee=gf.Range('-1.41421 .. 1.41421'),
+        rmdd=gf.Range('-1.41421 .. 1.41421'),
+        rmne=gf.Range('-1 .. 1'),
+        rmnd=gf.Range('-1 .. 1'),
+        rmed=gf.Range('-1 .. 1'),
+        duration=gf.Range('1. .. 5.'))
+
+    rstate = num.random.RandomState(23)
+    for mt_type in ('full', 'deviatoric'):
+        problem = CMTProblem(
+            name='cmt',
+            base_source=gf.MTSource(lat=10.2, lon=20.1, depth=10e3),
+            targets=targets,
+            ranges=ranges,
+            distance_min=15e3,
+            mt_type=mt_type)
+
+        xbounds = problem.get_parameter_bounds()
+        xs = num.array([
+            problem.random_uniform(xbounds, rstate) for _ in range(200)])
+
+        xs_new, ok = problem.preconstrain_many(xs)
+        assert 0 < num.sum(ok) < xs.shape[0]
+
+        for x, x_new, isok in zip(xs, xs_new, ok):
+            m9 = mtm.symmat6(*x_new[5:11])
+            if mt_type == 'deviatoric':
+                assert abs(num.trace(m9)) < 1e-12
+
+            assert_ae(num.sqrt(num.sum(num.asarray(m9)**2) / 2.), 1.0)
+
+            source = problem.get_source(x_new)
+            dmin = min(source.distance_to(t) for t in targets)
+            assert isok == (dmin >= problem.distance_min)
+
+            try:
+                assert_ae(problem.preconstrain(x), x_new)
+                assert isok
+            except Forbidden:
+                assert not isok
+
+        phase = UniformSamplerPhase(niterations=10, seed=1)
+        for iiter in range(10):
+            sample = phase.get_sample(problem, iiter, None)
+            problem.preconstrain(sample.model)
+
+
+def test_superposition_key_amplitude():
+    from grond.problems.superposition import get_impulse_component, \
+        get_moment_tensor_component
+
+    stf = gf.HalfSinusoidSTF(duration=2.)
+    source1 = gf.ExplosionSource(
+        lat=10., lon=20., depth=5e3, time=1001., volume_change=1e6, stf=stf)
+    source2 = source1.clone(time=1002., volume_change=-3e6)
+    source3 = source1.clone(depth=6e3)
+
+    c1, c2, c3 = [
+        get_impulse_component(source, 1000., amplitude='volume_change')
+        for source in (source1, source2, source3)]
+
+    assert c1.key == c2.key
+    assert c1.key != c3.key
+    assert_ae(c1.weights, [1e6])
+    assert_ae(c2.weights, [-3e6])
+    assert_ae(c2.tshift, 2.)
+    assert c2.make_sources()[0].volume_change == 1.0
+
+    source1 = gf.MTSource(
+        lat=10., lon=20., depth=5e3, time=1001., m6=num.arange(6.), stf=stf)
+    source2 = source1.clone(time=999., m6=-num.ones(6))
+    c1, c2 = [
+        get_moment_tensor_component(source, 1000.)
+        for source in (source1, source2)]
+
+    assert c1.key == c2.key
+    assert_ae(c2.weights, -num.ones(6))
+
+
+class TempEngine(object):
+    '''
+    Engine with a small synthetic GF store with travel-time tables.
+    '''
+
+    def __enter__(self):
+        from pyrocko import cake
+
+        self.path = tempfile.mkdtemp(prefix='grond-test-store-')
+        store_dir = op.join(self.path, 'test_problem')
+
+        mod = cake.LayeredModel.from_scanlines(cake.read_nd_model_str('''
+            0. 5.8 3.46 2.6 1264. 600.
+            20. 5.8 3.46 2.6 1264. 600.
+            20. 6.5 3.85 2.9 1283. 600.
+            35. 6.5 3.85 2.9 1283. 600.
+            mantle
+            35. 8.04 4.48 3.58 1449. 600.
+            300. 8.04 4.48 3.58 1449. 600.'''.lstrip()))
+
+        config = gf.ConfigTypeA(
+            id='test_problem',
+            ncomponents=10,
+            sample_rate=1.0,
+            receiver_depth=0.,
+            source_depth_min=0.,
+            source_depth_max=20*km,
+            source_depth_delta=5*km,
+            distance_min=0.,
+            distance_max=200*km,
+            distance_delta=10*km,
+            modelling_code_id='test',
+            earthmodel_1d=mod,
+            tabulated_phases=[
+                gf.TPDef(id='P', definition='p,P'),
+                gf.TPDef(id='S', definition='s,S'),
+                gf.TPDef(id='p_up', definition='p'),
+                gf.TPDef(id='P_down', definition='P'),
+                gf.TPDef(id='PmP', definition='Pv_(moho)p')])
+
+        gf.Store.create(store_dir, config=config)
+        store = gf.Store(store_dir, 'w')
+        t = num.arange(80, dtype=float)
+        for args in store.config.iter_nodes():
+            depth, distance, icomponent = args
+            data = (1.0 + icomponent) * (1.0 + distance / 1e5) \
+                * num.exp(-((t - 30. - icomponent) / 8.)**2)
+
+            store.put(args, gf.GFTrace(
+                data=data.astype(num.float32),
+                itmin=int(distance / 6000.),
+                deltat=1.0))
+
+        store.make_travel_time_tables()
+        store.close()
+        return gf.LocalEngine(store_dirs=[store_dir])
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def assert_timings_equal(times, times_ref):
+    times_ref = num.array(
+        [t if t is not None else num.nan for t in times_ref], dtype=float)
+
+    assert num.all(num.isnan(times) == num.isnan(times_ref))
+    assert_ae(times[num.isfinite(times)], times_ref[num.isfinite(times_ref)])
+
+
+def test_evaluate_timing_many():
+    from grond.problems.base import evaluate_timing_many, get_timing, \
+        TimingNotVectorisable
+
+    # Off the cell boundaries of the travel-time tables, where pyrocko's
+    # scalar and vectorised interpolation may pick different cells.
+    rstate = num.random.RandomState(23)
+    depths = rstate.uniform(0., 20*km, 500)
+    distances = rstate.uniform(0., 200*km, 500)
+
+    with TempEngine() as engine:
+        store = engine.get_store('test_problem')
+        for timing in (
+                'stored:P',
+                '{stored:PmP}-5',
+                '{stored:p_up|stored:P_down}',
+                '{stored:P_down|stored:p_up}+3',
+                'first{stored:p_up|stored:P_down}',
+                'last{stored:p_up|stored:P_down}-2',
+                'first{stored:PmP|stored:S}'):
+
+            times = evaluate_timing_many(
+                store, get_timing(timing), (depths, distances))
+
+            assert num.any(num.isfinite(times))
+            assert_timings_equal(times, [
+                store.t(timing, (depth, distance))
+                for (depth, distance) in zip(depths, distances)])
+
+        for timing in (
+                '{stored:P}-10%',
+                '{stored:P}-0.1S',
+                '{vel_surface:5}',
+                '{stored:P|vel_surface:5}',
+                '100'):
+
+            try:
+                evaluate_timing_many(
+                    store, get_timing(timing), (depths, distances))
+
+                assert False, 'TimingNotVectorisable expected'
+
+            except TimingNotVectorisable:
+                pass
+
+
+def get_waveform_targets(timings):
+    from grond.targets.waveform.target import WaveformMisfitTarget, \
+        WaveformMisfitConfig
+
+    targets = []
+    for i in range(12):
+        tmin, tmax, tpick = timings[i % len(timings)]
+        targets.append(WaveformMisfitTarget(
+            codes=('', 'S%i' % i, '', 'ZNE'[i % 3]),
+            lat=10.,
+            lon=20. + 0.15 * i,
+            store_id='test_problem',
+            path='all',
+            misfit_config=WaveformMisfitConfig(
+                fmin=0.01, fmax=0.1, tmin=tmin, tmax=tmax,
+                pick_synthetic_traveltime=tpick,
+                pick_phasename='P' if tpick else None)))
+
+    return targets
+
+
+def test_waveform_timings():
+    from grond.dataset import Dataset
+    from grond.problems.base import TimingGroup
+    from grond.problems.cmt.problem import CMTProblem
+
+    timings = [
+        ('{stored:P}-10', '{stored:S}+20', '{stored:P}'),
+        ('first{stored:p_up|stored:P_down}-5', 'last{stored:PmP|stored:S}',
+         None),
+        # not vectorisable, evaluated per target
+        ('{stored:P}-10%', '{vel_surface:3}+10', '{stored:P}-0.1S')]
+
+    targets = get_waveform_targets(timings)
+    ds = Dataset('ev1')
+    for target in targets:
+        target.set_dataset(ds)
+
+    problem = CMTProblem(
+        name='cmt',
+        base_source=gf.MTSource(
+            name='ev1', lat=10., lon=20.3, depth=7*km, time=1000.),
+        targets=targets,
+        ranges={})
+
+    rstate = num.random.RandomState(23)
+    with TempEngine() as engine:
+        problem.set_engine(engine)
+        kinds = set()
+        for kind, group in problem.get_timing_groups():
+            assert isinstance(group, TimingGroup)
+            kinds.add(kind)
+
+        assert kinds == set(['tmin', 'tmax', 'tpick'])
+
+        for isource in range(5):
+            source = problem.base_source.clone(
+                time=1000. + rstate.uniform(-5., 5.),
+                north_shift=rstate.uniform(-10*km, 10*km),
+                east_shift=rstate.uniform(-10*km, 10*km),
+                depth=rstate.uniform(1*km, 19*km))
+
+            tmins, tmaxs, tpicks = problem.get_waveform_timings(source)
+
+            for i, target in enumerate(targets):
+                tmin, tmax, tfade, tfade_taper = target.get_taper_params(
+                    engine, source)
+                tobs, tsyn = target.get_pick_shift(engine, source)
+
+                assert_ae(tmins[i], tmin)
+                assert_ae(tmaxs[i], tmax)
+                if tsyn is None:
+                    assert num.isnan(tpicks[i])
+                else:
+                    assert_ae(tpicks[i], tsyn)
+
+            # precomputed timings are used by the targets
+            problem.prepare_waveform_timings(source)
+            for i, target in enumerate(targets):
+                tmin, tmax, _, _ = target.get_taper_params(engine, source)
+                _, tsyn = target.get_pick_shift(engine, source)
+                assert tmin == tmins[i]
+                assert tmax == tmaxs[i]
+                if tsyn is not None:
+                    assert tsyn == tpicks[i]
+
+
+def get_synthetic_cmt_problem(engine):
+    from pyrocko import model, moment_tensor as mtm
+    from grond.dataset import Dataset
+    from grond.synthetic_tests import SyntheticTest
+    from grond.problems.cmt.problem import CMTProblem
+    from grond.targets.waveform_oac.target import WOACTarget
+
+    targets = get_waveform_targets([('{stored:P}-10', '{stored:S}+20', None)])
+    ds = Dataset('ev1')
+    ds.add_events([model.Event(
+        name='ev1', lat=10., lon=20.3, depth=7*km, time=1000.)])
+    ds.add_stations([
+        model.Station('', target.codes[1], '', lat=target.lat, lon=target.lon)
+        for target in targets])
+
+    for target in targets:
+        target.set_dataset(ds)
+
+    targets.append(WOACTarget(path='woac', associated_path='all'))
+
+    ranges = dict(
+        time=gf.Range('-5 .. 5 | add'),
+        north_shift=gf.Range('-15e3 .. 15e3'),
+        east_shift=gf.Range('-15e3 .. 15e3'),
+        depth=gf.Range('2e3 .. 18e3'),
+        magnitude=gf.Range('5 .. 6'),
+        rmnn=gf.Range('-1.41421 .. 1.41421'),
+        rmee=gf.Range('-1.41421 .. 1.41421'),
+        rmdd=gf.Range('-1.41421 .. 1.41421'),
+        rmne=gf.Range('-1 .. 1'),
+        rmnd=gf.Range('-1 .. 1'),
+        rmed=gf.Range('-1 .. 1'),
+        duration=gf.Range('1. .. 5.'))
+
+    problem = CMTProblem(
+        name='cmt',
+        base_source=gf.MTSource(
+            name='ev1', lat=10., lon=20.3, depth=7*km, time=1000.,
+            m6=mtm.MomentTensor(
+                strike=30., dip=60., rake=80., magnitude=5.5).m6(),
+            stf=gf.HalfSinusoidSTF(duration=2.)),
+        targets=targets,
+        ranges=ranges)
+
+    problem.set_engine(engine)
+
+    synthetic_test = SyntheticTest()
+    synthetic_test.set_problem(problem)
+    ds.set_synthetic_test(synthetic_test)
+
+    return problem
+
+
+def test_modelling_plan_cache():
+    rstate = num.random.RandomState(23)
+    with TempEngine() as engine:
+        problem = get_synthetic_cmt_problem(engine)
+        xbounds = problem.get_parameter_bounds()
+
+        ntargets = len(problem.targets)
+        masks = [None] + [
+            rstate.uniform(size=ntargets) < 0.6 for _ in range(3)]
+
+        for mask in masks:
+            if mask is not None:
+                # with the WOAC target
+                mask[-1] = True
+
+        for x in [
+                num.array(problem.random_uniform(xbounds, rstate))
+                for _ in range(3)]:
+
+            for mask in masks + masks:
+                misfits = problem.misfits(x, mask=mask)
+                assert num.sum(num.isfinite(misfits[:, 0])) == (
+                    ntargets if mask is None else num.sum(mask))
+
+                # new plan
+                misfits_ref = problem.copy().misfits(x, mask=mask)
+                num.testing.assert_equal(misfits, misfits_ref)
+
+        # changed targets
+        x = num.array(problem.random_uniform(xbounds, rstate))
+        problem.misfits(x)
+        targets_all = problem.targets
+        for targets in (
+                targets_all[3:],
+                targets_all[:-1:2] + targets_all[-1:]):
+
+            problem.targets = targets
+            misfits = problem.misfits(x)
+            assert misfits.shape == (len(targets), 2)
+            assert num.all(num.isfinite(misfits))
+
+            # new plan for the given targets
+            results = problem.evaluate(
+                x, targets=list(targets), result_mode='sparse')
+
+            num.testing.assert_equal(
+                misfits, num.vstack([result.misfits for result in results]))
@@ -0,0 +1,173 @@
+import shutil
+import tempfile
+import os.path as op
+
+import numpy as num
+
+from pyrocko import gf
+from grond.problems.superposition import SuperpositionCache, \
+    get_impulse_component, get_moment_tensor_component, \
+    process_superposition
+
+km = 1e3
+
+
+class TempEngine(object):
+    '''
+    Engine with a small synthetic GF store with smooth traces.
+    '''
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='grond-test-store-')
+        store_dir = op.join(self.path, 'test_superposition')
+        config = gf.ConfigTypeA(
+            id='test_superposition',
+            ncomponents=10,
+            sample_rate=1.0,
+            receiver_depth=0.,
+            source_depth_min=0.,
+            source_depth_max=20*km,
+            source_depth_delta=5*km,
+            distance_min=0.,
+            distance_max=200*km,
+            distance_delta=10*km,
+            modelling_code_id='test')
+
+        gf.Store.create(store_dir, config=config)
+        store = gf.Store(store_dir, 'w')
+        t = num.arange(80, dtype=float)
+        for args in store.config.iter_nodes():
+            depth, distance, icomponent = args
+            data = (1.0 + icomponent) * (1.0 + distance / 1e5) \
+                * num.exp(-((t - 30. - icomponent) / 8.)**2) \
+                + 0.2 * icomponent * (1.0 + num.tanh((t - 44.) / 6.))
+
+            store.put(args, gf.GFTrace(
+                data=data.astype(num.float32),
+                itmin=int(distance / 6000.),
+                deltat=1.0))
+
+        store.close()
+        return gf.LocalEngine(store_dirs=[store_dir])
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+def get_targets():
+    return [
+        gf.Target(
+            codes=('', 'S%i' % i, '', c),
+            lat=10.3,
+            lon=20.2 + i*0.3,
+            store_id='test_superposition',
+            interpolation='multilinear')
+        for i in range(3) for c in 'ZNE']
+
+
+def compare_superposition(engine, targets, source, tref, tolerance):
+    results_ref = engine.process(source, targets).results_list[0]
+    for component in (
+            get_impulse_component(source, tref),
+            get_moment_tensor_component(source, tref)):
+
+        results = process_superposition(
+            SuperpositionCache(), engine, source, targets, [component])
+
+        for result_ref, result in zip(results_ref, results):
+            tr_ref = result_ref.trace.pyrocko_trace()
+            tr = result.trace.pyrocko_trace()
+
+            # composed trace must cover the engine's trace, extending it
+            # with its end values
+            assert tr.tmin <= tr_ref.tmin + 1e-6
+            assert tr.tmax >= tr_ref.tmax - 1e-6
+            assert abs(tr.ydata[0] - tr_ref.ydata[0]) \
+                <= tolerance * num.max(num.abs(tr_ref.ydata))
+            assert abs(tr.ydata[-1] - tr_ref.ydata[-1]) \
+                <= tolerance * num.max(num.abs(tr_ref.ydata))
+
+            ydata = num.interp(
+                tr_ref.get_xdata(), tr.get_xdata(), tr.get_ydata())
+
+            error = num.max(num.abs(ydata - tr_ref.ydata)) \
+                / num.max(num.abs(tr_ref.ydata))
+
+            assert error < tolerance, \
+                'time shift %g s, STF %s: relative error %g' % (
+                    source.time - tref, source.stf, error)
+
+
+def test_superposition_integer_shift():
+    targets = get_targets()
+    tref = 100.
+    with TempEngine() as engine:
+        for tshift in (0., -3., 5.):
+            source = gf.MTSource(
+                lat=10., lon=20., depth=7*km, time=tref + tshift,
+                m6=[1., -2., 0.5, 0.3, -0.7, 1.1])
+
+            compare_superposition(engine, targets, source, tref, 1e-5)
+
+
+def test_superposition_time_stf():
+    targets = get_targets()
+    tref = 100.
+    with TempEngine() as engine:
+        for tshift in (0., 0.37, -2.6, 3.5):
+            for duration, anchor in (
+                    (0., 0.), (2.5, 0.), (3.3, -1.), (1.2, 1.)):
+
+                stf = gf.HalfSinusoidSTF(duration=duration, anchor=anchor) \
+                    if duration else None
+
+                source = gf.MTSource(
+                    lat=10., lon=20., depth=7*km, time=tref + tshift,
+                    m6=[1., -2., 0.5, 0.3, -0.7, 1.1], stf=stf)
+
+                # The engine interpolates fractional time shifts linearly
+                # and integrates the STF over the sample intervals, so the
+                # results differ by discretisation errors of about 1% for
+                # these smooth traces.
+                compare_superposition(engine, targets, source, tref, 2e-2)
+
+
+def test_superposition_components():
+    targets = get_targets()
+    tref = 100.
+    with TempEngine() as engine:
+        sources = [
+            gf.MTSource(
+                lat=10., lon=20., depth=7*km, time=tref - 4.4,
+                m6=[1., -2., 0.5, 0.3, -0.7, 1.1],
+                stf=gf.HalfSinusoidSTF(duration=2.)),
+            gf.MTSource(
+                lat=10., lon=20., depth=7*km, time=tref + 6.2,
+                m6=[-0.5, 0.5, 0., 1.2, 0.4, -0.3],
+                stf=gf.HalfSinusoidSTF(duration=3.))]
+
+        results_ref = [
+            engine.process(source, targets).results_list[0]
+            for source in sources]
+
+        components = [
+            get_moment_tensor_component(source, tref) for source in sources]
+
+        results = process_superposition(
+            SuperpositionCache(), engine, sources[0], targets, components)
+
+        for results_ref_target, result in zip(zip(*results_ref), results):
+            tr = result.trace.pyrocko_trace()
+            tr_ref = None
+            for result_ref in results_ref_target:
+                tr_ref_part = result_ref.trace.pyrocko_trace()
+                ydata = num.interp(
+                    tr.get_xdata(),
+                    tr_ref_part.get_xdata(), tr_ref_part.get_ydata())
+
+                tr_ref = ydata if tr_ref is None else tr_ref + ydata
+
+            error = num.max(num.abs(tr.ydata - tr_ref)) \
+                / num.max(num.abs(tr_ref))
+
+            assert error < 2e-2
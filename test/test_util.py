@@ -17,3 +17,155 @@ def test_nanmedian():
     for iy in range(a.shape[0]):
         b = a[iy, :]
         assert meta.nanmedian(b) == res[iy]
+
+
+def test_allocate_threads():
+    from grond.scheduler import allocate_threads
+
+    nthreads = allocate_threads(8, {0: 10., 1: 1., 2: 1.})
+    assert sum(nthreads.values()) == 8
+    assert nthreads[0] > nthreads[1] >= 1 and nthreads[2] >= 1
+
+    assert allocate_threads(2, {0: 1., 1: 1., 2: 1.}) == {0: 1, 1: 1, 2: 1}
+    assert allocate_threads(4, {}) == {}
+
+
+def _process_event_or_fail(ievent, ifail, thread_budget=None):
+    if ievent == ifail:
+        raise ValueError('event %i failed' % ievent)
+
+
+def _process_event_return_ok(ievent, ifail, thread_budget=None):
+    return ievent != ifail
+
+
+def test_scheduler_failed_event():
+    from grond.meta import GrondError
+    from grond.scheduler import EventScheduler
+
+    scheduler = EventScheduler(
+        2, ['ev0', 'ev1', 'ev2'], [1., 2., 1.], poll_interval=0.05)
+
+    try:
+        scheduler.run(_process_event_or_fail, (1,))
+        assert False, 'GrondError expected'
+
+    except GrondError as e:
+        assert 'ev1' in str(e) and 'event 1 failed' in str(e)
+        assert 'ev0' not in str(e) and 'ev2' not in str(e)
+
+    assert [s.failed for s in scheduler.stats] == [False, True, False]
+    assert all(s.cpu_time is not None for s in scheduler.stats)
+
+    scheduler = EventScheduler(
+        2, ['ev0', 'ev1', 'ev2'], [1., 2., 1.], poll_interval=0.05)
+    scheduler.run(_process_event_or_fail, (None,))
+    assert not any(s.failed for s in scheduler.stats)
+
+    # failures reported by return value, as by core.process_event
+    scheduler = EventScheduler(
+        2, ['ev0', 'ev1'], [1., 1.], poll_interval=0.05)
+
+    try:
+        scheduler.run(_process_event_return_ok, (0,))
+        assert False, 'GrondError expected'
+
+    except GrondError as e:
+        assert 'ev0' in str(e) and 'ev1' not in str(e)
+
+
+def _process_event_with_cost(ievent, path, thread_budget=None):
+    import time
+    import os.path as op
+
+    thread_budget.set_cost([3., 1.][ievent])
+    time.sleep(0.5)
+    with open(op.join(path, str(ievent)), 'w') as f:
+        f.write(str(thread_budget.get()))
+
+
+def test_scheduler_update_cost():
+    import shutil
+    import tempfile
+    import os.path as op
+    from grond.scheduler import EventScheduler
+
+    path = tempfile.mkdtemp(prefix='grond-test-scheduler-')
+    try:
+        scheduler = EventScheduler(4, ['ev0', 'ev1'], poll_interval=0.05)
+        scheduler.run(_process_event_with_cost, (path,))
+        assert [s.cost for s in scheduler.stats] == [3., 1.]
+
+        nthreads = []
+        for ievent in range(2):
+            with open(op.join(path, str(ievent))) as f:
+                nthreads.append(int(f.read()))
+
+        assert nthreads == [3, 1]
+
+    finally:
+        shutil.rmtree(path)
+
+
+def test_lazy_import():
+    import sys
+    import subprocess
+
+    code = '''
+import sys
+import grond
+assert grond.__version__
+assert 'grond.core' not in sys.modules
+assert 'pyrocko.gf' not in sys.modules
+
+grond.read_config
+assert 'grond.core' not in sys.modules
+assert 'matplotlib.pyplot' not in sys.modules
+assert grond.GrondError is grond.meta.GrondError
+'''
+
+    subprocess.check_call([sys.executable, '-c', code])
+
+    code = '''
+from grond import *
+import grond.meta
+assert GrondError is grond.meta.GrondError
+assert read_config is grond.config.read_config
+assert Problem is grond.problems.base.Problem
+assert CMTProblemConfig is grond.problems.cmt.problem.CMTProblemConfig
+assert HighScoreOptimiser
+assert Environment
+'''
+
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_timing_recorder():
+    from grond import timing
+
+    recorder = timing.TimingRecorder()
+    recorder_old = timing.set_recorder(recorder)
+    try:
+        for iiter in range(3):
+            recorder.start_iteration()
+            with timing.timed('engine'):
+                pass
+
+            recorder.add('history', 0.01)
+            recorder.add('history', 0.01)
+            recorder.end_iteration()
+
+    finally:
+        timing.set_recorder(recorder_old)
+
+    timings = timing.RunTimings.load(string=recorder.get_timings().dump())
+    assert timings.niterations == 3
+
+    history = timings.get_phase('history')
+    assert history.count == 3
+    assert abs(history.mean - 0.02) < 1e-9
+    edges = timings.get_bin_edges()
+    ibin = num.searchsorted(edges, 0.02) - 1
+    assert history.histogram[ibin] == 3
+    assert sum(timings.get_phase('engine').histogram) == 3
+    assert timings.summary().startswith('Time per iteration:')